@@ -3,17 +3,36 @@
 AI-powered NPC Generator using Ollama
 Extends the main NPC generator with AI-generated content
 """
+import collections
 import json
 import random
 import re
+import threading
+import time
 import requests
 from dotenv import load_dotenv
 import os
+from npc_profiling import timed
 
 # Load environment variables
 load_dotenv()
 OLLAMA_URL = os.getenv('OLLAMA_URL', 'http://localhost:11434')
 OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', 'llama3')
+# How long Ollama keeps the model loaded after each request: a duration like
+# '30m' or '1h', seconds, or -1 to keep it loaded until Ollama stops
+OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+# Seconds between KeepAlivePinger pings (default: half the keep-alive)
+OLLAMA_PING_INTERVAL = os.getenv('OLLAMA_PING_INTERVAL')
+# Send fixed instructions as a chat system message (/api/chat); turn off for
+# Ollama versions without the chat endpoint
+OLLAMA_USE_CHAT = os.getenv('OLLAMA_USE_CHAT', 'true').lower() not in ('0', 'false', 'no')
+# Longest wait for an answer, used until there's enough latency history to
+# adapt it (see CircuitBreaker)
+OLLAMA_TIMEOUT = float(os.getenv('OLLAMA_TIMEOUT', '180'))
+# Failures in a row before AI calls stop and procedural generation takes
+# over, and seconds before the backend is tried again
+OLLAMA_FAILURE_THRESHOLD = int(os.getenv('OLLAMA_FAILURE_THRESHOLD', '3'))
+OLLAMA_RETRY_AFTER = float(os.getenv('OLLAMA_RETRY_AFTER', '30'))
 
 # --------------------------------------------------------------------------- #
 #  Helper: Extract the first balanced JSON object from a string
@@ -36,41 +55,327 @@ def extract_json_from_response(text: str):
     except json.JSONDecodeError as exc:
         raise ValueError(f"Malformed JSON: {exc}") from exc
 
+# --------------------------------------------------------------------------- #
+#  Token and latency accounting
+# --------------------------------------------------------------------------- #
+# A model load longer than this means Ollama had to load it (a cold start)
+COLD_LOAD_MS = 500
+
+# Usage of the most recent query_ollama call (see call_usage), or None
+last_usage = None
+# Every call made in this run, for session_usage()
+_session_calls = []
+
+
+def call_usage(result, model, wall_time):
+    """
+    The token counts and timings Ollama reports with a response, in
+    milliseconds. Ollama reports durations in nanoseconds and leaves out
+    counts it didn't measure (e.g. prompt_eval_count for a cached prompt).
+    """
+    def ms(key):
+        return round(result.get(key, 0) / 1e6, 2)
+
+    return {
+        "model": result.get("model", model),
+        "prompt_tokens": result.get("prompt_eval_count", 0),
+        "completion_tokens": result.get("eval_count", 0),
+        "load_ms": ms("load_duration"),
+        "prompt_ms": ms("prompt_eval_duration"),
+        "eval_ms": ms("eval_duration"),
+        "total_ms": ms("total_duration"),
+        "wall_ms": round(wall_time * 1000, 2)
+    }
+
+
+def usage_stats(usages):
+    """
+    Per-model throughput from usage records (as stored in each AI NPC's
+    'ai_usage'). A record shared by a batch of NPCs carries batch_size and
+    is counted once per batch, not once per NPC.
+    Returns {model: {calls, prompt_tokens, completion_tokens, prompt/completion
+    tokens per second, mean/max load time, cold_loads, mean latency}}.
+    """
+    totals = {}
+    for usage in usages:
+        share = 1 / usage.get("batch_size", 1)
+        model = totals.setdefault(usage["model"], {
+            "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "load_ms": 0, "max_load_ms": 0,
+            "prompt_ms": 0, "eval_ms": 0, "wall_ms": 0, "cold_loads": 0})
+        model["calls"] += share
+        for key in ["prompt_tokens", "completion_tokens", "load_ms", "prompt_ms", "eval_ms", "wall_ms"]:
+            model[key] += usage[key] * share
+        model["max_load_ms"] = max(model["max_load_ms"], usage["load_ms"])
+        model["cold_loads"] += share * (usage["load_ms"] >= COLD_LOAD_MS)
+
+    stats = {}
+    for name, model in totals.items():
+        calls = round(model["calls"]) or 1
+        stats[name] = {
+            "calls": calls,
+            "prompt_tokens": round(model["prompt_tokens"]),
+            "completion_tokens": round(model["completion_tokens"]),
+            "prompt_tokens_per_s": model["prompt_tokens"] / model["prompt_ms"] * 1000 if model["prompt_ms"] else None,
+            "completion_tokens_per_s": (model["completion_tokens"] / model["eval_ms"] * 1000
+                                        if model["eval_ms"] else None),
+            "mean_load_ms": model["load_ms"] / calls,
+            "max_load_ms": model["max_load_ms"],
+            "cold_loads": round(model["cold_loads"]),
+            "mean_latency_ms": model["wall_ms"] / calls
+        }
+    return stats
+
+
+def session_usage():
+    """usage_stats() for every call made in this run"""
+    return usage_stats(_session_calls)
+
+
+def describe_usage(usage):
+    """One line summing up a call's usage"""
+    line = f"{usage['prompt_tokens']} prompt + {usage['completion_tokens']} completion tokens"
+    if usage["eval_ms"]:
+        line += f", {usage['completion_tokens'] / usage['eval_ms'] * 1000:.1f} tokens/s"
+    line += f", {usage['wall_ms'] / 1000:.2f} s"
+    if usage["load_ms"] >= COLD_LOAD_MS:
+        line += f" (model load {usage['load_ms'] / 1000:.2f} s)"
+    return line
+
+
+# --------------------------------------------------------------------------- #
+#  Circuit breaker
+# --------------------------------------------------------------------------- #
+class CircuitBreaker:
+    """
+    Stops calling a backend that keeps failing, so a dead or overloaded
+    Ollama costs one quick check per NPC instead of a long timeout.
+    - closed: calls go through; failure_threshold failures in a row open it
+    - open: calls are refused straight away (callers fall back to
+      procedural generation) until retry_after seconds have passed
+    - half-open: one probe call goes through; success closes the breaker,
+      failure opens it again
+    Read timeouts adapt to the backend: timeout_factor times the 95th
+    percentile of recent successful calls, between min_timeout and
+    max_timeout (max_timeout until min_samples calls have succeeded).
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(self, failure_threshold=None, retry_after=None, max_timeout=None, min_timeout=10.0,
+                 timeout_factor=3.0, min_samples=5, window=50):
+        self.failure_threshold = failure_threshold or OLLAMA_FAILURE_THRESHOLD
+        self.retry_after = OLLAMA_RETRY_AFTER if retry_after is None else retry_after
+        self.max_timeout = max_timeout or OLLAMA_TIMEOUT
+        self.min_timeout = min(min_timeout, self.max_timeout)
+        self.timeout_factor = timeout_factor
+        self.min_samples = min_samples
+        self.latencies = collections.deque(maxlen=window)
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go ahead now (moves open -> half-open when it's time to probe)"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.retry_after:
+                self.state = self.HALF_OPEN
+                return True  # This call is the probe
+            return False
+
+    def timeout(self):
+        """Read timeout for the next call, from recent latencies"""
+        with self._lock:
+            if len(self.latencies) < self.min_samples:
+                return self.max_timeout
+            ordered = sorted(self.latencies)
+            p95 = ordered[int(0.95 * (len(ordered) - 1))]
+        return min(self.max_timeout, max(self.min_timeout, p95 * self.timeout_factor))
+
+    def record_success(self, latency):
+        with self._lock:
+            self.latencies.append(latency)
+            self.failures = 0
+            self.state = self.CLOSED
+
+    def record_failure(self):
+        """Count a failed call; returns True if this opened the breaker"""
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                tripped = self.state != self.OPEN
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.trips += tripped
+                return tripped
+            return False
+
+
+# One breaker per model (a missing or broken model shouldn't block the others)
+_breakers = {}
+
+
+def breaker_for(model=None):
+    model = model or OLLAMA_MODEL
+    if model not in _breakers:
+        _breakers[model] = CircuitBreaker()
+    return _breakers[model]
+
+
+# --------------------------------------------------------------------------- #
+#  Keeping the model loaded
+# --------------------------------------------------------------------------- #
+def keep_alive_value(keep_alive=None):
+    """OLLAMA_KEEP_ALIVE as Ollama wants it: a number of seconds, or a duration string"""
+    value = str(OLLAMA_KEEP_ALIVE if keep_alive is None else keep_alive).strip()
+    return int(value) if value.lstrip("-").isdigit() else value
+
+
+def keep_alive_seconds(keep_alive=None):
+    """The keep-alive in seconds (None if the model is kept loaded forever)"""
+    value = keep_alive_value(keep_alive)
+    if isinstance(value, int):
+        return None if value < 0 else value
+    units = {"s": 1, "m": 60, "h": 3600}
+    total = 0
+    for amount, unit in re.findall(r"(\d+(?:\.\d+)?)([smh])", value):
+        total += float(amount) * units[unit]
+    return total or None
+
+
+@timed("ollama.warmup")
+def warm_up_model(model=None, keep_alive=None):
+    """
+    Load the model into memory without generating anything (a request with
+    no prompt), so the first real generation doesn't pay for the load.
+    Returns the seconds Ollama spent loading it (close to 0 if it was
+    already loaded), or None if Ollama couldn't be reached.
+    """
+    try:
+        response = requests.post(f"{OLLAMA_URL}/api/generate", timeout=300, json={
+            "model": model or OLLAMA_MODEL, "keep_alive": keep_alive_value(keep_alive)})
+        response.raise_for_status()
+        return response.json().get("load_duration", 0) / 1e9
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Error warming up {model or OLLAMA_MODEL}: {e}")
+        return None
+
+
+class KeepAlivePinger:
+    """
+    Keeps the model loaded during a long session by re-sending the warm-up
+    request in a background thread before the keep-alive runs out:
+        with KeepAlivePinger():
+            ...generate NPCs...
+    """
+
+    def __init__(self, model=None, interval=None, keep_alive=None):
+        self.model = model
+        self.keep_alive = keep_alive
+        if interval is None and OLLAMA_PING_INTERVAL:
+            interval = float(OLLAMA_PING_INTERVAL)
+        if interval is None:
+            seconds = keep_alive_seconds(keep_alive)
+            interval = seconds / 2 if seconds else None  # Kept loaded forever - nothing to do
+        self.interval = interval
+        self.pings = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if warm_up_model(self.model, self.keep_alive) is not None:
+                self.pings += 1
+
+    def start(self):
+        if self.interval and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ollama-keep-alive", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
+
+
 # --------------------------------------------------------------------------- #
 #  Core functions
 # --------------------------------------------------------------------------- #
-def query_ollama(prompt, model=None):
-    """Send a query to Ollama and return the response"""
+@timed("ollama.query")
+def query_ollama(prompt, model=None, format=None, options=None, system=None):
+    """
+    Send a query to Ollama and return the response
+    format: 'json' to make the model answer with valid JSON only
+    options: model options, e.g. {"num_predict": 200} to cap output tokens
+    system: fixed instructions, sent as the system message of a chat
+    request so the server can cache them across calls (with
+    OLLAMA_USE_CHAT off, they are put in front of the prompt instead)
+    The call's token counts and timings are left in last_usage.
+    Returns None straight away while the model's circuit breaker is open.
+    """
+    global last_usage
+    last_usage = None
     if not model:
         model = OLLAMA_MODEL
-
-    url = f"{OLLAMA_URL}/api/generate"
+    breaker = breaker_for(model)
+    if not breaker.allow():
+        return None
 
     payload = {
         "model": model,
-        "prompt": prompt,
-        "stream": False
+        "stream": False,
+        "keep_alive": keep_alive_value()
     }
+    if system and OLLAMA_USE_CHAT:
+        url = f"{OLLAMA_URL}/api/chat"
+        payload["messages"] = [{"role": "system", "content": system}, {"role": "user", "content": prompt}]
+    else:
+        url = f"{OLLAMA_URL}/api/generate"
+        payload["prompt"] = f"{system}\n\n{prompt}" if system else prompt
+    if format:
+        payload["format"] = format
+    if options:
+        payload["options"] = options
 
     try:
-        response = requests.post(url, json=payload, timeout=180)
+        start = time.perf_counter()
+        # Connecting should be quick even when generating is slow
+        response = requests.post(url, json=payload, timeout=(min(10, breaker.max_timeout), breaker.timeout()))
         response.raise_for_status()
 
         result = response.json()
+        elapsed = time.perf_counter() - start
+        breaker.record_success(elapsed)
+        last_usage = call_usage(result, model, elapsed)
+        _session_calls.append(last_usage)
+        if "message" in result:
+            return result["message"].get("content", "")
         return result.get('response', '')
 
     except requests.exceptions.RequestException as e:
         print(f"Error connecting to Ollama: {e}")
-        return None
     except json.JSONDecodeError as e:
         print(f"Error parsing Ollama response: {e}")
-        return None
+    if breaker.record_failure():
+        print(f"⚡ {model} keeps failing - using regular generation for the next {breaker.retry_after:g} s")
+    return None
 
 
-def generate_ai_npc_prompt(job_filter=None, gender_filter=None, challenge_rating=None, group_context=None):
-    """Generate a detailed prompt for AI NPC creation"""
-
-    base_prompt = """You are an expert D&D 5th Edition (2024) Dungeon Master creating a unique NPC. Generate a complete NPC with creative, engaging details that fit the D&D fantasy setting.
+# The fixed instructions for a full AI NPC. They go in the system message and
+# never change between requests, so Ollama can reuse its evaluation of them
+# (the prompt cache) and only evaluate the short per-NPC request each time.
+NPC_SYSTEM_PROMPT = """You are an expert D&D 5th Edition (2024) Dungeon Master creating a unique NPC. Generate a complete NPC with creative, engaging details that fit the D&D fantasy setting.
 Return your response as valid JSON with exactly this structure:
 {
     "name": "First Last",
@@ -99,6 +404,14 @@ Requirements:
 - Aside from species, use the supplied data like names as idea starts, but be creative
 - Be creative, characters must be complex and deep"""
 
+
+def generate_ai_npc_prompt(job_filter=None, gender_filter=None, challenge_rating=None, group_context=None):
+    """
+    The variable part of the prompt: what this particular NPC must be.
+    The instructions and JSON structure are in NPC_SYSTEM_PROMPT.
+    """
+    prompt = "Create a new NPC."
+
     # Add specific constraints based on arguments
     constraints = []
 
@@ -147,11 +460,12 @@ Requirements:
                     constraints.append(f"- Should share the motivation: {value}")
 
     if constraints:
-        base_prompt += "\n\nSpecific requirements for this NPC:\n" + "\n".join(constraints)
+        prompt += "\n\nSpecific requirements for this NPC:\n" + "\n".join(constraints)
 
-    return base_prompt
+    return prompt
 
 
+@timed("ai.parse")
 def parse_ai_npc_response(response_text):
     """Parse the AI response and convert it to the expected NPC format"""
     try:
@@ -191,8 +505,24 @@ def parse_ai_npc_response(response_text):
         return None
 
 
-def generate_ai_npc(job_filter=None, gender_filter=None, challenge_rating=None, shared_traits=None):
-    """Generate an NPC using AI with the same interface as the regular generator"""
+def generate_ai_npc(job_filter=None, gender_filter=None, challenge_rating=None, shared_traits=None, fallback=True,
+                    name_allocator=None, lazy_stats=False):
+    """
+    Generate an NPC using AI with the same interface as the regular generator
+    fallback: if the AI fails (or its circuit breaker is open), return a
+    regular generate_npc NPC instead of None
+    name_allocator: optional NameAllocator - fallback NPCs get unique names
+    from it, and names the AI picks are marked as taken
+    lazy_stats: give the NPC a lazy stat block (see generate_npc)
+    """
+
+    def regular_npc():
+        if not fallback:
+            return None
+        from npc_generator import generate_npc
+        return generate_npc(job_filter=job_filter, gender_filter=gender_filter, shared_traits=shared_traits,
+                            challenge_rating=challenge_rating, name_allocator=name_allocator,
+                            lazy_stats=lazy_stats)
 
     # Prepare group context if shared traits are provided
     group_context = None
@@ -207,18 +537,25 @@ def generate_ai_npc(job_filter=None, gender_filter=None, challenge_rating=None,
 
     # Query the AI
     print("🤖 Generating AI-powered NPC... (this may take a moment)")
-    response = query_ollama(prompt)
+    response = query_ollama(prompt, system=NPC_SYSTEM_PROMPT)
 
     if not response:
-        print("Failed to get response from AI. Falling back to regular generation.")
-        return None
+        if breaker_for().state == CircuitBreaker.OPEN:
+            print("AI is unavailable right now. Using regular generation.")
+        else:
+            print("Failed to get response from AI. Falling back to regular generation.")
+        return regular_npc()
+
+    usage = last_usage
+    print(f"🤖 {describe_usage(usage)}")
 
     # Parse the response
     ai_npc = parse_ai_npc_response(response)
 
     if not ai_npc:
         print("Failed to parse AI response. Falling back to regular generation.")
-        return None
+        return regular_npc()
+    ai_npc["ai_usage"] = usage
 
     # Apply shared traits if provided (override AI choices where necessary)
     if shared_traits:
@@ -240,8 +577,15 @@ def generate_ai_npc(job_filter=None, gender_filter=None, challenge_rating=None,
                 ai_npc["class"] = random.choice(JOBS[shared_traits["class_category"]])
                 ai_npc["class_category"] = shared_traits["class_category"]
 
+    if name_allocator is not None:
+        name_allocator.reserve(ai_npc["name"])
+
     # Generate stat block if challenge rating is provided
-    if challenge_rating:
+    if challenge_rating and lazy_stats:
+        from npc_generator import CR_STAT_TEMPLATES, lazy_stat_block
+        if challenge_rating in CR_STAT_TEMPLATES:
+            ai_npc["stat_block"] = lazy_stat_block(challenge_rating)
+    elif challenge_rating:
         from npc_generator import generate_stat_block
         stat_block = generate_stat_block(ai_npc, challenge_rating)
         if stat_block:
@@ -250,8 +594,9 @@ def generate_ai_npc(job_filter=None, gender_filter=None, challenge_rating=None,
     return ai_npc
 
 
-def generate_ai_group(group_type, count, job_filter=None, challenge_rating=None):
-    """Generate a group of AI NPCs with shared traits"""
+def generate_ai_group(group_type, count, job_filter=None, challenge_rating=None, name_allocator=None,
+                      lazy_stats=False):
+    """Generate a group of AI NPCs with shared traits (name_allocator, lazy_stats: see generate_ai_npc)"""
     from npc_generator import GROUP_TYPES
 
     if group_type not in GROUP_TYPES:
@@ -262,7 +607,8 @@ def generate_ai_group(group_type, count, job_filter=None, challenge_rating=None)
 
     # Generate the first NPC to establish shared traits
     print(f"🤖 Generating AI-powered {group_info['name']} ({count} members)...")
-    first_npc = generate_ai_npc(job_filter=job_filter, challenge_rating=challenge_rating)
+    first_npc = generate_ai_npc(job_filter=job_filter, challenge_rating=challenge_rating,
+                                name_allocator=name_allocator, lazy_stats=lazy_stats)
 
     if not first_npc:
         print("Failed to generate first AI NPC. Cannot create group.")
@@ -297,7 +643,8 @@ def generate_ai_group(group_type, count, job_filter=None, challenge_rating=None)
         relationship = random.choice(available_relationships)
         used_relationships.append(relationship)
 
-        npc = generate_ai_npc(job_filter=job_filter, shared_traits=shared_traits, challenge_rating=challenge_rating)
+        npc = generate_ai_npc(job_filter=job_filter, shared_traits=shared_traits, challenge_rating=challenge_rating,
+                              name_allocator=name_allocator, lazy_stats=lazy_stats)
 
         if not npc:
             print(f"Failed to generate AI NPC {i + 2}. Skipping...")
@@ -312,6 +659,195 @@ def generate_ai_group(group_type, count, job_filter=None, challenge_rating=None)
     }
 
 
+# --------------------------------------------------------------------------- #
+#  Hybrid mode: procedural NPCs, AI-written narrative fields only
+# --------------------------------------------------------------------------- #
+# The fields worth a model's time - everything else generate_npc picks from
+# its tables in microseconds
+HYBRID_FIELDS = ["personality", "speech_pattern", "motivation", "secret"]
+HYBRID_FIELD_DESCRIPTIONS = {
+    "personality": "a memorable personality trait",
+    "speech_pattern": "how they speak",
+    "motivation": "what drives them right now",
+    "secret": "something they hide"
+}
+# NPCs described in one prompt
+HYBRID_BATCH_SIZE = 8
+# Output token budget per NPC: four one-sentence fields plus JSON punctuation
+HYBRID_TOKENS_PER_NPC = 120
+
+
+def npc_summary(npc):
+    """One line describing an NPC's procedural skeleton, for hybrid prompts"""
+    summary = f"{npc['name']}, {npc['gender'].lower()} {npc['species']} {npc['class']}"
+    if "relationship" in npc:
+        summary += f" ({npc['relationship']})"
+    if "stat_block" in npc:
+        summary += f", CR {npc['stat_block']['challenge_rating']}"
+    return summary + f"; {npc['build']}, {npc['distinctive_feature']}"
+
+
+def hybrid_system_prompt(fields=HYBRID_FIELDS):
+    """The fixed instructions for hybrid requests (the same for every batch asking for these fields)"""
+    wanted = ", ".join(f'"{field}" ({HYBRID_FIELD_DESCRIPTIONS[field]})' for field in fields)
+    example = ", ".join(f'"{field}": "..."' for field in fields)
+    return (f"You are a D&D 5e Dungeon Master. For each NPC you are given, write {wanted}: one vivid, "
+            f"original sentence each that fits who they are.\n"
+            f'Reply with JSON only, one object per NPC in order: {{"npcs": [{{{example}}}]}}')
+
+
+def generate_hybrid_prompt(npcs, group_context=None):
+    """
+    The variable part of a hybrid request: a numbered line per NPC whose
+    other details are already decided
+    """
+    prompt = f"They are all {group_context}.\n" if group_context else ""
+    return prompt + "\n".join(f"{i}. {npc_summary(npc)}" for i, npc in enumerate(npcs, 1))
+
+
+def _first_json_value(text):
+    """The first JSON object or array in text (nested ones included)"""
+    decoder = json.JSONDecoder()
+    for match in re.finditer(r"[{\[]", text):
+        try:
+            return decoder.raw_decode(text, match.start())[0]
+        except json.JSONDecodeError:
+            continue
+    raise ValueError("No JSON found in the response.")
+
+
+@timed("ai.parse")
+def parse_hybrid_response(response_text, count, fields=HYBRID_FIELDS):
+    """
+    The narrative fields for each of `count` NPCs, in order, as a list of
+    dicts. NPCs the model skipped (or fields it got wrong) get an empty
+    dict, so they keep their procedural values.
+    """
+    try:
+        data = _first_json_value(response_text)
+    except ValueError as e:
+        print(f"Error extracting JSON: {e}")
+        return [{} for _ in range(count)]
+    if isinstance(data, dict):
+        # {"npcs": [...]} as asked, or any key holding the list, or one bare NPC
+        data = next((value for value in data.values() if isinstance(value, list)), [data])
+    results = []
+    for item in list(data)[:count]:
+        item = item if isinstance(item, dict) else {}
+        results.append({field: item[field].strip() for field in fields
+                        if isinstance(item.get(field), str) and item[field].strip()})
+    return results + [{} for _ in range(count - len(results))]
+
+
+@timed("ai.hybrid")
+def enrich_npcs(npcs, fields=HYBRID_FIELDS, batch_size=HYBRID_BATCH_SIZE, group_context=None):
+    """
+    Replace the narrative fields of already-generated NPCs with AI-written
+    ones, batch_size NPCs per request. NPCs the model doesn't answer for
+    keep their procedural values. Returns how many NPCs were enriched.
+    """
+    enriched = 0
+    for start in range(0, len(npcs), batch_size):
+        batch = npcs[start:start + batch_size]
+        response = query_ollama(generate_hybrid_prompt(batch, group_context), format="json",
+                                options={"num_predict": HYBRID_TOKENS_PER_NPC * len(batch)},
+                                system=hybrid_system_prompt(fields))
+        if not response:
+            continue
+        usage = dict(last_usage, batch_size=len(batch)) if len(batch) > 1 else last_usage
+        for npc, values in zip(batch, parse_hybrid_response(response, len(batch), fields)):
+            npc.update(values)
+            npc["ai_usage"] = usage
+            enriched += bool(values)
+    return enriched
+
+
+def shared_fields(members, fields=HYBRID_FIELDS):
+    """Narrative fields a group's members all have in common (e.g. a crew's motivation)"""
+    if len(members) < 2:
+        return {}
+    return {field: members[0][field] for field in fields
+            if all(member[field] == members[0][field] for member in members)}
+
+
+def generate_hybrid_npc(job_filter=None, gender_filter=None, challenge_rating=None, name_allocator=None):
+    """
+    A procedural NPC whose personality, speech, motivation and secret are
+    written by the AI. Falls back to the procedural text if the AI fails,
+    so this always returns an NPC.
+    """
+    from npc_generator import generate_npc
+
+    npc = generate_npc(job_filter=job_filter, gender_filter=gender_filter, challenge_rating=challenge_rating,
+                       name_allocator=name_allocator)
+    return add_ai_flavor(npc)
+
+
+def add_ai_flavor(npc):
+    """Have the AI rewrite a generated NPC's narrative fields (in place); returns the NPC"""
+    print("🤖 Adding AI flavor...")
+    if not enrich_npcs([npc]):
+        print("AI enrichment failed - keeping the generated details.")
+    return npc
+
+
+def generate_hybrid_group(group_type, count, job_filter=None, challenge_rating=None, name_allocator=None):
+    """
+    A procedural group whose members get AI-written narrative fields, all
+    in one request. Fields the group shares (like a crew's motivation) are
+    kept and given to the model as context instead.
+    """
+    from npc_generator import generate_group
+
+    group = generate_group(group_type, count, job_filter, challenge_rating, name_allocator=name_allocator)
+    return add_ai_flavor_to_group(group)
+
+
+def add_ai_flavor_to_group(group):
+    """add_ai_flavor for every member of a generated group, in one request"""
+    print(f"🤖 Adding AI flavor to {len(group['members'])} members...")
+    enrich_group(group, batch_size=max(HYBRID_BATCH_SIZE, len(group["members"])))
+    return group
+
+
+def enrich_group(group, batch_size=HYBRID_BATCH_SIZE):
+    """enrich_npcs for a group's members, leaving the fields they share alone"""
+    shared = shared_fields(group["members"])
+    context = f"members of the same {group['type'].lower()}"
+    if shared:
+        context += " who share " + "; ".join(f"{field.replace('_', ' ')}: {value}"
+                                             for field, value in shared.items())
+    fields = [field for field in HYBRID_FIELDS if field not in shared]
+    if not fields:
+        return 0
+    return enrich_npcs(group["members"], fields, batch_size, context)
+
+
+def enrich_items(items, batch_size=HYBRID_BATCH_SIZE):
+    """
+    Enrich a stream of (npc, group_info) pairs (e.g. a settlement) on the
+    way to the collection. Individuals are batched together, batch_size
+    per request; each group is enriched in its own requests.
+    """
+    pending = []
+
+    def flush():
+        if pending:
+            enrich_npcs([npc for npc, _ in pending], batch_size=batch_size)
+        yield from pending
+        pending.clear()
+
+    for npc, group_info in items:
+        if group_info:
+            enrich_group(group_info, batch_size)
+            yield npc, group_info
+        else:
+            pending.append((npc, group_info))
+            if len(pending) >= batch_size:
+                yield from flush()
+    yield from flush()
+
+
 def test_ollama_connection():
     """Test if Ollama is accessible and the model is available"""
     try:
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the D&D NPC Generator
+Times NPC/group/stat block generation, collection storage at several
+collection sizes, the --view listing, AI response parsing and the full AI
+path against a local stub Ollama server. Results are printed as a table
+and can be written to a JSON file to compare versions.
+
+Usage:
+    python3 benchmark_npc_generator.py
+    python3 benchmark_npc_generator.py --sizes 1000,10000 --output bench.json
+    python3 benchmark_npc_generator.py --only generation --ai-latency 0.2
+"""
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import npc_generator
+import npc_storage
+from ollama_stub_server import RECORDED_RESPONSES, start_stub_server
+
+
+# --------------------------------------------------------------------------- #
+#  Timing helpers
+# --------------------------------------------------------------------------- #
+def time_calls(function, iterations):
+    """Call function() iterations times and return the per-call durations in seconds"""
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def summarize(name, durations, **params):
+    """Turn raw durations into one result record"""
+    ordered = sorted(durations)
+    total = sum(durations)
+    return {
+        "name": name,
+        "params": params,
+        "iterations": len(durations),
+        "total_s": total,
+        "mean_ms": statistics.mean(durations) * 1000,
+        "median_ms": statistics.median(durations) * 1000,
+        "min_ms": ordered[0] * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "ops_per_sec": len(durations) / total if total else None
+    }
+
+
+def benchmark(name, function, iterations, **params):
+    """Time a function and return its result record"""
+    return summarize(name, time_calls(function, iterations), **params)
+
+
+@contextlib.contextmanager
+def quiet():
+    """Swallow everything printed inside the block"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+@contextlib.contextmanager
+def collection_directory(path):
+    """Point npc_storage at a different collection directory for a while"""
+    names = ["NPC_DATA_DIR", "NPC_DATA_FILE", "NPC_LOCK_FILE"]
+    saved = {name: getattr(npc_storage, name) for name in names}
+    npc_storage.NPC_DATA_DIR = path
+    npc_storage.NPC_DATA_FILE = os.path.join(path, "npcs.json")
+    npc_storage.NPC_LOCK_FILE = os.path.join(path, "npcs.lock")
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(npc_storage, name, value)
+
+
+def build_collection(size, group_every=10):
+    """A synthetic collection with size entries (every tenth one a group)"""
+    entries = []
+    next_id = 1
+    items = []
+    for i in range(size):
+        if i % group_every == 0:
+            items.append((None, npc_generator.generate_group("family", 3)))
+        else:
+            items.append((npc_generator.generate_npc(challenge_rating=random.choice(["0", "1", "5"])), None))
+    timestamp = "2025-01-01T12:00:00"
+    for npc, group_info in items:
+        entry = npc_storage.build_collection_entry(npc, group_info, next_id, timestamp)
+        next_id += 1 + len(entry.get("members", []))
+        entries.append(entry)
+    return {"npcs": entries, "next_id": next_id}
+
+
+# --------------------------------------------------------------------------- #
+#  Benchmark groups
+# --------------------------------------------------------------------------- #
+def bench_generation(iterations):
+    """NPC, group and stat block generation"""
+    npc = npc_generator.generate_npc(job_filter="guard")
+    return [
+        benchmark("generate_npc", npc_generator.generate_npc, iterations),
+        benchmark("generate_npc", lambda: npc_generator.generate_npc(challenge_rating="5"),
+                  iterations, challenge_rating="5"),
+        benchmark("generate_npc", lambda: npc_generator.generate_npc(challenge_rating="5", lazy_stats=True),
+                  iterations, challenge_rating="5", lazy_stats=True),
+        benchmark("generate_group", lambda: npc_generator.generate_group("family", 4),
+                  max(1, iterations // 4), group_type="family", count=4),
+        benchmark("generate_group", lambda: npc_generator.generate_group("crew", 6, challenge_rating="2"),
+                  max(1, iterations // 6), group_type="crew", count=6, challenge_rating="2"),
+        benchmark("generate_stat_block", lambda: npc_generator.generate_stat_block(npc, "1/4"),
+                  iterations, challenge_rating="1/4"),
+        benchmark("generate_stat_block", lambda: npc_generator.generate_stat_block(npc, "15"),
+                  iterations, challenge_rating="15"),
+        benchmark("generate_stat_block", lambda: npc_generator.generate_stat_block(npc, "30"),
+                  iterations, challenge_rating="30"),
+    ]
+
+
+def bench_storage(sizes, iterations):
+    """Saving and viewing NPCs at several collection sizes"""
+    results = []
+    for size in sizes:
+        directory = tempfile.mkdtemp(prefix="npc-bench-")
+        try:
+            with collection_directory(directory), quiet():
+                collection = build_collection(size)
+                npc_storage.save_npc_collection(collection)
+                del collection
+                # Build the sidecar index up front so it isn't part of the timings
+                from npc_index import open_index
+                open_index().close()
+
+                # Big collections rewrite a lot of JSON per save - keep the run short
+                adds = max(1, min(iterations, 20000 // size))
+                results.append(benchmark(
+                    "add_npc_to_collection",
+                    lambda: npc_storage.add_npc_to_collection(npc_generator.generate_npc()),
+                    adds, collection_size=size))
+                results.append(benchmark("load_npc_collection", npc_storage.load_npc_collection,
+                                         adds, collection_size=size))
+
+                views = [
+                    ("first page", {}),
+                    ("first page, job filter", {"filter_job": "guard"}),
+                    ("newest page, species filter", {"filter_species": "Elf", "sort": "newest"}),
+                    ("everything", {"limit": 0}),
+                ]
+                for label, kwargs in views:
+                    results.append(benchmark("view_npc_collection",
+                                             lambda: npc_generator.view_npc_collection(**kwargs),
+                                             adds, collection_size=size, view=label))
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def bench_rendering(count):
+    """
+    Dumping `count` NPCs to a line-buffered file (like a terminal or pipe):
+    one print per line, the way display_npc used to work, against rendering
+    each NPC to one string and writing in large chunks
+    """
+    from npc_render import render_npc, write_buffered
+    npcs = [npc_generator.generate_npc(challenge_rating=random.choice([None, "1", "5"])) for _ in range(count)]
+    results = []
+    with open(os.devnull, 'w', buffering=1) as out:
+        def print_lines():
+            for npc in npcs:
+                for line in render_npc(npc, "plain").splitlines():
+                    print(line, file=out)
+
+        results.append(benchmark("render", print_lines, 3, npcs=count, output="print per line"))
+        for style in ["plain", "markdown", "ansi"]:
+            results.append(benchmark("render", lambda: write_buffered((render_npc(npc, style) for npc in npcs), out),
+                                     3, npcs=count, output="buffered", style=style))
+    return results
+
+
+def bench_parsing(iterations):
+    """Pulling NPC JSON out of recorded model responses"""
+    from ai_npc_generator import extract_json_from_response, parse_ai_npc_response
+
+    def parse_all():
+        for text in RECORDED_RESPONSES:
+            try:
+                extract_json_from_response(text)
+            except ValueError:
+                pass
+
+    def parse_npcs():
+        with quiet():
+            for text in RECORDED_RESPONSES:
+                parse_ai_npc_response(text)
+
+    return [
+        benchmark("extract_json_from_response", parse_all, iterations,
+                  responses=len(RECORDED_RESPONSES)),
+        benchmark("parse_ai_npc_response", parse_npcs, iterations,
+                  responses=len(RECORDED_RESPONSES)),
+    ]
+
+
+def bench_prompt_eval(ai_npc_generator, iterations, layout, **params):
+    """
+    generate_ai_npc with a different job each call, recording the prompt
+    tokens and time the server spent evaluating each prompt
+    layout: "single" - the layout from before the instructions moved to a
+    system message: instructions and this NPC's requirements as one
+    /api/generate prompt; "generate" - the split prompt with
+    OLLAMA_USE_CHAT off; "chat" - system and user chat messages
+    """
+    saved_chat = ai_npc_generator.OLLAMA_USE_CHAT
+    saved_query = ai_npc_generator.query_ollama
+    ai_npc_generator.OLLAMA_USE_CHAT = layout == "chat"
+    if layout == "single":
+        def query_single_prompt(prompt, system=None, **kwargs):
+            if system:
+                prompt = system + prompt.replace("Create a new NPC.", "", 1)
+            return saved_query(prompt, **kwargs)
+        ai_npc_generator.query_ollama = query_single_prompt
+    jobs = itertools.cycle(npc_generator.JOBS)
+    usages = []
+
+    def generate():
+        ai_npc_generator.generate_ai_npc(job_filter=next(jobs), challenge_rating="1")
+        usages.append(ai_npc_generator.last_usage)
+
+    try:
+        generate()  # The first call always evaluates the whole prompt
+        usages.clear()
+        result = benchmark(f"prompt_eval_{layout}", generate, iterations, **params)
+    finally:
+        ai_npc_generator.OLLAMA_USE_CHAT = saved_chat
+        ai_npc_generator.query_ollama = saved_query
+    usages = [usage for usage in usages if usage]
+    if usages:
+        result["params"]["prompt_tokens"] = round(statistics.mean(u["prompt_tokens"] for u in usages), 1)
+        result["params"]["prompt_eval_ms"] = round(statistics.mean(u["prompt_ms"] for u in usages), 2)
+    return result
+
+
+def bench_ai(iterations, latency, ollama_url=None):
+    """
+    generate_ai_npc, generate_ai_group, the hybrid path and prompt
+    evaluation, against a local stub server - or a real Ollama server if
+    ollama_url is given
+    """
+    import ai_npc_generator
+
+    server = None
+    if ollama_url:
+        params = {"server": ollama_url}
+    else:
+        server = start_stub_server(latency=latency, models=[ai_npc_generator.OLLAMA_MODEL])
+        ollama_url = server.url
+        params = {"stub_latency_s": latency}
+
+    saved_url = ai_npc_generator.OLLAMA_URL
+    ai_npc_generator.OLLAMA_URL = ollama_url
+    try:
+        with quiet():
+            return [
+                benchmark("generate_ai_npc",
+                          lambda: ai_npc_generator.generate_ai_npc(job_filter="innkeeper", challenge_rating="1"),
+                          iterations, **params),
+                benchmark("generate_ai_group",
+                          lambda: ai_npc_generator.generate_ai_group("crew", 4),
+                          max(1, iterations // 4), count=4, **params),
+                benchmark("generate_hybrid_npc",
+                          lambda: ai_npc_generator.generate_hybrid_npc(job_filter="innkeeper", challenge_rating="1"),
+                          iterations, **params),
+                benchmark("generate_hybrid_group",
+                          lambda: ai_npc_generator.generate_hybrid_group("crew", 4),
+                          max(1, iterations // 4), count=4, **params),
+                benchmark("enrich_npcs",
+                          lambda: ai_npc_generator.enrich_npcs([npc_generator.generate_npc() for _ in range(32)]),
+                          max(1, iterations // 4), count=32, batch_size=ai_npc_generator.HYBRID_BATCH_SIZE,
+                          **params),
+                # Instructions in front of the prompt vs. in a chat system message
+                bench_prompt_eval(ai_npc_generator, iterations, "single", **params),
+                bench_prompt_eval(ai_npc_generator, iterations, "generate", **params),
+                bench_prompt_eval(ai_npc_generator, iterations, "chat", **params),
+            ]
+    finally:
+        ai_npc_generator.OLLAMA_URL = saved_url
+        if server:
+            server.shutdown()
+            server.server_close()
+
+
+# --------------------------------------------------------------------------- #
+#  Reporting
+# --------------------------------------------------------------------------- #
+def environment_info():
+    """Where and on what the benchmarks ran, for comparing result files"""
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                         stderr=subprocess.DEVNULL, text=True,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")
+    }
+
+
+def print_results(results):
+    """Human readable table of results"""
+    print(f"{'benchmark':<28} {'params':<52} {'mean ms':>10} {'p95 ms':>10} {'ops/s':>10}")
+    print("-" * 114)
+    for result in results:
+        params = ", ".join(f"{key}={value}" for key, value in result["params"].items())
+        ops = f"{result['ops_per_sec']:.1f}" if result["ops_per_sec"] else "-"
+        print(f"{result['name']:<28} {params[:52]:<52} {result['mean_ms']:>10.3f} "
+              f"{result['p95_ms']:>10.3f} {ops:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the D&D NPC Generator')
+    parser.add_argument('--only', choices=['generation', 'storage', 'rendering', 'parsing', 'ai'], action='append',
+                        help='Run only these benchmark groups (repeatable)')
+    parser.add_argument('--iterations', '-n', type=int, default=200,
+                        help='Iterations per benchmark (default: 200)')
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='Collection sizes for storage benchmarks (default: 1000,10000,100000)')
+    parser.add_argument('--render-count', type=int, default=10000,
+                        help='NPCs dumped by the rendering benchmark (default: 10000)')
+    parser.add_argument('--ai-latency', type=float, default=0.05,
+                        help='Seconds the stub Ollama server waits per request (default: 0.05)')
+    parser.add_argument('--ollama-url', metavar='URL',
+                        help='Run the AI benchmarks against this Ollama server instead of the stub')
+    parser.add_argument('--seed', type=int, default=1234,
+                        help='Random seed so runs generate the same NPCs (default: 1234)')
+    parser.add_argument('--output', '-o', metavar='FILE',
+                        help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    groups = args.only or ['generation', 'storage', 'rendering', 'parsing', 'ai']
+    results = []
+
+    if 'generation' in groups:
+        results += bench_generation(args.iterations)
+    if 'storage' in groups:
+        sizes = [int(size) for size in args.sizes.split(',') if size]
+        results += bench_storage(sizes, args.iterations)
+    if 'rendering' in groups:
+        results += bench_rendering(args.render_count)
+    if 'parsing' in groups or 'ai' in groups:
+        try:
+            if 'parsing' in groups:
+                results += bench_parsing(args.iterations)
+            if 'ai' in groups:
+                results += bench_ai(max(1, args.iterations // 20), args.ai_latency, args.ollama_url)
+        except ImportError as e:
+            print(f"Skipping AI benchmarks - dependencies not available: {e}")
+
+    print_results(results)
+
+    if args.output:
+        report = {"environment": environment_info(), "seed": args.seed, "results": results}
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
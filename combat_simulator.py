@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Monte Carlo combat simulator
+Pits a generated stat block against a reference party of four player
+characters thousands of times, to check whether NPCs really play like
+their Challenge Rating. Uses NumPy to run all the fights at once when it
+is installed, and plain Python otherwise.
+
+Usage:
+    python3 combat_simulator.py
+    python3 combat_simulator.py --crs 1/2,1,2 --jobs guard,criminal --fights 5000
+"""
+
+import argparse
+import functools
+import json
+import random
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from dice import DiceExpression, parse_damage
+from npc_generator import CLASS_MODIFIERS, CR_STAT_TEMPLATES, generate_npc
+
+# How long a fight may last before we call it a draw
+MAX_ROUNDS = 50
+
+
+@functools.lru_cache(maxsize=None)
+def parse_attack_bonus(text):
+    """'+5' -> ('attack', 5); 'DC 13' -> ('save', 13)"""
+    text = text.strip()
+    if text.upper().startswith("DC"):
+        return "save", int(text[2:])
+    return "attack", int(text)
+
+
+# An attack boiled down to what the simulator needs
+CompiledAttack = namedtuple("CompiledAttack", ["kind", "bonus", "dice"])
+
+
+def compile_attacks(stat_block):
+    """Turn every attack in a stat block into a CompiledAttack, once, up front"""
+    compiled = []
+    for attack in stat_block["attacks"]:
+        if "damage_dice" in attack:
+            dice = DiceExpression.from_dict(attack["damage_dice"])
+        else:
+            # Stat blocks saved before damage was stored as dice - read the text
+            dice, _ = parse_damage(attack["damage"])
+        compiled.append(CompiledAttack(*parse_attack_bonus(attack["attack_bonus"]), dice))
+    return compiled
+
+
+def reference_character(level):
+    """
+    A rough average player character of the given level:
+    AC, hit points, attack bonus, attacks per round, damage dice and Dex save
+    """
+    proficiency = 2 + (level - 1) // 4
+    ability = 3 + (level >= 4) + (level >= 8)
+    attacks = 1 + (level >= 5) + (level >= 11)
+    return {
+        "level": level,
+        "armor_class": 14 + (level - 1) // 4,
+        "hit_points": 10 + 7 * (level - 1),
+        "attack_bonus": proficiency + ability,
+        "attacks": attacks,
+        "damage": DiceExpression([(1, 8)], ability),
+        "dex_save": 2 + (proficiency if level >= 9 else 0)
+    }
+
+
+def cr_to_party_level(cr):
+    """The level of a party of four that a creature of this CR should challenge"""
+    if "/" in cr:
+        return 1
+    return max(1, min(20, int(cr)))
+
+
+# --------------------------------------------------------------------------- #
+#  Simulation
+# --------------------------------------------------------------------------- #
+def _simulate_numpy(npc_hp, npc_ac, npc_attacks, party, fights, rng):
+    """Run every fight at once: each array has one row per fight"""
+    size = len(party)
+    pc_ac = np.array([pc["armor_class"] for pc in party])
+    pc_save = np.array([pc["dex_save"] for pc in party])
+    pc_hp = np.tile(np.array([pc["hit_points"] for pc in party], dtype=np.int64), (fights, 1))
+    hp = np.full(fights, npc_hp, dtype=np.int64)
+    rounds = np.zeros(fights, dtype=np.int64)
+    damage_dealt = np.zeros(fights, dtype=np.int64)
+    ongoing = np.ones(fights, dtype=bool)
+
+    def roll(dice, n, crit=None):
+        return np.maximum(dice.roll_array(n, rng, critical=crit), 0)
+
+    for round_number in range(1, MAX_ROUNDS + 1):
+        active = np.flatnonzero(ongoing)
+        if active.size == 0:
+            break
+        n = active.size
+        rounds[active] = round_number
+
+        # The party attacks the NPC
+        pc_alive = pc_hp[active] > 0
+        party_damage = np.zeros(n, dtype=np.int64)
+        for i, pc in enumerate(party):
+            for _ in range(pc["attacks"]):
+                d20 = rng.integers(1, 21, size=n)
+                hit = ((d20 == 20) | ((d20 != 1) & (d20 + pc["attack_bonus"] >= npc_ac))) & pc_alive[:, i]
+                party_damage += np.where(hit, roll(pc["damage"], n, crit=d20 == 20), 0)
+
+        # The NPC attacks the first party member still standing
+        target = np.argmax(pc_alive, axis=1)
+        npc_damage = np.zeros(n, dtype=np.int64)
+        for attack in npc_attacks:
+            d20 = rng.integers(1, 21, size=n)
+            if attack.kind == "save":
+                hit = d20 + pc_save[target] < attack.bonus
+                npc_damage += np.where(hit, roll(attack.dice, n), 0)
+            else:
+                hit = (d20 == 20) | ((d20 != 1) & (d20 + attack.bonus >= pc_ac[target]))
+                npc_damage += np.where(hit, roll(attack.dice, n, crit=d20 == 20), 0)
+
+        # Both sides' damage lands at the end of the round
+        hp[active] -= party_damage
+        pc_hp[active, target] -= npc_damage
+        damage_dealt[active] += npc_damage
+
+        npc_down = hp[active] <= 0
+        party_down = ~(pc_hp[active] > 0).any(axis=1)
+        ongoing[active[npc_down | party_down]] = False
+
+    npc_won = (hp > 0) & ~(pc_hp > 0).any(axis=1)
+    npc_died = hp <= 0
+    return npc_won.tolist(), npc_died.tolist(), rounds.tolist(), damage_dealt.tolist()
+
+
+def _simulate_python(npc_hp, npc_ac, npc_attacks, party, fights, rng):
+    """Same fights as _simulate_numpy, one at a time"""
+    def roll(dice, crit=False):
+        return max(0, dice.roll(rng, critical=crit))
+
+    wins, deaths, all_rounds, all_damage = [], [], [], []
+    for _ in range(fights):
+        hp = npc_hp
+        pc_hp = [pc["hit_points"] for pc in party]
+        damage_dealt = 0
+        rounds = 0
+        while rounds < MAX_ROUNDS and hp > 0 and any(h > 0 for h in pc_hp):
+            rounds += 1
+            party_damage = 0
+            for pc, pc_current in zip(party, pc_hp):
+                if pc_current <= 0:
+                    continue
+                for _ in range(pc["attacks"]):
+                    d20 = rng.randint(1, 20)
+                    if d20 == 20 or (d20 != 1 and d20 + pc["attack_bonus"] >= npc_ac):
+                        party_damage += roll(pc["damage"], crit=d20 == 20)
+
+            target = next(i for i, h in enumerate(pc_hp) if h > 0)
+            npc_damage = 0
+            for attack in npc_attacks:
+                d20 = rng.randint(1, 20)
+                if attack.kind == "save":
+                    if d20 + party[target]["dex_save"] < attack.bonus:
+                        npc_damage += roll(attack.dice)
+                elif d20 == 20 or (d20 != 1 and d20 + attack.bonus >= party[target]["armor_class"]):
+                    npc_damage += roll(attack.dice, crit=d20 == 20)
+
+            hp -= party_damage
+            pc_hp[target] -= npc_damage
+            damage_dealt += npc_damage
+
+        wins.append(hp > 0 and not any(h > 0 for h in pc_hp))
+        deaths.append(hp <= 0)
+        all_rounds.append(rounds)
+        all_damage.append(damage_dealt)
+    return wins, deaths, all_rounds, all_damage
+
+
+def simulate_fights(stat_block, party=None, fights=1000, seed=None, use_numpy=None):
+    """
+    Fight a stat block against a party `fights` times.
+    party: list of reference_character() dicts (default: four characters of
+    the level this CR is meant to challenge)
+    Returns win rate, draw rate and average rounds/damage.
+    """
+    if party is None:
+        party = [reference_character(cr_to_party_level(stat_block["challenge_rating"]))] * 4
+    npc_attacks = compile_attacks(stat_block)
+    if use_numpy is None:
+        use_numpy = np is not None
+
+    if use_numpy:
+        if np is None:
+            raise ImportError("NumPy is not installed (pip install numpy)")
+        results = _simulate_numpy(stat_block["hit_points"], stat_block["armor_class"], npc_attacks,
+                                  party, fights, np.random.default_rng(seed))
+    else:
+        results = _simulate_python(stat_block["hit_points"], stat_block["armor_class"], npc_attacks,
+                                   party, fights, random.Random(seed))
+    wins, deaths, rounds, damage = results
+
+    kill_rounds = [r for r, died in zip(rounds, deaths) if died]
+    return {
+        "fights": fights,
+        "party_level": party[0]["level"],
+        "party_size": len(party),
+        "win_rate": sum(wins) / fights,
+        "draw_rate": sum(1 for won, died in zip(wins, deaths) if not won and not died) / fights,
+        "mean_rounds": sum(rounds) / fights,
+        "mean_rounds_to_kill": sum(kill_rounds) / len(kill_rounds) if kill_rounds else None,
+        "mean_damage_dealt": sum(damage) / fights
+    }
+
+
+def validate_challenge_ratings(crs=None, jobs=None, fights=1000, samples=5, seed=None, use_numpy=None):
+    """
+    Simulate fights for every CR / class category combination.
+    samples: how many different NPCs to generate per combination (their HP
+    rolls differ); fights are split evenly between them.
+    Returns a list of result rows.
+    """
+    crs = crs or list(CR_STAT_TEMPLATES)
+    jobs = jobs or list(CLASS_MODIFIERS)
+    rng = random.Random(seed)
+    rows = []
+    for cr in crs:
+        for job in jobs:
+            per_sample = max(1, fights // samples)
+            totals = []
+            for _ in range(samples):
+                npc = generate_npc(job_filter=job, challenge_rating=cr)
+                totals.append(simulate_fights(npc["stat_block"], fights=per_sample,
+                                              seed=rng.randrange(2 ** 32), use_numpy=use_numpy))
+            kills = [t["mean_rounds_to_kill"] for t in totals if t["mean_rounds_to_kill"] is not None]
+            rows.append({
+                "challenge_rating": cr,
+                "class_category": job,
+                "fights": per_sample * samples,
+                "party_level": totals[0]["party_level"],
+                "win_rate": sum(t["win_rate"] for t in totals) / samples,
+                "draw_rate": sum(t["draw_rate"] for t in totals) / samples,
+                "mean_rounds_to_kill": sum(kills) / len(kills) if kills else None,
+                "mean_damage_dealt": sum(t["mean_damage_dealt"] for t in totals) / samples
+            })
+    return rows
+
+
+def print_report(rows):
+    """Table of win rates and rounds-to-kill per CR and class"""
+    print(f"{'CR':>4}  {'class':<12} {'party':>6} {'NPC wins':>9} {'draws':>7} {'rounds to kill':>15} {'dmg dealt':>10}")
+    print("-" * 70)
+    for row in rows:
+        rounds = f"{row['mean_rounds_to_kill']:.1f}" if row["mean_rounds_to_kill"] is not None else "-"
+        print(f"{row['challenge_rating']:>4}  {row['class_category']:<12} {'4x' + str(row['party_level']):>6} "
+              f"{row['win_rate']:>8.1%} {row['draw_rate']:>7.1%} {rounds:>15} {row['mean_damage_dealt']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check generated stat blocks against their CR by simulation')
+    parser.add_argument('--crs', help='Comma-separated CRs to test (default: all)')
+    parser.add_argument('--jobs', help='Comma-separated job categories to test (default: all)')
+    parser.add_argument('--fights', type=int, default=1000,
+                        help='Fights per CR/job combination (default: 1000)')
+    parser.add_argument('--samples', type=int, default=5,
+                        help='Different NPCs generated per combination (default: 5)')
+    parser.add_argument('--seed', type=int, help='Random seed for repeatable results')
+    parser.add_argument('--no-numpy', action='store_true', help='Use the plain Python simulator')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    rows = validate_challenge_ratings(
+        crs=args.crs.split(",") if args.crs else None,
+        jobs=args.jobs.split(",") if args.jobs else None,
+        fights=args.fights, samples=args.samples, seed=args.seed,
+        use_numpy=False if args.no_numpy else None
+    )
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print_report(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Dice expressions like "2d6 + 3" or "1d8 + 1d6 - 1"
+Parse once (parse_dice caches every expression it has seen), then roll
+as often as you like - one at a time, or N at once with roll_many.
+Exact average/minimum/maximum come for free.
+"""
+
+import functools
+import random
+import re
+
+
+@functools.lru_cache(maxsize=None)
+def load_numpy():
+    """NumPy if it's installed, else None. Imported on first use to keep startup fast."""
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+
+# One term: "2d6", "+ 3", "- 1d4", "+ -1" (the last is how older stat blocks wrote negatives)
+TERM_PATTERN = re.compile(r"\s*([+-]?)\s*(-?\d+)(?:d(\d+))?", re.IGNORECASE)
+# A damage string: dice expression followed by an optional damage type
+DAMAGE_PATTERN = re.compile(
+    r"^\s*(?P<dice>\d+d\d+(?:\s*[+-]\s*-?\d+(?:d\d+)?)*)\s*(?P<type>[a-z]+)?", re.IGNORECASE
+)
+
+
+class DiceExpression:
+    """
+    A sum of dice and a flat modifier. Immutable - get one from parse_dice()
+    so identical expressions share one parsed object.
+    """
+    __slots__ = ("dice", "modifier")
+
+    def __init__(self, dice, modifier=0):
+        # dice: tuple of (count, sides) pairs
+        self.dice = tuple((count, sides) for count, sides in dice if count)
+        self.modifier = modifier
+
+    def __str__(self):
+        text = " + ".join(f"{count}d{sides}" for count, sides in self.dice)
+        if not text:
+            return str(self.modifier)
+        if self.modifier > 0:
+            text += f" + {self.modifier}"
+        elif self.modifier < 0:
+            text += f" - {-self.modifier}"
+        return text
+
+    def __repr__(self):
+        return f"DiceExpression('{self}')"
+
+    def __eq__(self, other):
+        return isinstance(other, DiceExpression) and (self.dice, self.modifier) == (other.dice, other.modifier)
+
+    def __hash__(self):
+        return hash((self.dice, self.modifier))
+
+    @property
+    def average(self):
+        """Exact expected value"""
+        return sum(count * (sides + 1) / 2 for count, sides in self.dice) + self.modifier
+
+    @property
+    def minimum(self):
+        return sum(count for count, _ in self.dice) + self.modifier
+
+    @property
+    def maximum(self):
+        return sum(count * sides for count, sides in self.dice) + self.modifier
+
+    def roll(self, rng=None, critical=False):
+        """Roll once. critical=True rolls every die twice (5e critical hit)."""
+        rng = rng or random
+        times = 2 if critical else 1
+        return sum(rng.randint(1, sides) for count, sides in self.dice
+                   for _ in range(count * times)) + self.modifier
+
+    def roll_many(self, n, rng=None):
+        """
+        Roll n times and return a list of results. Vectorized when NumPy is
+        installed, unless rng is a plain random.Random.
+        """
+        if load_numpy() is not None and not isinstance(rng, random.Random):
+            return self.roll_array(n, rng).tolist()
+        rng = rng or random
+        return [self.roll(rng) for _ in range(n)]
+
+    def roll_array(self, n, rng=None, critical=None):
+        """
+        Roll n times into a NumPy array in one go.
+        rng: numpy Generator (default: a fresh one)
+        critical: optional boolean array - those rolls get their dice doubled
+        """
+        np = load_numpy()
+        if np is None:
+            raise ImportError("NumPy is not installed (pip install numpy)")
+        rng = rng or np.random.default_rng()
+        total = np.full(n, self.modifier, dtype=np.int64)
+        for count, sides in self.dice:
+            total += rng.integers(1, sides + 1, size=(n, count)).sum(axis=1)
+            if critical is not None:
+                extra = rng.integers(1, sides + 1, size=(n, count)).sum(axis=1)
+                total += np.where(critical, extra, 0)
+        return total
+
+    def to_dict(self):
+        """Structured, JSON-friendly form stored in stat blocks"""
+        return {
+            "expression": str(self),
+            "dice": [list(term) for term in self.dice],
+            "modifier": self.modifier,
+            "average": self.average,
+            "min": self.minimum,
+            "max": self.maximum
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild from to_dict() output without parsing any text"""
+        return cls([tuple(term) for term in data["dice"]], data["modifier"])
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_dice(text):
+    """Parse '2d6 + 3', '1d8 - 1', '3d6', '1d4 + -1' or '5' into a (shared) DiceExpression"""
+    text = text.strip()
+    if not text:
+        raise ValueError("Empty dice expression")
+    dice = []
+    modifier = 0
+    pos = 0
+    while pos < len(text):
+        match = TERM_PATTERN.match(text, pos)
+        if not match or match.end() == pos:
+            raise ValueError(f"Can't read dice expression '{text}'")
+        sign = -1 if match.group(1) == "-" else 1
+        number = int(match.group(2)) * sign
+        if match.group(3):
+            if number < 0:
+                raise ValueError(f"Can't subtract dice in '{text}'")
+            dice.append((number, int(match.group(3))))
+        else:
+            modifier += number
+        pos = match.end()
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+    return DiceExpression(dice, modifier)
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_damage(text):
+    """
+    Split a damage string like '2d6 + 3 slashing damage' into
+    (DiceExpression, damage type). Cached like parse_dice.
+    """
+    match = DAMAGE_PATTERN.match(text)
+    if not match:
+        raise ValueError(f"Can't read damage '{text}'")
+    return parse_dice(match.group("dice")), (match.group("type") or "").lower()
+
+
+def hit_dice_for(hit_points, size, con_modifier):
+    """
+    A 5e-style hit dice expression (e.g. '11d8 + 22') whose average is as
+    close as possible to hit_points for a creature of this size
+    """
+    sides = {"Tiny": 4, "Small": 6, "Medium": 8, "Large": 10, "Huge": 12, "Gargantuan": 20}.get(size, 8)
+    per_die = (sides + 1) / 2 + con_modifier
+    count = max(1, round(hit_points / per_die)) if per_die > 0 else 1
+    return DiceExpression([(count, sides)], count * con_modifier)
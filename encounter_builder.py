@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Encounter builder
+Picks a mix of NPC challenge ratings that fits an XP budget for a party,
+then generates the NPCs with stat blocks.
+
+Two budget systems are supported:
+- easy / medium / hard / deadly: 2014 DMG thresholds, with the encounter
+  multiplier for the number of foes (and the small/large party adjustment)
+- low / moderate / high: 2024 DMG budgets, which drop the multiplier
+"""
+
+import functools
+import random
+
+from npc_generator import CR_STAT_TEMPLATES, GROUP_TYPES, generate_group, generate_npc
+
+# XP thresholds per character level: (easy, medium, hard, deadly)
+XP_THRESHOLDS_2014 = {
+    1: (25, 50, 75, 100), 2: (50, 100, 150, 200), 3: (75, 150, 225, 400),
+    4: (125, 250, 375, 500), 5: (250, 500, 750, 1100), 6: (300, 600, 900, 1400),
+    7: (350, 750, 1100, 1700), 8: (450, 900, 1400, 2100), 9: (550, 1100, 1600, 2400),
+    10: (600, 1200, 1900, 2800), 11: (800, 1600, 2400, 3600), 12: (1000, 2000, 3000, 4500),
+    13: (1100, 2200, 3400, 5100), 14: (1250, 2500, 3800, 5700), 15: (1400, 2800, 4300, 6400),
+    16: (1600, 3200, 4800, 7200), 17: (2000, 3900, 5900, 8800), 18: (2100, 4200, 6300, 9500),
+    19: (2400, 4900, 7300, 10900), 20: (2800, 5700, 8500, 12700)
+}
+
+# XP budget per character level: (low, moderate, high)
+XP_BUDGETS_2024 = {
+    1: (50, 75, 100), 2: (100, 150, 200), 3: (150, 225, 400), 4: (250, 375, 500),
+    5: (500, 750, 1100), 6: (600, 1000, 1400), 7: (750, 1300, 1700), 8: (1000, 1700, 2100),
+    9: (1300, 2000, 2600), 10: (1600, 2300, 3100), 11: (1900, 2900, 4100),
+    12: (2200, 3700, 4700), 13: (2600, 4200, 5400), 14: (2900, 4900, 6200),
+    15: (3300, 5400, 7800), 16: (3800, 6100, 9800), 17: (4500, 7200, 11700),
+    18: (5000, 8700, 14200), 19: (5500, 10700, 17200), 20: (6400, 13200, 22000)
+}
+
+DIFFICULTIES_2014 = ["easy", "medium", "hard", "deadly"]
+DIFFICULTIES_2024 = ["low", "moderate", "high"]
+DIFFICULTIES = DIFFICULTIES_2014 + DIFFICULTIES_2024
+
+# Encounter multipliers by number of foes (2014 DMG), lowest step first
+MULTIPLIER_STEPS = [(1, 1.0), (2, 1.5), (3, 2.0), (7, 2.5), (11, 3.0), (15, 4.0)]
+MULTIPLIER_VALUES = [0.5] + [value for _, value in MULTIPLIER_STEPS] + [5.0]
+
+# CRs worth fighting (CR 0 gives no XP), ordered by XP
+ENCOUNTER_CRS = sorted((cr for cr, data in CR_STAT_TEMPLATES.items() if data["xp"] > 0),
+                       key=lambda cr: CR_STAT_TEMPLATES[cr]["xp"])
+
+
+def encounter_multiplier(count, party_size=4):
+    """2014 DMG multiplier for fighting `count` foes, adjusted for party size"""
+    step = 0
+    for i, (minimum, _) in enumerate(MULTIPLIER_STEPS):
+        if count >= minimum:
+            step = i
+    index = step + 1  # MULTIPLIER_VALUES has an extra step on each end
+    if party_size < 3:
+        index += 1
+    elif party_size >= 6:
+        index -= 1
+    return MULTIPLIER_VALUES[index]
+
+
+def xp_budget(party_levels, difficulty):
+    """
+    XP range (low, high) that counts as `difficulty` for this party.
+    The top of the range is the next difficulty up (or +50% for the hardest).
+    """
+    if difficulty in DIFFICULTIES_2014:
+        table, names = XP_THRESHOLDS_2014, DIFFICULTIES_2014
+    elif difficulty in DIFFICULTIES_2024:
+        table, names = XP_BUDGETS_2024, DIFFICULTIES_2024
+    else:
+        raise ValueError(f"Unknown difficulty: {difficulty}")
+
+    for level in party_levels:
+        if level not in table:
+            raise ValueError(f"Character level must be 1-20, got {level}")
+
+    step = names.index(difficulty)
+    low = sum(table[level][step] for level in party_levels)
+    if step + 1 < len(names):
+        high = sum(table[level][step + 1] for level in party_levels) - 1
+    else:
+        high = low * 3 // 2
+    return low, high
+
+
+@functools.lru_cache(maxsize=256)
+def find_encounter_mixes(low, high, party_size, use_multiplier, max_count=8, max_kinds=2):
+    """
+    Every mix of up to max_kinds different CRs (max_count foes in total)
+    whose adjusted XP lands in [low, high].
+    Returns a tuple of mixes; each mix is a tuple of (cr, count) pairs.
+    Results are cached, so repeat requests for the same party are instant.
+    """
+    xp = [CR_STAT_TEMPLATES[cr]["xp"] for cr in ENCOUNTER_CRS]
+    mixes = []
+
+    def adjusted(base_xp, count):
+        if not use_multiplier:
+            return base_xp
+        return base_xp * encounter_multiplier(count, party_size)
+
+    for i, cr in enumerate(ENCOUNTER_CRS):
+        for count in range(1, max_count + 1):
+            value = adjusted(xp[i] * count, count)
+            if value > high:
+                break  # CRs are sorted by XP, so more of them only gets worse
+            if value >= low:
+                mixes.append(((cr, count),))
+
+        if max_kinds < 2:
+            continue
+        # A stronger leader (cr) backed up by weaker followers
+        for j in range(i):
+            for leaders in range(1, max_count):
+                if adjusted(xp[i] * leaders, leaders) > high:
+                    break
+                for followers in range(1, max_count - leaders + 1):
+                    count = leaders + followers
+                    value = adjusted(xp[i] * leaders + xp[j] * followers, count)
+                    if value > high:
+                        break
+                    if value >= low:
+                        mixes.append(((cr, leaders), (ENCOUNTER_CRS[j], followers)))
+    return tuple(mixes)
+
+
+def plan_encounter(party_levels, difficulty, max_count=8, max_kinds=2):
+    """
+    Choose a CR mix for an encounter without generating any NPCs.
+    Returns a dict with the budget, the mix and its base/adjusted XP.
+    Raises ValueError if nothing fits.
+    """
+    low, high = xp_budget(party_levels, difficulty)
+    use_multiplier = difficulty in DIFFICULTIES_2014
+    mixes = find_encounter_mixes(low, high, len(party_levels), use_multiplier, max_count, max_kinds)
+    if not mixes:
+        raise ValueError(f"No combination of up to {max_count} NPCs makes a {difficulty} encounter "
+                         f"({low}-{high} XP) for this party")
+
+    mix = random.choice(mixes)
+    count = sum(n for _, n in mix)
+    base_xp = sum(CR_STAT_TEMPLATES[cr]["xp"] * n for cr, n in mix)
+    multiplier = encounter_multiplier(count, len(party_levels)) if use_multiplier else 1.0
+    return {
+        "difficulty": difficulty,
+        "party_levels": list(party_levels),
+        "budget": (low, high),
+        "mix": list(mix),
+        "count": count,
+        "base_xp": base_xp,
+        "multiplier": multiplier,
+        "adjusted_xp": int(base_xp * multiplier)
+    }
+
+
+def build_encounter(party_levels, difficulty, job_filter=None, group_type="crew", max_count=8, max_kinds=2,
+                    lazy_stats=False):
+    """
+    Plan an encounter and generate its NPCs with stat blocks.
+    The NPCs are generated as a related group (a crew by default; None for
+    unrelated NPCs), with the strongest CR going to the first member.
+    lazy_stats: give them lazy stat blocks (see generate_npc).
+    Returns the plan with 'type' and 'members' added, ready for
+    display_group / add_npc_to_collection.
+    """
+    plan = plan_encounter(party_levels, difficulty, max_count, max_kinds)
+    crs = [cr for cr, count in plan["mix"] for _ in range(count)]
+
+    if group_type:
+        if group_type not in GROUP_TYPES:
+            raise ValueError(f"Unknown group type: {group_type}")
+        # Shared traits and roles come from the group, stat blocks from each member's CR
+        members = generate_group(group_type, len(crs), job_filter=job_filter, member_crs=crs,
+                                 lazy_stats=lazy_stats)["members"]
+        name = GROUP_TYPES[group_type]["name"]
+    else:
+        members = [generate_npc(job_filter=job_filter, challenge_rating=cr, lazy_stats=lazy_stats) for cr in crs]
+        name = "NPCs"
+
+    plan["type"] = f"{difficulty.title()} Encounter: {name}"
+    plan["members"] = members
+    return plan
+
+
+def describe_encounter(plan):
+    """One-line summary like '1 × CR 3 + 4 × CR 1/2 - 1,500 XP (adjusted 3,750 XP)'"""
+    mix = " + ".join(f"{count} × CR {cr}" for cr, count in plan["mix"])
+    low, high = plan["budget"]
+    summary = f"{mix} - {plan['base_xp']:,} XP"
+    if plan["multiplier"] != 1.0:
+        summary += f" (adjusted {plan['adjusted_xp']:,} XP, ×{plan['multiplier']})"
+    return f"{summary}; {plan['difficulty']} budget {low:,}-{high:,} XP"
+
+
+def parse_party(text):
+    """Parse '5,5,5,5' or '4x5' (four level-5 characters) into a list of levels"""
+    try:
+        if "x" in text.lower():
+            size, level = text.lower().split("x")
+            return [int(level)] * int(size)
+        return [int(level) for level in text.split(",") if level.strip()]
+    except ValueError:
+        raise ValueError(f"Could not read party '{text}' - use levels like 5,5,4,6 or 4x5")
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate detection for NPCs
+Two NPCs are compared trait by trait (first and last name, species, class,
+personality, appearance...) and their similarity is the fraction of traits
+they share. Rather than compare every pair, each NPC is hashed into BANDS
+buckets, each keyed on a few of its traits; only NPCs that land in the same
+bucket at least once are compared. That's locality-sensitive hashing by
+trait sampling - the fixed-trait cousin of MinHash - and makes checking a
+new NPC, or deduplicating a whole collection, close to linear time.
+
+The buckets for saved NPCs live in the sidecar index (npc_index.py), so
+checking a new NPC at insert time never reads npcs.json.
+"""
+
+import hashlib
+import operator
+import random
+
+# Traits compared between NPCs (the name counts as two: first and last)
+TRAIT_FIELDS = ["species", "class", "gender", "personality", "speech_pattern", "voice",
+                "motivation", "secret", "height", "build", "hair_color", "hair_style",
+                "eye_color", "distinctive_feature", "clothing_style"]
+TRAIT_COUNT = len(TRAIT_FIELDS) + 2
+
+# NPCs sharing at least this fraction of traits count as duplicates
+DEFAULT_THRESHOLD = 0.75
+
+# Each band keys on BAND_SIZE traits. A pair sharing k of TRAIT_COUNT traits
+# collides in a band with probability C(k, 4) / C(17, 4): ~30% at 13 shared
+# traits (so 20 bands find it 99.9% of the time) and zero below 4 shared
+# traits, which is almost every unrelated pair.
+BAND_COUNT = 20
+BAND_SIZE = 4
+# Fixed seed: stored bucket keys must mean the same thing in every run
+BANDS = [tuple(sorted(random.Random(band).sample(range(TRAIT_COUNT), BAND_SIZE)))
+         for band in range(BAND_COUNT)]
+_BAND_TRAITS = [operator.itemgetter(*band) for band in BANDS]
+
+SEPARATOR = "\x1f"
+# How many times --no-duplicates regenerates before giving up
+MAX_ATTEMPTS = 10
+
+
+def npc_traits(npc):
+    """The trait tuple two NPCs are compared on"""
+    name = npc.get("name", "").split()
+    first = name[0] if name else ""
+    last = name[-1] if len(name) > 1 else ""
+    return (first.lower(), last.lower()) + tuple(str(npc.get(field, "")).lower() for field in TRAIT_FIELDS)
+
+
+def similarity(traits, other):
+    """Fraction of traits two trait tuples have in common"""
+    return sum(map(operator.eq, traits, other)) / TRAIT_COUNT
+
+
+def band_keys(traits):
+    """
+    One stable 63-bit bucket key per band (stable across runs, unlike hash(),
+    so they can be stored)
+    """
+    return [int.from_bytes(hashlib.blake2b(SEPARATOR.join(band(traits)).encode(), digest_size=8).digest(),
+                           "big") >> 1 for band in _BAND_TRAITS]
+
+
+def collection_members(entries):
+    """Yield (npc, entry) for every individual and group member"""
+    for entry in entries:
+        if entry["type"] == "group":
+            for member in entry["members"]:
+                yield member, entry
+        else:
+            yield entry, entry
+
+
+class DedupIndex:
+    """
+    In-memory bucket index for checking NPCs against each other, e.g. a
+    whole collection (find_duplicates) or a batch being generated
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self.buckets = {}
+        self.traits = []
+        self.keys = []
+
+    def find(self, npc):
+        """Return [(key, similarity)] for NPCs already added that are too similar to npc"""
+        traits = npc_traits(npc)
+        return self._find(traits, band_keys(traits))
+
+    def add(self, npc, key=None):
+        """Remember an NPC; key is what find() reports for it (default: its ID)"""
+        traits = npc_traits(npc)
+        self._add(traits, band_keys(traits), npc.get("id") if key is None else key)
+
+    def _find(self, traits, buckets):
+        seen = set()
+        matches = []
+        for band, bucket in enumerate(buckets):
+            for i in self.buckets.get((band, bucket), ()):
+                if i in seen:
+                    continue
+                seen.add(i)
+                score = similarity(traits, self.traits[i])
+                if score >= self.threshold:
+                    matches.append((self.keys[i], score))
+        return sorted(matches, key=lambda match: -match[1])
+
+    def _add(self, traits, buckets, key):
+        i = len(self.traits)
+        self.traits.append(traits)
+        self.keys.append(key)
+        for band, bucket in enumerate(buckets):
+            self.buckets.setdefault((band, bucket), []).append(i)
+
+
+def find_duplicates(entries, threshold=DEFAULT_THRESHOLD):
+    """
+    Near-duplicates across a whole collection in one pass.
+    entries: collection entries (e.g. iter_npc_collection(), streamed)
+    Returns [(npc, entry, [(earlier NPC id, similarity), ...])] for every NPC
+    that is too similar to one saved before it.
+    """
+    index = DedupIndex(threshold)
+    duplicates = []
+    for npc, entry in collection_members(entries):
+        traits = npc_traits(npc)
+        buckets = band_keys(traits)
+        matches = index._find(traits, buckets)
+        if matches:
+            duplicates.append((npc, entry, matches))
+        # Older group members have no ID of their own - report the group instead
+        index._add(traits, buckets, npc.get("id", entry["id"]))
+    return duplicates
+
+
+def find_similar_saved(npc, threshold=DEFAULT_THRESHOLD):
+    """
+    Saved NPCs too similar to npc, looked up in the sidecar index.
+    Returns a list of dicts (id, entry_id, name, similarity), most similar first.
+    """
+    from contextlib import closing
+    from npc_index import open_index
+
+    traits = npc_traits(npc)
+    keys = band_keys(traits)
+    where = " OR ".join("(band = ? AND bucket = ?)" for _ in keys)
+    params = [value for band, bucket in enumerate(keys) for value in (band, bucket)]
+    with closing(open_index()) as conn:
+        rows = conn.execute(
+            "SELECT DISTINCT npcs.rowid, npcs.id, npcs.entry_id, npcs.name, npcs.traits FROM npc_bands "
+            f"JOIN npcs ON npcs.rowid = npc_bands.npc_rowid WHERE {where}", params
+        ).fetchall()
+    matches = []
+    for row in rows:
+        score = similarity(traits, tuple(row["traits"].split(SEPARATOR)))
+        if score >= threshold:
+            matches.append({"id": row["id"], "entry_id": row["entry_id"], "name": row["name"],
+                            "similarity": score})
+    return sorted(matches, key=lambda match: -match["similarity"])
+
+
+def generate_distinct(generate, threshold=DEFAULT_THRESHOLD, attempts=MAX_ATTEMPTS):
+    """
+    Call generate() (returning an NPC or a group) until nothing it made is
+    too similar to a saved NPC, at most `attempts` times.
+    Returns (result, matches): matches is empty unless every attempt was
+    a near-duplicate, in which case the last attempt is returned.
+    """
+    result, matches = None, []
+    for _ in range(attempts):
+        result = generate()
+        if not result:
+            return result, []
+        members = result["members"] if "members" in result else [result]
+        matches = [match for npc in members for match in find_similar_saved(npc, threshold)]
+        if not matches:
+            break
+    return result, matches
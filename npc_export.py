@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Bulk export of the NPC collection
+Streams npcs.json one entry at a time (see iter_npc_collection) and writes
+each NPC straight to the output file, so exporting a huge collection never
+needs more memory than a single NPC. Groups are flattened: every member
+becomes its own record carrying its group's ID and type.
+
+Formats:
+- jsonl: one NPC per line, exactly as saved
+- csv: one row per NPC, stat block flattened into columns
+- markdown: a readable stat block per NPC (see npc_render.py)
+- foundry: Foundry VTT (dnd5e system) actors, one JSON document per line -
+  the compendium pack (.db) layout Foundry imports
+
+Any format can be compressed with gzip, or zstd if the zstandard package
+is installed (pip install zstandard).
+"""
+
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import sys
+from contextlib import ExitStack
+
+from npc_generator import expand_stat_block, matches_filters
+from npc_profiling import timed
+from npc_render import ABILITIES, render_npc
+from npc_storage import iter_npc_collection, write_file_atomically
+
+EXPORT_FORMATS = ["jsonl", "csv", "markdown", "foundry"]
+COMPRESSIONS = ["gzip", "zstd"]
+
+# File extension -> format / compression, for guessing from the output name
+FORMAT_EXTENSIONS = {".jsonl": "jsonl", ".ndjson": "jsonl", ".csv": "csv", ".md": "markdown",
+                     ".markdown": "markdown", ".db": "foundry"}
+COMPRESSION_EXTENSIONS = {".gz": "gzip", ".zst": "zstd"}
+
+# CSV columns copied straight from the NPC record; the rest come from its stat block
+CSV_TRAIT_FIELDS = [
+    "id", "group_id", "group_type", "relationship", "name", "species", "class", "class_category",
+    "gender", "personality", "speech_pattern", "voice", "motivation", "secret", "height", "build",
+    "hair_color", "hair_style", "eye_color", "distinctive_feature", "clothing_style", "timestamp"
+]
+CSV_FIELDS = CSV_TRAIT_FIELDS + [
+    "challenge_rating", "xp_value", "armor_class", "hit_points", "hit_dice", "speed", "size"
+] + ABILITIES + ["saving_throws", "skills", "special_abilities", "attacks"]
+
+
+def iter_export_records(entries=None, filter_job=None, filter_gender=None, filter_species=None,
+                        expand_stats=True):
+    """
+    Yield one flat NPC record per individual or group member.
+    Members get group_id/group_type from their group (and a timestamp if they
+    have none). Lazy stat blocks are built in full unless expand_stats is False.
+    """
+    if entries is None:
+        entries = iter_npc_collection()
+    for entry in entries:
+        if entry.get("type") == "group":
+            members = [dict(member, group_id=entry["id"], group_type=entry.get("group_type"))
+                       for member in entry["members"]]
+            for member in members:
+                member.setdefault("timestamp", entry.get("timestamp"))
+        else:
+            members = [entry]
+        for npc in members:
+            if matches_filters(npc, filter_job, filter_gender, filter_species):
+                yield expand_stat_block(npc) if expand_stats else npc
+
+
+def guess_format(path, fmt=None, compression=None):
+    """Fill in whichever of format/compression wasn't given from the file name"""
+    root, ext = os.path.splitext(path.lower())
+    if compression is None and ext in COMPRESSION_EXTENSIONS:
+        compression = COMPRESSION_EXTENSIONS[ext]
+        ext = os.path.splitext(root)[1]
+    if fmt is None:
+        fmt = FORMAT_EXTENSIONS.get(ext, "jsonl")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt} (choose from {', '.join(EXPORT_FORMATS)})")
+    if compression not in COMPRESSIONS + [None]:
+        raise ValueError(f"Unknown compression: {compression} (choose from {', '.join(COMPRESSIONS)})")
+    return fmt, compression
+
+
+def open_compressed(stack, raw, compression):
+    """
+    Wrap a binary file object in a text stream, compressing if asked.
+    Everything opened is registered on `stack` so it's closed in order.
+    """
+    if compression == "gzip":
+        raw = stack.enter_context(gzip.GzipFile(fileobj=raw, mode="wb"))
+    elif compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("zstd compression needs the zstandard package (pip install zstandard)")
+        raw = stack.enter_context(zstandard.ZstdCompressor().stream_writer(raw, closefd=False))
+    text = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+    stack.callback(text.detach)  # Don't let the wrapper close the file underneath us
+    stack.callback(text.flush)
+    return text
+
+
+# --------------------------------------------------------------------------- #
+#  Writers - each takes an iterable of records and an open text stream
+# --------------------------------------------------------------------------- #
+def write_jsonl(records, out):
+    count = 0
+    for npc in records:
+        out.write(json.dumps(npc, ensure_ascii=False))
+        out.write("\n")
+        count += 1
+    return count
+
+
+def csv_row(npc):
+    """Flatten an NPC and its stat block into one CSV row"""
+    row = {field: npc.get(field, "") for field in CSV_TRAIT_FIELDS}
+    stat_block = npc.get("stat_block")
+    if stat_block:
+        for field in ["challenge_rating", "xp_value", "armor_class", "hit_points", "speed", "size"]:
+            row[field] = stat_block.get(field, "")
+        if "hit_dice" in stat_block:
+            row["hit_dice"] = stat_block["hit_dice"]["expression"]
+        for ability in ABILITIES:
+            row[ability] = stat_block["ability_scores"][ability]
+        row["saving_throws"] = "; ".join(f"{save.title()} {bonus:+}"
+                                         for save, bonus in stat_block["saving_throws"].items())
+        row["skills"] = "; ".join(f"{skill.title()} {bonus:+}" for skill, bonus in stat_block["skills"].items())
+        row["special_abilities"] = "; ".join(stat_block["special_abilities"])
+        row["attacks"] = "; ".join(f"{attack['name']} ({attack['attack_bonus']}, {attack['damage']})"
+                                   for attack in stat_block["attacks"])
+    return row
+
+
+def write_csv(records, out):
+    writer = csv.DictWriter(out, fieldnames=CSV_FIELDS, restval="")
+    writer.writeheader()
+    count = 0
+    for npc in records:
+        writer.writerow(csv_row(npc))
+        count += 1
+    return count
+
+
+def write_markdown(records, out):
+    out.write("# NPC Collection\n\n")
+    count = 0
+    for npc in records:
+        out.write(render_npc(npc, "markdown"))
+        count += 1
+    return count
+
+
+# Foundry's dnd5e size codes
+FOUNDRY_SIZES = {"Tiny": "tiny", "Small": "sm", "Medium": "med", "Large": "lg", "Huge": "huge",
+                 "Gargantuan": "grg"}
+ABILITY_CODES = {"strength": "str", "dexterity": "dex", "constitution": "con",
+                 "intelligence": "int", "wisdom": "wis", "charisma": "cha"}
+SKILL_CODES = {"acrobatics": "acr", "animal handling": "ani", "arcana": "arc", "athletics": "ath",
+               "deception": "dec", "history": "his", "insight": "ins", "intimidation": "itm",
+               "investigation": "inv", "medicine": "med", "nature": "nat", "perception": "prc",
+               "performance": "prf", "persuasion": "per", "religion": "rel", "sleight of hand": "slt",
+               "stealth": "ste", "survival": "sur"}
+
+
+def foundry_id(*parts):
+    """Stable 16-character document ID, so re-exports update actors instead of duplicating them"""
+    return hashlib.sha1(":".join(str(part) for part in parts).encode()).hexdigest()[:16]
+
+
+def foundry_cr(cr):
+    if "/" in cr:
+        top, bottom = cr.split("/")
+        return int(top) / int(bottom)
+    return int(cr)
+
+
+def foundry_weapon(npc_key, attack):
+    """A stat block attack as a dnd5e weapon item"""
+    parts = []
+    if "damage_dice" in attack:
+        parts.append([attack["damage_dice"]["expression"], attack.get("damage_type", "")])
+    else:
+        parts.append([attack["damage"].split(" damage")[0], ""])
+    melee = "Melee" in attack["type"]
+    distance = attack.get("reach") or attack.get("range") or ""
+    value, _, long_range = distance.split(" ")[0].partition("/")
+    return {
+        "_id": foundry_id(npc_key, attack["name"]),
+        "name": attack["name"],
+        "type": "weapon",
+        "system": {
+            "description": {"value": f"<p>{attack['type']}, {attack['attack_bonus']} to hit. "
+                                     f"Hit: {attack['damage']}</p>"},
+            "activation": {"type": "action", "cost": 1},
+            "actionType": "mwak" if melee else "rwak",
+            "range": {"value": int(value) if value.isdigit() else None,
+                      "long": int(long_range) if long_range.isdigit() else None, "units": "ft"},
+            "damage": {"parts": parts},
+            "weaponType": "natural",
+            "equipped": True,
+            "proficient": True
+        }
+    }
+
+
+def foundry_actor(npc):
+    """An NPC as a Foundry VTT dnd5e 'npc' actor document"""
+    key = npc.get("id", npc["name"])
+    biography = "".join(f"<p><strong>{label}:</strong> {npc[field]}</p>" for label, field in [
+        ("Personality", "personality"), ("Speech", "speech_pattern"), ("Voice", "voice"),
+        ("Motivation", "motivation"), ("Secret", "secret"), ("Notable", "distinctive_feature"),
+        ("Style", "clothing_style")])
+    system = {
+        "details": {
+            "biography": {"value": biography},
+            "race": npc.get("species", ""),
+            "type": {"value": "humanoid", "subtype": npc.get("species", "").lower()},
+            "alignment": ""
+        },
+        "traits": {"size": "med"}
+    }
+    items = []
+    stat_block = npc.get("stat_block")
+    if stat_block:
+        hp = stat_block["hit_points"]
+        system["abilities"] = {
+            ABILITY_CODES[ability]: {"value": score, "proficient": int(ability in stat_block["saving_throws"])}
+            for ability, score in stat_block["ability_scores"].items()
+        }
+        system["attributes"] = {
+            "ac": {"flat": stat_block["armor_class"], "calc": "flat"},
+            "hp": {"value": hp, "max": hp,
+                   "formula": stat_block["hit_dice"]["expression"] if "hit_dice" in stat_block else ""},
+            "movement": {"walk": stat_block["speed"], "units": "ft"},
+            "spelldc": stat_block["spell_save_dc"]
+        }
+        system["details"]["cr"] = foundry_cr(stat_block["challenge_rating"])
+        system["details"]["xp"] = {"value": stat_block["xp_value"]}
+        system["traits"]["size"] = FOUNDRY_SIZES.get(stat_block["size"], "med")
+        system["skills"] = {SKILL_CODES[skill]: {"value": 1} for skill in stat_block["skills"]
+                            if skill in SKILL_CODES}
+        items = [foundry_weapon(key, attack) for attack in stat_block["attacks"]]
+        items += [{"_id": foundry_id(key, ability), "name": ability.split(":")[0], "type": "feat",
+                   "system": {"description": {"value": f"<p>{ability}</p>"}}}
+                  for ability in stat_block["special_abilities"]]
+    return {
+        "_id": foundry_id("npc", key),
+        "name": npc["name"],
+        "type": "npc",
+        "img": "icons/svg/mystery-man.svg",
+        "system": system,
+        "items": items,
+        "flags": {"dnd-npc-generator": {"id": npc.get("id"), "group_id": npc.get("group_id"),
+                                        "class": npc.get("class"), "relationship": npc.get("relationship")}}
+    }
+
+
+def write_foundry(records, out):
+    count = 0
+    for npc in records:
+        out.write(json.dumps(foundry_actor(npc), ensure_ascii=False))
+        out.write("\n")
+        count += 1
+    return count
+
+
+WRITERS = {"jsonl": write_jsonl, "csv": write_csv, "markdown": write_markdown, "foundry": write_foundry}
+
+
+@timed("export")
+def export_collection(path, fmt=None, compression=None, entries=None,
+                      filter_job=None, filter_gender=None, filter_species=None):
+    """
+    Stream the collection (or `entries`) to `path` ('-' for stdout).
+    fmt/compression default to whatever the file name suggests
+    (npcs.csv.gz -> csv + gzip); plain .jsonl otherwise.
+    Files are written atomically, so a failed export leaves no partial file.
+    Returns the number of NPCs written.
+    """
+    fmt, compression = guess_format(path, fmt, compression)
+    records = iter_export_records(entries, filter_job, filter_gender, filter_species)
+    write = WRITERS[fmt]
+    result = []
+
+    def write_to(raw):
+        with ExitStack() as stack:
+            result.append(write(records, open_compressed(stack, raw, compression)))
+
+    if path == "-":
+        write_to(sys.stdout.buffer)
+        sys.stdout.buffer.flush()
+    else:
+        write_file_atomically(path, lambda f: write_to(f.buffer))
+    return result[0]
@@ -6,10 +6,17 @@ Built out of frustration with his lack of imagination by Mike McPhee
 """
 
 import random
+import math      # For the CR stat curves
 import argparse  # For command-line arguments
-import json      # For saving/loading NPC data
-import os        # For file and directory operations
-import datetime  # For timestamps
+import heapq     # For picking a page of results out of a stream
+import sys       # For writing rendered NPCs to stdout
+import time      # For --profile wall time
+from npc_profiling import timed  # For --profile timings
+from dice import DiceExpression, hit_dice_for, parse_dice  # For structured damage and hit dice
+from npc_render import render_group, render_npc, render_stat_block, set_style, write_buffered  # For display_npc and friends
+from npc_storage import (SCHEMA_VERSION, add_npc_to_collection, collection_lock, collection_names,  # For npcs.json
+                         iter_npc_collection, load_npc_collection, migrate_collection, save_npc_collection,
+                         stream_into_collection)
 
 # Data lists for generating NPCs
 # Lists in Python are created with square brackets and comma-separated values
@@ -193,34 +200,80 @@ NONBINARY_VOICES = [
 ]
 
 # D&D 5e 2024 Challenge Rating system
-CHALLENGE_RATINGS = [
-    "0", "1/8", "1/4", "1/2", "1", "2", "3", "4", "5", 
-    "6", "7", "8", "9", "10", "11", "12", "13", "14", "15"
-]
-
-# Base stat templates by Challenge Rating (2024 rules)
-CR_STAT_TEMPLATES = {
-    "0": {"ac": 10, "hp": (1, 6), "prof": 2, "damage": (1, 1), "save_dc": 11, "xp": 0},
-    "1/8": {"ac": 11, "hp": (6, 15), "prof": 2, "damage": (2, 3), "save_dc": 11, "xp": 25},
-    "1/4": {"ac": 11, "hp": (8, 20), "prof": 2, "damage": (3, 5), "save_dc": 11, "xp": 50},
-    "1/2": {"ac": 12, "hp": (16, 30), "prof": 2, "damage": (4, 8), "save_dc": 12, "xp": 100},
-    "1": {"ac": 12, "hp": (26, 40), "prof": 2, "damage": (6, 12), "save_dc": 12, "xp": 200},
-    "2": {"ac": 13, "hp": (36, 55), "prof": 2, "damage": (7, 17), "save_dc": 13, "xp": 450},
-    "3": {"ac": 13, "hp": (50, 75), "prof": 2, "damage": (10, 20), "save_dc": 13, "xp": 700},
-    "4": {"ac": 14, "hp": (71, 90), "prof": 2, "damage": (11, 26), "save_dc": 14, "xp": 1100},
-    "5": {"ac": 15, "hp": (86, 105), "prof": 3, "damage": (15, 32), "save_dc": 14, "xp": 1800},
-    "6": {"ac": 15, "hp": (101, 120), "prof": 3, "damage": (21, 38), "save_dc": 15, "xp": 2300},
-    "7": {"ac": 15, "hp": (116, 135), "prof": 3, "damage": (23, 44), "save_dc": 15, "xp": 2900},
-    "8": {"ac": 16, "hp": (131, 150), "prof": 3, "damage": (25, 50), "save_dc": 16, "xp": 3900},
-    "9": {"ac": 16, "hp": (146, 165), "prof": 4, "damage": (27, 56), "save_dc": 16, "xp": 5000},
-    "10": {"ac": 17, "hp": (161, 180), "prof": 4, "damage": (29, 62), "save_dc": 17, "xp": 5900},
-    "11": {"ac": 17, "hp": (176, 195), "prof": 4, "damage": (31, 68), "save_dc": 17, "xp": 7200},
-    "12": {"ac": 17, "hp": (191, 210), "prof": 4, "damage": (33, 74), "save_dc": 18, "xp": 8400},
-    "13": {"ac": 18, "hp": (206, 225), "prof": 5, "damage": (35, 80), "save_dc": 18, "xp": 10000},
-    "14": {"ac": 18, "hp": (221, 240), "prof": 5, "damage": (37, 86), "save_dc": 19, "xp": 11500},
-    "15": {"ac": 18, "hp": (236, 255), "prof": 5, "damage": (39, 92), "save_dc": 19, "xp": 13000}
+CHALLENGE_RATINGS = ["0", "1/8", "1/4", "1/2"] + [str(cr) for cr in range(1, 31)]
+
+# XP per CR, in CHALLENGE_RATINGS order (published values - no formula behind them)
+CR_XP = [0, 25, 50, 100, 200, 450, 700, 1100, 1800, 2300, 2900, 3900, 5000, 5900, 7200, 8400, 10000,
+         11500, 13000, 15000, 18000, 20000, 22000, 25000, 33000, 41000, 50000, 62000, 75000, 90000,
+         105000, 120000, 135000, 155000]
+
+# Stat curves: (CR, value) points joined by straight lines. Up to CR 15 they
+# give exactly the values of the old hand-written table; past it they follow
+# the DMG's slopes (HP 15 per CR through CR 22, then 45 per CR from CR 23;
+# AC levelling off at 19) and end on the DMG's CR 30 damage of 303-320.
+CR_CURVES = {
+    "ac": [(0, 10), (1 / 2, 12), (4, 14), (6, 15), (14, 18), (16, 18), (17, 19), (30, 19)],
+    "hp_low": [(0, 1), (1 / 8, 6), (1 / 4, 8), (1 / 2, 16), (1, 26), (2, 36), (3, 50), (4, 71), (20, 311),
+               (22, 341), (23, 356), (30, 671)],
+    "hp_high": [(0, 6), (1 / 8, 15), (1 / 2, 30), (1, 40), (2, 55), (3, 75), (20, 330), (21, 340), (22, 355),
+                (23, 400), (30, 715)],
+    "damage_low": [(0, 1), (1 / 2, 4), (1, 6), (2, 7), (3, 10), (4, 11), (5, 15), (6, 21), (20, 49),
+                   (30, 303)],
+    "damage_high": [(0, 1), (1 / 2, 8), (1, 12), (2, 17), (3, 20), (20, 122), (30, 320)],
+    "save_dc": [(0, 11), (1 / 4, 11), (1 / 2, 12), (15, 19), (30, 23)],
 }
 
+
+def cr_value(cr):
+    """A CR string as a number: '1/4' -> 0.25, '5' -> 5"""
+    top, _, bottom = cr.partition("/")
+    return int(top) / int(bottom) if bottom else int(top)
+
+
+def on_curve(points, x):
+    """Value at x on a CR_CURVES line, rounded half up"""
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        if x <= x1:
+            return int(y0 + (y1 - y0) * (x - x0) / (x1 - x0) + 0.5)
+    return points[-1][1]
+
+
+def cr_stats(cr):
+    """Everything generate_stat_block needs to know about one CR"""
+    value = cr_value(cr)
+    prof = 2 + max(0, math.ceil(value) - 1) // 4
+    if value <= 1 / 8:
+        ability_score = 10
+    elif value <= 1:
+        ability_score = 12
+    else:
+        # 14 / 16 / 18 with proficiency up to CR 16, then +1 per proficiency step
+        ability_score = 10 + 2 * min(prof, 4) + max(0, prof - 5)
+    curve = {stat: on_curve(points, value) for stat, points in CR_CURVES.items()}
+    return {
+        "ac": curve["ac"],
+        "hp": (curve["hp_low"], curve["hp_high"]),
+        "prof": prof,
+        "damage": (curve["damage_low"], curve["damage_high"]),
+        "save_dc": curve["save_dc"],
+        "xp": CR_XP[CHALLENGE_RATINGS.index(cr)],
+        "level": math.ceil(value) + 1 if value >= 1 / 2 else 1,  # Rough character level
+        "ability_score": ability_score,
+        # Primary stat gets +2, up to 20 (past CR 16, up to the 5e maximum of 30)
+        "primary_score": min(20 if ability_score <= 18 else 30, ability_score + 2),
+        # Weapon dice step: CR 1/4 and below, 1/2-2, 3-15, 16+
+        "damage_tier": 0 if value <= 1 / 4 else 1 if value <= 2 else 2 if value <= 15 else 3,
+        # Past CR 15 an average hit does at least the low end of the damage curve
+        # (up to it the tier dice stand as they are, so old stat blocks come out the same)
+        "min_damage": curve["damage_low"] if value > 15 else 0,
+    }
+
+
+# Worked out once at import: CR_STAT_TABLE[i] is the row for CHALLENGE_RATINGS[i],
+# and CR_STAT_TEMPLATES maps each CR string to the same row
+CR_STAT_TABLE = [cr_stats(cr) for cr in CHALLENGE_RATINGS]
+CR_STAT_TEMPLATES = dict(zip(CHALLENGE_RATINGS, CR_STAT_TABLE))
+
 # Class-specific stat modifiers and abilities
 CLASS_MODIFIERS = {
     "innkeeper": {
@@ -436,36 +489,24 @@ CLOTHING_STYLES = [
     "wears clothes adapted for their profession"
 ]
 
-# File management constants
-NPC_DATA_DIR = "npc_collection"
-NPC_DATA_FILE = os.path.join(NPC_DATA_DIR, "npcs.json")
-
 
 def calculate_ability_score(cr, primary_stat=None):
     """Calculate ability scores based on CR and primary stat"""
-    # Base scores by CR (roughly)
-    if cr in ["0", "1/8"]:
-        base_score = 10
-    elif cr in ["1/4", "1/2", "1"]:
-        base_score = 12
-    elif cr in ["2", "3", "4"]:
-        base_score = 14
-    elif cr in ["5", "6", "7", "8"]:
-        base_score = 16
-    else:  # CR 9+
-        base_score = 18
-    
-    # Primary stat gets a +2 bonus
-    primary_bonus = 2 if primary_stat else 0
-    return min(20, base_score + primary_bonus)
-
-
-def generate_stat_block(npc, challenge_rating):
-    """Generate D&D 5e stat block for an NPC based on their CR and class"""
-    if challenge_rating not in CR_STAT_TEMPLATES:
+    cr_data = CR_STAT_TEMPLATES.get(cr, CR_STAT_TEMPLATES["0"])
+    return cr_data["primary_score"] if primary_stat else cr_data["ability_score"]
+
+
+@timed("stat_block")
+def generate_stat_block(npc, challenge_rating, hp_seed=None):
+    """
+    Generate D&D 5e stat block for an NPC based on their CR and class
+    hp_seed: seed for the hit point roll (the only random part), so a lazy
+    stat block always expands to the same numbers
+    """
+    cr_data = CR_STAT_TEMPLATES.get(challenge_rating)
+    if cr_data is None:
         return None
     
-    cr_data = CR_STAT_TEMPLATES[challenge_rating]
     class_data = CLASS_MODIFIERS.get(npc["class_category"], CLASS_MODIFIERS["commoner"])
     species_data = SPECIES_MODIFIERS.get(npc["species"], SPECIES_MODIFIERS["Human"])
     
@@ -476,7 +517,7 @@ def generate_stat_block(npc, challenge_rating):
     
     for stat in stats:
         is_primary = (stat == primary_stat or primary_stat == "varies")
-        ability_scores[stat] = calculate_ability_score(challenge_rating, is_primary)
+        ability_scores[stat] = cr_data["primary_score"] if is_primary else cr_data["ability_score"]
     
     # Apply ability modifiers
     def get_modifier(score):
@@ -490,22 +531,22 @@ def generate_stat_block(npc, challenge_rating):
     
     hp_min, hp_max = cr_data["hp"]
     hp_modifier = int((hp_max - hp_min) * class_data["hp_multiplier"])
-    final_hp = random.randint(hp_min + hp_modifier, hp_max + hp_modifier)
+    rng = random if hp_seed is None else random.Random(hp_seed)
+    final_hp = rng.randint(hp_min + hp_modifier, hp_max + hp_modifier)
     
     # Add constitution modifier to HP
-    con_bonus = ability_mods["constitution"] * (challenge_rating_to_level(challenge_rating))
+    con_bonus = ability_mods["constitution"] * cr_data["level"]
     final_hp = max(1, final_hp + con_bonus)
+    # Hit dice averaging out to the rolled HP, for anyone who wants to reroll it
+    hit_dice = hit_dice_for(final_hp, species_data["size"], ability_mods["constitution"])
     
-    # Calculate attack bonus and damage
+    # Calculate attack bonus
     prof_bonus = cr_data["prof"]
     primary_mod = ability_mods.get(primary_stat, 0) if primary_stat != "varies" else max(ability_mods.values())
     attack_bonus = prof_bonus + primary_mod
     
-    damage_min, damage_max = cr_data["damage"]
-    base_damage = f"{damage_min}-{damage_max}"
-    
     # Generate attacks based on class
-    attacks = generate_attacks(npc, ability_mods, attack_bonus, challenge_rating)
+    attacks = generate_attacks(npc, ability_mods, attack_bonus, challenge_rating, cr_data)
     
     # Compile stat block
     stat_block = {
@@ -513,6 +554,7 @@ def generate_stat_block(npc, challenge_rating):
         "xp_value": cr_data["xp"],
         "armor_class": final_ac,
         "hit_points": final_hp,
+        "hit_dice": hit_dice.to_dict(),
         "speed": species_data["speed"],
         "size": species_data["size"],
         "ability_scores": ability_scores,
@@ -528,14 +570,36 @@ def generate_stat_block(npc, challenge_rating):
     return stat_block
 
 
+def lazy_stat_block(challenge_rating):
+    """
+    A stand-in stat block holding just the CR and the seed of its hit point
+    roll - a fraction of the size and generation time of the real one.
+    expand_stat_block() builds the full stat block from it whenever it's
+    needed; the saved record stays lazy.
+    """
+    return {"challenge_rating": challenge_rating, "hp_seed": random.getrandbits(32)}
+
+
+def is_lazy_stat_block(stat_block):
+    return "hp_seed" in stat_block and "hit_points" not in stat_block
+
+
+def expand_stat_block(npc):
+    """
+    The NPC with its lazy stat block built in full - a shallow copy, so the
+    NPC passed in (and whatever gets saved from it) stays lazy. NPCs
+    without a lazy stat block are returned as they are.
+    """
+    stat_block = npc.get("stat_block")
+    if stat_block and is_lazy_stat_block(stat_block):
+        return dict(npc, stat_block=generate_stat_block(npc, stat_block["challenge_rating"], stat_block["hp_seed"]))
+    return npc
+
+
 def challenge_rating_to_level(cr):
     """Convert CR to approximate character level for calculations"""
-    cr_to_level = {
-        "0": 1, "1/8": 1, "1/4": 1, "1/2": 2, "1": 2, "2": 3, "3": 4, "4": 5,
-        "5": 6, "6": 7, "7": 8, "8": 9, "9": 10, "10": 11, "11": 12, "12": 13,
-        "13": 14, "14": 15, "15": 16
-    }
-    return cr_to_level.get(cr, 1)
+    cr_data = CR_STAT_TEMPLATES.get(cr)
+    return cr_data["level"] if cr_data else 1
 
 
 def skill_to_ability(skill):
@@ -550,133 +614,116 @@ def skill_to_ability(skill):
     return skill_map.get(skill, "wisdom")
 
 
-def generate_attacks(npc, ability_mods, attack_bonus, cr):
-    """Generate appropriate attacks for the NPC based on their class"""
+def attack_damage(damage_dice, damage_mod, damage_type, note=""):
+    """
+    Damage fields for an attack: the display string plus the same damage as a
+    structured dice expression, so nothing has to re-parse the text to roll it
+    """
+    expression = DiceExpression(parse_dice(damage_dice).dice, damage_mod)
+    return {
+        "damage": f"{expression} {damage_type} damage{note}",
+        "damage_dice": expression.to_dict(),
+        "damage_type": damage_type
+    }
+
+
+# Weapon dice per class of attack, by CR damage tier (see cr_stats)
+ATTACK_DICE = {
+    "melee": ["1d8", "2d6", "2d8", "4d8"],
+    "ranged": ["1d6", "2d4", "2d6", "4d6"],
+    "spell": ["1d8", "2d6", "3d6", "6d6"],
+}
+
+
+def scale_dice(damage_dice, damage_mod, min_damage):
+    """
+    damage_dice ('4d8') with as many more dice as it takes for an average
+    hit (dice plus damage_mod) to do at least min_damage
+    """
+    (count, sides), = parse_dice(damage_dice).dice
+    needed = math.ceil((min_damage - damage_mod) / ((sides + 1) / 2))
+    return f"{max(count, needed)}d{sides}"
+
+
+def generate_attacks(npc, ability_mods, attack_bonus, cr, cr_data=None):
+    """
+    Generate appropriate attacks for the NPC based on their class
+    cr_data: the CR's row of CR_STAT_TABLE, if the caller has already looked it up
+    """
     attacks = []
+    if cr_data is None:
+        cr_data = CR_STAT_TEMPLATES[cr]
+    tier = cr_data["damage_tier"]
+    min_damage = cr_data["min_damage"]
     class_category = npc["class_category"]
     
     # Determine attack type based on class
     if class_category in ["guard", "adventurer", "noble"]:
         # Melee weapon attack
-        damage_dice = "1d8" if cr in ["0", "1/8", "1/4"] else "2d6" if cr in ["1/2", "1", "2"] else "2d8"
         damage_mod = ability_mods["strength"]
+        damage_dice = scale_dice(ATTACK_DICE["melee"][tier], damage_mod, min_damage)
         attacks.append({
             "name": "Longsword",
             "type": "Melee Weapon Attack",
             "attack_bonus": f"+{attack_bonus}",
             "reach": "5 ft.",
             "target": "one target",
-            "damage": f"{damage_dice} + {damage_mod} slashing damage"
+            **attack_damage(damage_dice, damage_mod, "slashing")
         })
     
     elif class_category in ["criminal", "performer"]:
         # Ranged or finesse weapon
-        damage_dice = "1d6" if cr in ["0", "1/8", "1/4"] else "2d4" if cr in ["1/2", "1", "2"] else "2d6"
         damage_mod = ability_mods["dexterity"]
+        damage_dice = scale_dice(ATTACK_DICE["ranged"][tier], damage_mod, min_damage)
         attacks.append({
             "name": "Shortbow",
             "type": "Ranged Weapon Attack",
             "attack_bonus": f"+{attack_bonus}",
             "range": "150/600 ft.",
             "target": "one target",
-            "damage": f"{damage_dice} + {damage_mod} piercing damage"
+            **attack_damage(damage_dice, damage_mod, "piercing")
         })
     
     elif class_category == "religious":
         # Spell attack
-        damage_dice = "1d8" if cr in ["0", "1/8", "1/4"] else "2d6" if cr in ["1/2", "1", "2"] else "3d6"
+        damage_dice = scale_dice(ATTACK_DICE["spell"][tier], 0, min_damage)
         attacks.append({
             "name": "Sacred Flame",
             "type": "Spell Attack",
             "attack_bonus": f"DC {12 + ability_mods['wisdom']}",
             "range": "60 ft.",
             "target": "one creature",
-            "damage": f"{damage_dice} radiant damage (Dex save for no damage)"
+            **attack_damage(damage_dice, 0, "radiant", " (Dex save for no damage)")
         })
     
     else:
         # Basic unarmed or improvised attack
-        damage_dice = "1d4"
         damage_mod = ability_mods["strength"]
+        damage_dice = scale_dice("1d4", damage_mod, min_damage)
         attacks.append({
             "name": "Improvised Weapon",
             "type": "Melee Weapon Attack",
             "attack_bonus": f"+{attack_bonus}",
             "reach": "5 ft.",
             "target": "one target",
-            "damage": f"{damage_dice} + {damage_mod} bludgeoning damage"
+            **attack_damage(damage_dice, damage_mod, "bludgeoning")
         })
     
     return attacks
 
 
-def ensure_data_directory():
-    """Create the NPC data directory if it doesn't exist"""
-    if not os.path.exists(NPC_DATA_DIR):
-        os.makedirs(NPC_DATA_DIR)
-
-
-def load_npc_collection():
-    """Load existing NPC collection from file"""
-    ensure_data_directory()
-    if os.path.exists(NPC_DATA_FILE):
-        try:
-            with open(NPC_DATA_FILE, 'r') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError):
-            return {"npcs": [], "next_id": 1}
-    return {"npcs": [], "next_id": 1}
-
-
-def save_npc_collection(collection):
-    """Save NPC collection to file"""
-    ensure_data_directory()
-    with open(NPC_DATA_FILE, 'w') as f:
-        json.dump(collection, f, indent=2)
-
-
-def add_npc_to_collection(npc, group_info=None):
-    """Add an NPC (or group) to the persistent collection"""
-    collection = load_npc_collection()
-    
-    timestamp = datetime.datetime.now().isoformat()
-    
-    if group_info:
-        # This is a group of NPCs
-        group_entry = {
-            "id": collection["next_id"],
-            "type": "group",
-            "group_type": group_info["type"],
-            "timestamp": timestamp,
-            "members": []
-        }
-        
-        for member in group_info["members"]:
-            member_data = member.copy()
-            member_data["timestamp"] = timestamp
-            group_entry["members"].append(member_data)
-        
-        collection["npcs"].append(group_entry)
-    else:
-        # Single NPC
-        npc_data = npc.copy()
-        npc_data["id"] = collection["next_id"]
-        npc_data["type"] = "individual"
-        npc_data["timestamp"] = timestamp
-        collection["npcs"].append(npc_data)
-    
-    collection["next_id"] += 1
-    save_npc_collection(collection)
-    return collection["next_id"] - 1
-
-
-def generate_npc(job_filter=None, gender_filter=None, shared_traits=None, challenge_rating=None):
+@timed("generate.npc")
+def generate_npc(job_filter=None, gender_filter=None, shared_traits=None, challenge_rating=None,
+                 name_allocator=None, lazy_stats=False):
     """
     Function to generate a random NPC with optional filters
     job_filter: specific job category like 'innkeeper' 
     gender_filter: 'Male', 'Female', or 'Non-binary'
     shared_traits: dict of traits to share with group members
     challenge_rating: CR string like '1/4' or '5' to generate stat block
+    name_allocator: optional NameAllocator that guarantees the name is unique
+    lazy_stats: store only the CR and HP seed (see lazy_stat_block) instead
+    of building the stat block now
     """
     # Apply filters or use defaults
     if job_filter and job_filter in JOBS:
@@ -728,6 +775,12 @@ def generate_npc(job_filter=None, gender_filter=None, shared_traits=None, challe
                 character_class = random.choice(JOBS[shared_traits["class_category"]])
                 class_category = shared_traits["class_category"]
     
+    name = f"{first_name} {last_name}"
+    if name_allocator is not None:
+        # Only the first name varies when the group shares a family name
+        shared_last_name = shared_traits.get("last_name") if shared_traits else None
+        name = name_allocator.allocate(species, last_name=shared_last_name)
+    
     # Choose voice based on gender
     if gender == "Male":
         voice = random.choice(MALE_VOICES)
@@ -738,7 +791,7 @@ def generate_npc(job_filter=None, gender_filter=None, shared_traits=None, challe
     
     # Create a dictionary to store all the NPC information
     npc = {
-        "name": f"{first_name} {last_name}",
+        "name": name,
         "species": species,
         "class": character_class,
         "class_category": class_category,
@@ -759,7 +812,10 @@ def generate_npc(job_filter=None, gender_filter=None, shared_traits=None, challe
     }
     
     # Generate stat block if challenge rating is provided
-    if challenge_rating:
+    if challenge_rating and lazy_stats:
+        if challenge_rating in CR_STAT_TEMPLATES:
+            npc["stat_block"] = lazy_stat_block(challenge_rating)
+    elif challenge_rating:
         stat_block = generate_stat_block(npc, challenge_rating)
         if stat_block:
             npc["stat_block"] = stat_block
@@ -767,22 +823,32 @@ def generate_npc(job_filter=None, gender_filter=None, shared_traits=None, challe
     return npc
 
 
-def generate_group(group_type, count, job_filter=None, challenge_rating=None):
+@timed("generate.group")
+def generate_group(group_type, count, job_filter=None, challenge_rating=None, name_allocator=None,
+                   member_jobs=None, member_crs=None, lazy_stats=False):
     """
     Generate a related group of NPCs
     group_type: 'family', 'crew', 'business', or 'adventuring'
     count: number of NPCs to generate
     job_filter: optional job category
     challenge_rating: CR string like '1/4' or '5' to generate stat blocks
+    name_allocator: optional NameAllocator that keeps member names unique
+    member_jobs / member_crs: optional per-member job categories and CRs
+    (one per member, None for random / no stat block), overriding
+    job_filter and challenge_rating
+    lazy_stats: give members lazy stat blocks (see generate_npc)
     """
     if group_type not in GROUP_TYPES:
         raise ValueError(f"Unknown group type: {group_type}")
     
     group_info = GROUP_TYPES[group_type]
     npcs = []
+    jobs = member_jobs or [job_filter] * count
+    crs = member_crs or [challenge_rating] * count
     
     # Generate the first NPC to establish shared traits
-    first_npc = generate_npc(job_filter=job_filter, challenge_rating=challenge_rating)
+    first_npc = generate_npc(job_filter=jobs[0], challenge_rating=crs[0],
+                             name_allocator=name_allocator, lazy_stats=lazy_stats)
     
     # Determine what traits this group will share
     shared_traits = {}
@@ -811,7 +877,8 @@ def generate_group(group_type, count, job_filter=None, challenge_rating=None):
         relationship = random.choice(available_relationships)
         used_relationships.append(relationship)
         
-        npc = generate_npc(job_filter=job_filter, shared_traits=shared_traits, challenge_rating=challenge_rating)
+        npc = generate_npc(job_filter=jobs[i + 1], shared_traits=shared_traits, challenge_rating=crs[i + 1],
+                           name_allocator=name_allocator, lazy_stats=lazy_stats)
         npc["relationship"] = relationship
         npcs.append(npc)
     
@@ -821,131 +888,119 @@ def generate_group(group_type, count, job_filter=None, challenge_rating=None):
     }
 
 
-def display_npc(npc):
+@timed("display.npc")
+def display_npc(npc, style=None):
     """
     Function to display an NPC in a nice format
-    Takes an NPC dictionary as input
+    Takes an NPC dictionary as input (style: plain, markdown or ansi - see npc_render.py)
+    A lazy stat block is built for display only; the NPC itself stays lazy.
     """
-    title = f"📜 {npc['name']} ({npc['gender']})"
-    if "relationship" in npc:
-        title += f" - {npc['relationship']}"
-    print(title)
-    print(f"Species: {npc['species']}")
-    print(f"Class: {npc['class']}")
-    
-    print(f"\n👤 PHYSICAL APPEARANCE:")
-    print(f"Height & Build: {npc['height']}, {npc['build']}")
-    print(f"Hair: {npc['hair_color']} hair, {npc['hair_style']}")
-    print(f"Eyes: {npc['eye_color']}")
-    print(f"Notable: {npc['distinctive_feature']}")
-    print(f"Style: {npc['clothing_style']}")
-    
-    print(f"\n🎭 ROLEPLAY NOTES:")
-    print(f"Personality: {npc['personality']}")
-    print(f"Speech pattern: {npc['speech_pattern']}")
-    print(f"Voice inspiration: {npc['voice']}")
-    
-    print(f"\n📖 STORY HOOKS:")
-    print(f"Motivation: {npc['motivation']}")
-    print(f"Secret: {npc['secret']}")
-    
-    # Display stat block if present
-    if "stat_block" in npc:
-        display_stat_block(npc["stat_block"])
-
-
-def display_stat_block(stat_block):
-    """Display a formatted D&D 5e stat block"""
-    print(f"\n⚔️  COMBAT STATISTICS (CR {stat_block['challenge_rating']}) - {stat_block['xp_value']} XP")
-    print("=" * 50)
-    
-    # Basic stats
-    print(f"Size: {stat_block['size']}")
-    print(f"Armor Class: {stat_block['armor_class']}")
-    print(f"Hit Points: {stat_block['hit_points']}")
-    print(f"Speed: {stat_block['speed']} ft.")
-    
-    # Ability scores
-    print(f"\n📊 ABILITY SCORES:")
-    abilities = stat_block['ability_scores']
-    mods = stat_block['ability_modifiers']
-    print(f"STR: {abilities['strength']} ({mods['strength']:+}) | DEX: {abilities['dexterity']} ({mods['dexterity']:+}) | CON: {abilities['constitution']} ({mods['constitution']:+})")
-    print(f"INT: {abilities['intelligence']} ({mods['intelligence']:+}) | WIS: {abilities['wisdom']} ({mods['wisdom']:+}) | CHA: {abilities['charisma']} ({mods['charisma']:+})")
-    
-    # Proficiencies
-    print(f"\n🎯 PROFICIENCIES:")
-    print(f"Proficiency Bonus: +{stat_block['proficiency_bonus']}")
-    
-    if stat_block['saving_throws']:
-        saves = [f"{save.title()} {bonus:+}" for save, bonus in stat_block['saving_throws'].items()]
-        print(f"Saving Throws: {', '.join(saves)}")
-    
-    if stat_block['skills']:
-        skills = [f"{skill.title()} {bonus:+}" for skill, bonus in stat_block['skills'].items()]
-        print(f"Skills: {', '.join(skills)}")
-    
-    # Special abilities
-    if stat_block['special_abilities']:
-        print(f"\n✨ SPECIAL ABILITIES:")
-        for ability in stat_block['special_abilities']:
-            print(f"• {ability}")
-    
-    # Actions/Attacks
-    if stat_block['attacks']:
-        print(f"\n⚔️  ACTIONS:")
-        for attack in stat_block['attacks']:
-            print(f"• {attack['name']}: {attack['type']}, {attack['attack_bonus']} to hit")
-            if 'reach' in attack:
-                print(f"  Reach {attack['reach']}, {attack['target']}. Hit: {attack['damage']}")
-            elif 'range' in attack:
-                print(f"  Range {attack['range']}, {attack['target']}. Hit: {attack['damage']}")
-
-
-def display_group(group):
+    sys.stdout.write(render_npc(expand_stat_block(npc), style))
+
+
+@timed("display.stat_block")
+def display_stat_block(stat_block, style=None, npc=None):
+    """
+    Display a formatted D&D 5e stat block
+    npc: the NPC it belongs to - needed to build a lazy stat block
+    """
+    if is_lazy_stat_block(stat_block):
+        if npc is None:
+            raise ValueError("A lazy stat block can only be displayed with its NPC")
+        stat_block = expand_stat_block(npc)["stat_block"]
+    sys.stdout.write(render_stat_block(stat_block, style))
+
+
+@timed("display.group")
+def display_group(group, style=None):
     """
     Display a group of related NPCs
     """
-    print(f"\n🏛️  {group['type'].upper()}")
-    print("=" * 50)
-    
-    for i, npc in enumerate(group['members']):
-        if i > 0:
-            print("\n" + "-" * 30)
-        display_npc(npc)
+    # Lazy stat blocks are built on copies, so the group can still be saved lazy
+    group = dict(group, members=[expand_stat_block(npc) for npc in group["members"]])
+    sys.stdout.write(render_group(group, style))
 
 
-def view_npc_collection(filter_job=None, filter_gender=None, filter_species=None):
-    """View all saved NPCs with optional filtering"""
-    collection = load_npc_collection()
-    
-    if not collection["npcs"]:
-        print("No NPCs in collection yet. Generate some NPCs first!")
+def format_timestamp(timestamp):
+    """Turn a saved ISO timestamp into 'YYYY-MM-DD HH:MM' for display"""
+    # Same result as fromisoformat + strftime, without parsing every row
+    return timestamp[:16].replace("T", " ")
+
+
+@timed("view.collection")
+def view_npc_collection(filter_job=None, filter_gender=None, filter_species=None,
+                        limit=20, offset=0, since=None, sort="oldest"):
+    """
+    View saved NPCs with optional filtering, one page at a time
+    limit: entries per page (0 shows everything)
+    offset: number of matching entries to skip
+    since: only entries saved on/after this ISO date, e.g. '2025-08-01'
+    sort: 'oldest' or 'newest' first
+    """
+    def matching_entries():
+        for entry in iter_npc_collection():
+            if since and entry["timestamp"] < since:
+                continue
+            if entry["type"] == "group":
+                members = [member for member in entry["members"]
+                           if matches_filters(member, filter_job, filter_gender, filter_species)]
+                if members:
+                    yield entry, members
+            elif matches_filters(entry, filter_job, filter_gender, filter_species):
+                yield entry, None
+    
+    # Fetch one more than the page so we know whether there is a next page
+    wanted = offset + limit + 1 if limit else None
+    if sort == "newest":
+        # Entries are stored oldest first, so keep only the last few while streaming
+        if wanted:
+            page = heapq.nlargest(wanted, matching_entries(), key=lambda match: match[0]["id"])
+        else:
+            page = list(matching_entries())[::-1]
+    else:
+        page = []
+        for match in matching_entries():
+            page.append(match)
+            if wanted and len(page) == wanted:
+                break  # Page is full - don't read the rest of the file
+    
+    has_more = bool(limit) and len(page) > offset + limit
+    page = page[offset:offset + limit] if limit else page[offset:]
+    
+    if not page:
+        if offset or since or filter_job or filter_gender or filter_species:
+            print("No matching NPCs in collection.")
+        else:
+            print("No NPCs in collection yet. Generate some NPCs first!")
         return
     
-    print(f"\n📚 NPC COLLECTION ({len(collection['npcs'])} entries)")
+    print(f"\n📚 NPC COLLECTION (showing {offset + 1}-{offset + len(page)}, {sort} first)")
     print("=" * 60)
     
-    for entry in collection["npcs"]:
-        # Parse the timestamp for display
-        timestamp = datetime.datetime.fromisoformat(entry["timestamp"])
-        date_str = timestamp.strftime("%Y-%m-%d %H:%M")
-        
-        if entry["type"] == "group":
-            print(f"\n#{entry['id']} - {entry['group_type']} ({len(entry['members'])} members) - {date_str}")
-            print("-" * 40)
+    def listing():
+        for entry, members in page:
+            date_str = format_timestamp(entry["timestamp"])
             
-            for member in entry["members"]:
-                if matches_filters(member, filter_job, filter_gender, filter_species):
-                    print(f"  • {member['name']} ({member['gender']}) - {member['species']} {member['class']}")
+            if entry["type"] == "group":
+                yield f"\n#{entry['id']} - {entry['group_type']} ({len(entry['members'])} members) - {date_str}\n"
+                yield "-" * 40 + "\n"
+                
+                for member in members:
+                    yield f"  • {member['name']} ({member['gender']}) - {member['species']} {member['class']}\n"
                     if "relationship" in member:
-                        print(f"    Role: {member['relationship']}")
-        else:
-            # Individual NPC
-            if matches_filters(entry, filter_job, filter_gender, filter_species):
-                print(f"\n#{entry['id']} - {entry['name']} ({entry['gender']}) - {date_str}")
-                print(f"  {entry['species']} {entry['class']}")
-                print(f"  {entry['height']}, {entry['build']}")
-                print(f"  {entry['distinctive_feature']}")
+                        yield f"    Role: {member['relationship']}\n"
+            else:
+                # Individual NPC
+                yield (f"\n#{entry['id']} - {entry['name']} ({entry['gender']}) - {date_str}\n"
+                       f"  {entry['species']} {entry['class']}\n"
+                       f"  {entry['height']}, {entry['build']}\n"
+                       f"  {entry['distinctive_feature']}\n")
+    
+    # Written in large chunks rather than a print() per line - see write_buffered
+    write_buffered(listing())
+    
+    if has_more:
+        print(f"\nMore NPCs available - use '--offset {offset + limit}' to see the next page")
 
 
 def matches_filters(npc, filter_job, filter_gender, filter_species):
@@ -959,31 +1014,246 @@ def matches_filters(npc, filter_job, filter_gender, filter_species):
     return True
 
 
+def find_collection_entry(entries, npc_id):
+    """
+    Find an entry or group member by ID in an iterable of collection entries
+    Returns (npc, group) - group is the parent group entry for members, else None
+    """
+    for entry in entries:
+        if entry["id"] == npc_id:
+            return entry, None
+        if entry["type"] == "group":
+            for member in entry["members"]:
+                if member.get("id") == npc_id:
+                    return member, entry
+    return None, None
+
+
+@timed("view.details")
 def view_npc_details(npc_id):
     """View detailed information about a specific NPC"""
-    collection = load_npc_collection()
+    # Streams the file and stops as soon as the NPC turns up
+    entry, group = find_collection_entry(iter_npc_collection(), npc_id)
     
-    for entry in collection["npcs"]:
-        if entry["id"] == npc_id:
-            timestamp = datetime.datetime.fromisoformat(entry["timestamp"])
-            date_str = timestamp.strftime("%Y-%m-%d %H:%M")
-            
-            print(f"\n📜 NPC #{npc_id} (Created: {date_str})")
-            print("=" * 50)
-            
-            if entry["type"] == "group":
-                print(f"🏛️  {entry['group_type'].upper()}")
-                print("=" * 50)
-                
-                for i, member in enumerate(entry["members"]):
-                    if i > 0:
-                        print("\n" + "-" * 30)
-                    display_npc(member)
-            else:
-                display_npc(entry)
-            return
+    if entry is None:
+        print(f"NPC #{npc_id} not found in collection.")
+        return
+    
+    date_str = format_timestamp(entry["timestamp"])
     
-    print(f"NPC #{npc_id} not found in collection.")
+    print(f"\n📜 NPC #{npc_id} (Created: {date_str})")
+    if group:
+        print(f"Member of {group['group_type']} #{group['id']}")
+    print("=" * 50)
+    
+    if entry.get("type") == "group":  # Group members have no "type"
+        print(f"🏛️  {entry['group_type'].upper()}")
+        print("=" * 50)
+        
+        write_buffered(("\n" + "-" * 30 + "\n" if i else "") + render_npc(expand_stat_block(member))
+                       for i, member in enumerate(entry["members"]))
+    else:
+        display_npc(entry)
+
+
+def format_indexed_npc(row):
+    """One-line summary of an NPC row from the index"""
+    # Group members saved by older versions have no ID of their own
+    label = f"#{row['id']} " if row["id"] is not None else ""
+    return f"{label}{row['name']} ({row['species']} {row['class']})"
+
+
+def view_related_npcs(npc_id):
+    """Show the group an NPC belongs to and everyone sharing their last name"""
+    from npc_index import find_npcs, group_members
+    
+    matches = find_npcs(id=npc_id)
+    npc = matches[0] if matches else None
+    group_id = npc["group_id"] if npc else npc_id
+    members = group_members(group_id) if group_id is not None else []
+    
+    if npc is None and not members:
+        print(f"NPC #{npc_id} not found in collection.")
+        return
+    
+    title = f"#{npc_id} - {npc['name']}" if npc else f"GROUP #{npc_id}"
+    print(f"\n🔗 RELATIONS OF {title}")
+    print("=" * 50)
+    
+    if members:
+        print(f"Group #{group_id} ({len(members)} members):")
+        for member in members:
+            role = f" - {member['relationship']}" if member["relationship"] else ""
+            print(f"  • {format_indexed_npc(member)}{role}")
+    else:
+        print("Not part of any group.")
+    
+    if npc:
+        kin = [other for other in find_npcs(last_name=npc["last_name"]) if other["id"] != npc_id]
+        if kin:
+            print(f"\nAlso named {npc['last_name']} ({len(kin)}):")
+            for other in kin:
+                print(f"  • {format_indexed_npc(other)}")
+
+
+@timed("view.search")
+def view_search_results(query, limit=20):
+    """Full-text search of the collection, best matches first"""
+    from npc_index import search_npcs
+    
+    try:
+        results = search_npcs(query, limit)
+    except ValueError as e:
+        print(e)
+        return
+    
+    if not results:
+        print(f"No NPCs match '{query}'.")
+        return
+    
+    print(f"\n🔍 SEARCH: {query} ({len(results)} best matches)")
+    print("=" * 60)
+    for row in results:
+        # Members of older groups have no ID of their own - point at the group
+        npc_id = row["id"] if row["id"] is not None else row["entry_id"]
+        print(f"\n#{npc_id} - {row['name']} ({row['gender']}) - {row['species']} {row['class']}")
+        print(f"  {row['snippet']}")
+
+
+def view_group_query(group_type=None, leader_species=None):
+    """List members of groups matching a type and/or leader species"""
+    from npc_index import find_group_members
+    
+    members = find_group_members(group_type, leader_species=leader_species)
+    if not members:
+        print("No matching groups in collection.")
+        return
+    
+    def listing():
+        current_group = None
+        for member in members:
+            if member["group_id"] != current_group:
+                current_group = member["group_id"]
+                yield f"\n#{current_group} - {member['group_type']}\n" + "-" * 40 + "\n"
+            yield f"  • {format_indexed_npc(member)}\n"
+            if member["relationship"]:
+                yield f"    Role: {member['relationship']}\n"
+    
+    write_buffered(listing())
+
+
+@timed("view.stats")
+def view_collection_stats():
+    """Counts per species, class, gender and CR plus HP/AC histograms, from the index"""
+    from npc_index import collection_stats
+    
+    stats = collection_stats()
+    total = sum(stats["species"].values())
+    if not total:
+        print("No NPCs in collection yet. Generate some first!")
+        return
+    
+    entries = stats["entries"]
+    print(f"\n📊 COLLECTION STATISTICS ({total} NPCs: {entries.get('individual', 0)} individuals, "
+          f"{entries.get('group', 0)} groups)")
+    print("=" * 60)
+    
+    def numeric(value):
+        return int(value.split("-")[0])
+    
+    def cr_order(value):
+        return CHALLENGE_RATINGS.index(value) if value in CHALLENGE_RATINGS else len(CHALLENGE_RATINGS)
+    
+    sections = [
+        ("Species", "species", None),
+        ("Job category", "class_category", None),
+        ("Gender", "gender", None),
+        ("Challenge rating", "challenge_rating", cr_order),
+        ("Hit points", "hit_points", numeric),
+        ("Armor class", "armor_class", numeric),
+    ]
+    for title, dimension, order in sections:
+        counts = stats[dimension]
+        if not counts:
+            continue
+        print(f"\n{title}:")
+        values = sorted(counts, key=order) if order else list(counts)
+        largest = max(counts.values())
+        for value in values:
+            count = counts[value]
+            bar = "█" * max(1, round(30 * count / largest))
+            print(f"  {value:<14} {count:>7}  {count / total:>6.1%}  {bar}")
+
+    lazy = stats.get("lazy_stat_blocks", {}).get("lazy", 0)
+    if lazy:
+        print(f"\n{lazy} lazy stat block{'s' if lazy != 1 else ''} not counted in the hit point and armor class histograms")
+
+
+def print_ai_usage(stats):
+    """Table of per-model token counts and throughput (see ai_npc_generator.usage_stats)"""
+    print(f"{'model':<20} {'calls':>6} {'prompt tok':>11} {'output tok':>11} {'prompt tok/s':>13} "
+          f"{'output tok/s':>13} {'mean load':>10} {'cold':>5} {'latency':>9}")
+    print("-" * 108)
+    for model, row in stats.items():
+        prompt_rate = f"{row['prompt_tokens_per_s']:.1f}" if row["prompt_tokens_per_s"] else "-"
+        output_rate = f"{row['completion_tokens_per_s']:.1f}" if row["completion_tokens_per_s"] else "-"
+        print(f"{model[:20]:<20} {row['calls']:>6} {row['prompt_tokens']:>11} {row['completion_tokens']:>11} "
+              f"{prompt_rate:>13} {output_rate:>13} {row['mean_load_ms'] / 1000:>9.2f}s {row['cold_loads']:>5} "
+              f"{row['mean_latency_ms'] / 1000:>8.2f}s")
+
+
+def view_ai_usage():
+    """Per-model token and latency totals over every AI-written NPC in the collection"""
+    from ai_npc_generator import usage_stats
+    
+    def usages():
+        for entry in iter_npc_collection():
+            for npc in entry["members"] if entry["type"] == "group" else [entry]:
+                if npc.get("ai_usage"):
+                    yield npc["ai_usage"]
+    
+    stats = usage_stats(usages())
+    if not stats:
+        print("No AI-written NPCs with usage figures in the collection yet.")
+        return
+    print("\n🤖 AI USAGE BY MODEL")
+    print("=" * 108)
+    print_ai_usage(stats)
+
+
+@timed("view.duplicates")
+def view_duplicates(threshold=0.75, remove=False):
+    """
+    List NPCs that near-duplicate an earlier one (see npc_dedup.py).
+    remove: also delete the duplicates that are individual entries - group
+    members are only reported, since removing them would break up the group.
+    """
+    from npc_dedup import find_duplicates
+    
+    if not remove:
+        duplicates = find_duplicates(iter_npc_collection(), threshold)
+    else:
+        with collection_lock():
+            collection = load_npc_collection()
+            duplicates = find_duplicates(collection["npcs"], threshold)
+            removable = {id(entry) for npc, entry, _ in duplicates if npc is entry}
+            if removable:
+                collection["npcs"] = [entry for entry in collection["npcs"] if id(entry) not in removable]
+                save_npc_collection(collection)
+    
+    if not duplicates:
+        print(f"No near-duplicates found (threshold {threshold:.0%} of traits).")
+        return
+    
+    print(f"\n👯 NEAR-DUPLICATES ({len(duplicates)} NPCs share {threshold:.0%}+ of their traits with an earlier NPC)")
+    print("=" * 60)
+    for npc, entry, matches in duplicates:
+        npc_id = npc.get("id", entry["id"])
+        similar = ", ".join(f"#{other} ({score:.0%})" for other, score in matches)
+        where = f" in {entry['group_type']} #{entry['id']}" if npc is not entry else ""
+        print(f"#{npc_id} - {npc['name']}{where} ~ {similar}")
+    if remove:
+        print(f"\n🗑️  Removed {len(removable)} individual NPCs; group members were left alone")
 
 
 def main():
@@ -998,6 +1268,11 @@ def main():
                        help='Challenge Rating for stat block generation (e.g. 1/4, 2, 5)')
     parser.add_argument('--ai', action='store_true',
                        help='Use AI (Ollama) to generate creative, unique NPCs')
+    parser.add_argument('--warm-up', action='store_true',
+                       help='Load the AI model into memory now (so later --ai runs start fast) and exit')
+    parser.add_argument('--hybrid', action='store_true',
+                       help='Generate NPCs normally, then have the AI write only personality, speech, '
+                            'motivation and secret (much faster than --ai)')
     
     # Group options
     parser.add_argument('--group', '-gr', choices=list(GROUP_TYPES.keys()),
@@ -1005,13 +1280,50 @@ def main():
     parser.add_argument('--count', '-c', type=int, default=3, 
                        help='Number of NPCs in group (default: 3)')
     
+    # Encounter options
+    parser.add_argument('--encounter', '-e', metavar='DIFFICULTY',
+                       choices=['easy', 'medium', 'hard', 'deadly', 'low', 'moderate', 'high'],
+                       help='Build an encounter for --party: easy/medium/hard/deadly (2014 rules) '
+                            'or low/moderate/high (2024 rules)')
+    parser.add_argument('--party', default='4x3',
+                       help="Party levels for --encounter, e.g. '5,5,4,6' or '4x5' (default: 4x3)")
+    parser.add_argument('--max-foes', type=int, default=8,
+                       help='Most NPCs an encounter may contain (default: 8)')
+    
+    # Settlement options
+    parser.add_argument('--settlement', metavar='TYPE|FILE',
+                       help='Populate a whole settlement: village, town, port, city, or a JSON spec file')
+    parser.add_argument('--population', type=int,
+                       help="Number of people in --settlement (default: the spec's population)")
+    parser.add_argument('--lazy-stats', action='store_true',
+                       help='Save only the CR and HP roll of each stat block and build the rest when '
+                            'it is shown or exported (faster, smaller bulk runs)')
+    
     # Collection management options
     parser.add_argument('--view', '-v', action='store_true',
                        help='View all NPCs in your collection')
     parser.add_argument('--view-id', type=int, metavar='ID',
                        help='View detailed info for a specific NPC by ID')
+    parser.add_argument('--stats', action='store_true',
+                       help='Show counts by species, job, gender and CR, and HP/AC histograms')
+    parser.add_argument('--ai-stats', action='store_true',
+                       help='Show token counts, tokens/s and model load times for AI-written NPCs, per model')
+    parser.add_argument('--related', type=int, metavar='ID',
+                       help='Show the group and relatives of a specific NPC by ID')
+    parser.add_argument('--migrate', action='store_true',
+                       help='Upgrade an older npcs.json to the current format in place')
+    parser.add_argument('--no-duplicates', action='store_true',
+                       help='Regenerate NPCs that are near-duplicates of ones already saved')
+    parser.add_argument('--find-duplicates', action='store_true',
+                       help='List near-duplicate NPCs in the collection')
+    parser.add_argument('--remove-duplicates', action='store_true',
+                       help='Delete individual NPCs that near-duplicate an earlier NPC')
+    parser.add_argument('--similarity', type=float, default=0.75, metavar='FRACTION',
+                       help='Share of traits two NPCs need in common to count as duplicates (default: 0.75)')
     parser.add_argument('--no-save', action='store_true',
                        help='Generate NPC without saving to collection')
+    parser.add_argument('--unique-names', action='store_true',
+                       help='Never reuse a name that is already in your collection')
     
     # Filter options for viewing
     parser.add_argument('--filter-job', choices=list(JOBS.keys()),
@@ -1020,22 +1332,132 @@ def main():
                        help='Filter collection by gender')
     parser.add_argument('--filter-species', choices=SPECIES,
                        help='Filter collection by species')
+    parser.add_argument('--search', '-s', metavar='QUERY',
+                       help='Full-text search of the collection (e.g. "debt AND sailor", "scar*")')
+    parser.add_argument('--limit', type=int, default=20,
+                       help='Entries per page for --view, or results for --search (default: 20, 0 = all)')
+    parser.add_argument('--offset', type=int, default=0,
+                       help='Skip this many matching entries in --view (for paging)')
+    parser.add_argument('--since', metavar='DATE',
+                       help='With --view: only NPCs saved on or after this date (YYYY-MM-DD)')
+    parser.add_argument('--sort', choices=['oldest', 'newest'], default='oldest',
+                       help='With --view: show oldest or newest NPCs first (default: oldest)')
+    parser.add_argument('--led-by', choices=SPECIES, metavar='SPECIES',
+                       help='With --view: only groups whose leader is this species (combine with --group)')
+    
+    # Display options
+    parser.add_argument('--style', choices=['plain', 'markdown', 'ansi'], default='plain',
+                       help='How NPCs are printed: plain text, Markdown or ANSI colours (default: plain)')
+    
+    # Export options
+    parser.add_argument('--export', metavar='FILE',
+                       help="Export the collection to FILE ('-' for stdout); honours --filter-* options")
+    parser.add_argument('--format', choices=['jsonl', 'csv', 'markdown', 'foundry'],
+                       help='Export format (default: from the file extension, else jsonl)')
+    parser.add_argument('--compress', choices=['gzip', 'zstd'],
+                       help='Compress the export (default: from a .gz/.zst extension)')
     
     # Help options
     parser.add_argument('--list-jobs', action='store_true',
                        help='List all available job categories')
     
+    # Performance options
+    parser.add_argument('--profile', action='store_true',
+                       help='Print how long each phase (AI, parsing, loading, saving, display) took')
+    parser.add_argument('--profile-dump', metavar='FILE',
+                       help='Also save full cProfile stats to FILE (view with python -m pstats FILE)')
+    parser.add_argument('--metrics-file', metavar='FILE',
+                       help='Export phase timings to FILE (.json, or .prom for Prometheus)')
+    
     args = parser.parse_args()
     
+    if not (args.profile or args.profile_dump or args.metrics_file):
+        run(args)
+        return
+    
+    import npc_profiling
+    npc_profiling.enable()
+    profiler = None
+    if args.profile_dump:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        run(args)
+    finally:
+        wall_time = time.perf_counter() - start
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile_dump)
+            print(f"\ncProfile stats saved to {args.profile_dump}")
+        if args.profile:
+            npc_profiling.print_report(wall_time)
+        if args.metrics_file:
+            npc_profiling.write_metrics(args.metrics_file, wall_time)
+            print(f"Metrics saved to {args.metrics_file}")
+
+
+def run(args):
+    """Carry out whatever the command-line arguments asked for"""
+    set_style(args.style)
+    
     # Handle collection viewing
     if args.view:
-        view_npc_collection(args.filter_job, args.filter_gender, args.filter_species)
+        if args.group or args.led_by:
+            view_group_query(args.group, args.led_by)
+        else:
+            view_npc_collection(args.filter_job, args.filter_gender, args.filter_species,
+                                limit=args.limit, offset=args.offset, since=args.since, sort=args.sort)
         return
     
     if args.view_id:
         view_npc_details(args.view_id)
         return
     
+    if args.search:
+        view_search_results(args.search, args.limit)
+        return
+    
+    if args.related:
+        view_related_npcs(args.related)
+        return
+    
+    if args.stats:
+        view_collection_stats()
+        return
+    
+    if args.ai_stats:
+        try:
+            view_ai_usage()
+        except ImportError as e:
+            print(f"❌ AI dependencies not available: {e}")
+        return
+    
+    if args.find_duplicates or args.remove_duplicates:
+        view_duplicates(args.similarity, remove=args.remove_duplicates)
+        return
+    
+    if args.migrate:
+        result = migrate_collection()
+        if result:
+            print(f"✅ Upgraded {result[0]} entries from format version {result[1]} to {SCHEMA_VERSION}")
+        else:
+            print(f"Collection is already at format version {SCHEMA_VERSION}.")
+        return
+    
+    if args.export:
+        from npc_export import export_collection
+        try:
+            count = export_collection(args.export, args.format, args.compress, filter_job=args.filter_job,
+                                      filter_gender=args.filter_gender, filter_species=args.filter_species)
+        except (ValueError, OSError) as e:
+            print(f"Export failed: {e}", file=sys.stderr)
+            return
+        if args.export != "-":
+            print(f"📦 Exported {count} NPCs to {args.export}")
+        return
+    
     # Handle help options
     if args.list_jobs:
         print("📋 Available Job Categories:")
@@ -1043,10 +1465,24 @@ def main():
             print(f"  {category}: {', '.join(jobs)}")
         return
     
+    if args.warm_up:
+        try:
+            from ai_npc_generator import OLLAMA_KEEP_ALIVE, OLLAMA_MODEL, warm_up_model
+        except ImportError as e:
+            print(f"❌ AI dependencies not available: {e}")
+            return
+        load_time = warm_up_model()
+        if load_time is not None:
+            print(f"✅ {OLLAMA_MODEL} is loaded (took {load_time:.2f} s) and stays loaded for {OLLAMA_KEEP_ALIVE}")
+        return
+    
     # Handle AI import if needed
-    if args.ai:
+    pinger = None
+    if args.ai or args.hybrid:
         try:
-            from ai_npc_generator import generate_ai_npc, generate_ai_group, test_ollama_connection
+            from ai_npc_generator import (KeepAlivePinger, add_ai_flavor, add_ai_flavor_to_group, enrich_group,
+                                          enrich_items, generate_ai_group, generate_ai_npc,
+                                          test_ollama_connection, warm_up_model)
             
             # Test Ollama connection
             if not test_ollama_connection():
@@ -1055,55 +1491,145 @@ def main():
                 print("  2. Your .env file is configured correctly")
                 print("  3. The specified model is available")
                 print("\nFalling back to regular generation...")
-                args.ai = False
+                args.ai = args.hybrid = False
             else:
                 print("✅ Connected to Ollama successfully!")
+                # Load the model now rather than in the middle of the first NPC,
+                # and keep it loaded however long this run takes
+                load_time = warm_up_model()
+                if load_time:
+                    print(f"🔥 Model loaded in {load_time:.2f} s")
+                pinger = KeepAlivePinger().start()
                 
         except ImportError as e:
             print(f"❌ AI dependencies not available: {e}")
             print("Install required packages:")
             print("  pip install python-dotenv requests")
             print("\nFalling back to regular generation...")
-            args.ai = False
-    
-    print("Welcome to Mike's D&D NPC Generator!")
-    if args.ai:
-        print("🤖 AI-Powered Mode Enabled!")
-    print("=" * 40)
-    
-    # Generate based on arguments
-    if args.group:
-        # Generate a group
+            args.ai = args.hybrid = False
+    
+    # Everything from here on runs with the keep-alive pinger going - stop it however we leave
+    try:
+        # Seed the name allocator once with every name already in the collection
+        name_allocator = None
+        if args.unique_names:
+            from npc_names import NameAllocator
+            name_allocator = NameAllocator(FIRST_NAMES, LAST_NAMES, collection_names(load_npc_collection()))
+            if args.ai:
+                print("⚠️  --unique-names can't stop the AI from reusing a saved name (only fall-back NPCs are checked)")
+    
+        def distinct(generate):
+            """Call generate(), retrying near-duplicates of saved NPCs if --no-duplicates is on"""
+            if not args.no_duplicates:
+                return generate()
+            from npc_dedup import generate_distinct
+            result, matches = generate_distinct(generate, args.similarity)
+            if matches:
+                print(f"⚠️  Still similar to NPC #{matches[0]['id'] or matches[0]['entry_id']} "
+                      f"({matches[0]['similarity']:.0%} of traits) after several tries")
+            return result
+    
+        print("Welcome to Mike's D&D NPC Generator!")
         if args.ai:
-            group = generate_ai_group(args.group, args.count, args.job, args.cr)
-        else:
-            group = generate_group(args.group, args.count, args.job, args.cr)
-            
-        if group:
-            display_group(group)
-            
+            print("🤖 AI-Powered Mode Enabled!")
+        elif args.hybrid:
+            print("🤖 Hybrid Mode: AI-written personalities, motivations and secrets")
+        print("=" * 40)
+    
+        # Generate based on arguments
+        if args.encounter:
+            from encounter_builder import build_encounter, describe_encounter, parse_party
+            try:
+                encounter = build_encounter(parse_party(args.party), args.encounter, job_filter=args.job,
+                                            group_type=args.group or "crew", max_count=args.max_foes,
+                                            lazy_stats=args.lazy_stats)
+            except ValueError as e:
+                print(f"Could not build encounter: {e}")
+                return
+        
+            if args.hybrid:
+                enrich_group(encounter)
+            print(f"\n🗡️  {describe_encounter(encounter)}")
+            display_group(encounter)
+        
             if not args.no_save:
-                npc_id = add_npc_to_collection(None, group)
+                npc_id = add_npc_to_collection(None, encounter)
                 print(f"\n💾 Saved as NPC #{npc_id}")
                 print(f"Use '--view-id {npc_id}' to view again later")
-        else:
-            print("Failed to generate group. Try again or use regular generation.")
-    else:
-        # Generate a single NPC
-        if args.ai:
-            npc = generate_ai_npc(job_filter=args.job, gender_filter=args.gender, challenge_rating=args.cr)
-        else:
-            npc = generate_npc(job_filter=args.job, gender_filter=args.gender, challenge_rating=args.cr)
+        elif args.settlement:
+            from settlement_generator import describe_settlement, generate_settlement, load_spec
+            try:
+                spec = load_spec(args.settlement)
+            except ValueError as e:
+                print(f"Could not plan settlement: {e}")
+                return
+        
+            print("\n🏘️  " + "\n".join(describe_settlement(spec, args.population)))
+            items = generate_settlement(spec, args.population, name_allocator=name_allocator,
+                                        lazy_stats=args.lazy_stats)
+            if args.hybrid:
+                items = enrich_items(items)
+            if args.no_save:
+                entries = sum(1 for _ in items)
+                print(f"\nGenerated {entries} households and groups (not saved)")
+            else:
+                entries = stream_into_collection(items)
+                print(f"\n💾 Saved {entries} households and groups to your collection")
+                print("Use '--view' or '--search' to browse them")
+        elif args.group:
+            # Generate a group
+            if args.ai:
+                group = distinct(lambda: generate_ai_group(args.group, args.count, args.job, args.cr,
+                                                           name_allocator=name_allocator,
+                                                           lazy_stats=args.lazy_stats))
+            else:
+                # Hybrid: near-duplicates are rejected before the AI sees them, so it's asked only once
+                group = distinct(lambda: generate_group(args.group, args.count, args.job, args.cr,
+                                                        name_allocator=name_allocator, lazy_stats=args.lazy_stats))
+                if group and args.hybrid:
+                    add_ai_flavor_to_group(group)
             
-        if npc:
-            display_npc(npc)
+            if group:
+                display_group(group)
             
-            if not args.no_save:
-                npc_id = add_npc_to_collection(npc)
-                print(f"\n💾 Saved as NPC #{npc_id}")
-                print(f"Use '--view-id {npc_id}' to view again later")
+                if not args.no_save:
+                    npc_id = add_npc_to_collection(None, group)
+                    print(f"\n💾 Saved as NPC #{npc_id}")
+                    print(f"Use '--view-id {npc_id}' to view again later")
+            else:
+                print("Failed to generate group. Try again or use regular generation.")
         else:
-            print("Failed to generate NPC. Try again or use regular generation.")
+            # Generate a single NPC
+            if args.ai:
+                npc = distinct(lambda: generate_ai_npc(job_filter=args.job, gender_filter=args.gender,
+                                                       challenge_rating=args.cr, name_allocator=name_allocator,
+                                                       lazy_stats=args.lazy_stats))
+            else:
+                npc = distinct(lambda: generate_npc(job_filter=args.job, gender_filter=args.gender,
+                                                    challenge_rating=args.cr, name_allocator=name_allocator,
+                                                    lazy_stats=args.lazy_stats))
+                if npc and args.hybrid:
+                    add_ai_flavor(npc)
+            
+            if npc:
+                display_npc(npc)
+            
+                if not args.no_save:
+                    npc_id = add_npc_to_collection(npc)
+                    print(f"\n💾 Saved as NPC #{npc_id}")
+                    print(f"Use '--view-id {npc_id}' to view again later")
+            else:
+                print("Failed to generate NPC. Try again or use regular generation.")
+    finally:
+        if pinger:
+            pinger.stop()
+    
+    if args.ai or args.hybrid:
+        from ai_npc_generator import session_usage
+        usage = session_usage()
+        if usage:
+            print("\n🤖 AI usage this run:")
+            print_ai_usage(usage)
     
     print("\n" + "=" * 40)
     print("Happy DMing! 🎲")
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+Sidecar index for the NPC collection
+npcs.json stays the real record of every NPC. This module keeps a small
+SQLite database next to it so questions like "who is in this NPC's group?"
+or "which crews are led by a Tiefling?" can be answered without walking
+the whole collection. It also keeps running counts per species, class,
+gender, CR, HP and AC for --stats, and the near-duplicate buckets used by
+--no-duplicates. The index can always be rebuilt from npcs.json.
+"""
+
+import os
+import sqlite3
+from collections import Counter
+from contextlib import closing
+
+from npc_dedup import SEPARATOR, band_keys, npc_traits
+
+NPC_INDEX_FILE = "index.db"
+
+# Bump whenever SCHEMA changes - older index files are dropped and rebuilt
+INDEX_VERSION = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS groups (
+    id INTEGER PRIMARY KEY,
+    group_type TEXT,
+    group_key TEXT,
+    timestamp TEXT
+);
+CREATE TABLE IF NOT EXISTS npcs (
+    id INTEGER,
+    entry_id INTEGER,
+    group_id INTEGER,
+    name TEXT,
+    last_name TEXT,
+    species TEXT,
+    class TEXT,
+    class_category TEXT,
+    gender TEXT,
+    motivation TEXT,
+    relationship TEXT,
+    timestamp TEXT,
+    traits TEXT
+);
+CREATE INDEX IF NOT EXISTS npcs_by_id ON npcs (id);
+CREATE INDEX IF NOT EXISTS npcs_by_entry ON npcs (entry_id);
+CREATE INDEX IF NOT EXISTS npcs_by_group ON npcs (group_id, relationship);
+CREATE INDEX IF NOT EXISTS npcs_by_last_name ON npcs (last_name);
+CREATE INDEX IF NOT EXISTS npcs_by_motivation ON npcs (motivation);
+CREATE INDEX IF NOT EXISTS npcs_by_species_role ON npcs (species, relationship);
+CREATE INDEX IF NOT EXISTS npcs_by_category ON npcs (class_category);
+CREATE INDEX IF NOT EXISTS groups_by_key ON groups (group_key);
+CREATE TABLE IF NOT EXISTS npc_bands (
+    band INTEGER,
+    bucket INTEGER,
+    npc_rowid INTEGER,
+    PRIMARY KEY (band, bucket, npc_rowid)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS stats (
+    dimension TEXT,
+    value TEXT,
+    count INTEGER,
+    PRIMARY KEY (dimension, value)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS npc_text USING fts5 (
+    name, species, class, personality, speech_pattern, voice, motivation,
+    secret, appearance, notes,
+    tokenize = 'porter unicode61'
+);
+"""
+
+# Fields that get their own column in the full-text index
+TEXT_FIELDS = ["name", "species", "class", "personality", "speech_pattern", "voice",
+               "motivation", "secret"]
+# Fields folded together into the 'appearance' column
+APPEARANCE_FIELDS = ["height", "build", "hair_color", "hair_style", "eye_color",
+                     "distinctive_feature", "clothing_style"]
+# Everything else free-form (AI NPCs sometimes add fields of their own)
+NOT_SEARCHABLE_FIELDS = {"id", "group_id", "type", "timestamp", "stat_block", "class_category",
+                         "gender", "relationship"}
+
+# Running totals kept in the stats table, in display order
+STAT_DIMENSIONS = ["entries", "species", "class_category", "gender", "challenge_rating",
+                   "hit_points", "armor_class", "lazy_stat_blocks"]
+# Width of each hit point histogram bucket
+HP_BUCKET = 10
+
+# Columns that find_npcs() accepts as filters
+NPC_FILTER_COLUMNS = [
+    "id", "entry_id", "group_id", "name", "last_name", "species", "class",
+    "class_category", "gender", "motivation", "relationship"
+]
+
+
+def index_path():
+    """Location of the index database (next to npcs.json)"""
+    from npc_storage import NPC_DATA_DIR
+    return os.path.join(NPC_DATA_DIR, NPC_INDEX_FILE)
+
+
+def collection_signature():
+    """
+    Cheap fingerprint of npcs.json (size and modification time) so we can
+    tell whether the index still matches it without reading the file
+    """
+    from npc_storage import NPC_DATA_FILE
+    try:
+        stat = os.stat(NPC_DATA_FILE)
+    except OSError:
+        return "missing"
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def connect_index():
+    """Open the index database, creating the tables if needed"""
+    from npc_storage import ensure_data_directory
+    ensure_data_directory()
+    conn = sqlite3.connect(index_path())
+    conn.row_factory = sqlite3.Row
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version != INDEX_VERSION:
+        # Index files from older versions are just dropped; open_index rebuilds them
+        for table in ["meta", "groups", "npcs", "npc_text", "stats", "npc_bands"]:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def open_index():
+    """
+    Open the index, rebuilding it first if npcs.json changed behind our back
+    (hand edits, an older version of the generator, a deleted index...)
+    """
+    conn = connect_index()
+    row = conn.execute("SELECT value FROM meta WHERE key = 'signature'").fetchone()
+    if row is None or row["value"] != collection_signature():
+        from npc_storage import collection_lock, load_npc_collection
+        # Hold the lock so a writer can't change npcs.json halfway through
+        with collection_lock():
+            rebuild_index(load_npc_collection(), conn)
+    return conn
+
+
+def group_key_for(group_type):
+    """Map a stored group name like 'Crew/Gang' back to its GROUP_TYPES key"""
+    from npc_generator import GROUP_TYPES
+    for key, info in GROUP_TYPES.items():
+        if info["name"] == group_type or key == group_type:
+            return key
+    return None
+
+
+def _npc_row(npc, entry_id, group_id, timestamp, traits):
+    name = npc.get("name", "")
+    return (
+        npc.get("id"), entry_id, group_id, name,
+        name.split()[-1] if name.split() else "",
+        npc.get("species"),
+        npc.get("class"), npc.get("class_category"), npc.get("gender"),
+        npc.get("motivation"), npc.get("relationship"), timestamp,
+        SEPARATOR.join(traits)
+    )
+
+
+def _text_row(npc):
+    """Columns of the full-text index for one NPC"""
+    appearance = " ".join(str(npc.get(field, "")) for field in APPEARANCE_FIELDS)
+    notes = " ".join(
+        str(value) for field, value in npc.items()
+        if field not in NOT_SEARCHABLE_FIELDS and field not in APPEARANCE_FIELDS
+        and field not in TEXT_FIELDS and isinstance(value, str)
+    )
+    job = f"{npc.get('class', '')} {npc.get('class_category', '')}"
+    return (npc.get("name"), npc.get("species"), job, npc.get("personality"), npc.get("speech_pattern"),
+            npc.get("voice"), npc.get("motivation"), npc.get("secret"), appearance, notes)
+
+
+def count_stats(counts, npc):
+    """Add one NPC's species, class, gender, CR, HP and AC to a Counter of (dimension, value)"""
+    counts["species", npc.get("species") or "Unknown"] += 1
+    counts["class_category", npc.get("class_category") or "Unknown"] += 1
+    counts["gender", npc.get("gender") or "Unknown"] += 1
+    stat_block = npc.get("stat_block")
+    if stat_block:
+        counts["challenge_rating", stat_block["challenge_rating"]] += 1
+        if "hit_points" not in stat_block:
+            # Lazy stat block - HP and AC aren't rolled until it's shown, so just count it
+            counts["lazy_stat_blocks", "lazy"] += 1
+            return
+        low = stat_block["hit_points"] // HP_BUCKET * HP_BUCKET
+        counts["hit_points", f"{low}-{low + HP_BUCKET - 1}"] += 1
+        counts["armor_class", str(stat_block["armor_class"])] += 1
+    else:
+        counts["challenge_rating", "none"] += 1
+
+
+def save_stats(conn, counts):
+    """Fold a Counter from count_stats into the running totals"""
+    conn.executemany(
+        "INSERT INTO stats (dimension, value, count) VALUES (?, ?, ?) "
+        "ON CONFLICT (dimension, value) DO UPDATE SET count = count + excluded.count",
+        [(dimension, value, count) for (dimension, value), count in counts.items()]
+    )
+
+
+def index_entry(conn, entry, counts=None):
+    """
+    Add one collection entry (individual or group) to the index
+    counts: Counter that collects the entry's statistics (see save_stats)
+    """
+    timestamp = entry.get("timestamp")
+    if counts is not None:
+        counts["entries", "group" if entry.get("type") == "group" else "individual"] += 1
+    if entry["type"] == "group":
+        conn.execute(
+            "INSERT OR REPLACE INTO groups (id, group_type, group_key, timestamp) VALUES (?, ?, ?, ?)",
+            (entry["id"], entry["group_type"], group_key_for(entry["group_type"]), timestamp)
+        )
+        members = [(member, entry["id"]) for member in entry["members"]]
+    else:
+        members = [(entry, None)]
+    for npc, group_id in members:
+        traits = npc_traits(npc)
+        cursor = conn.execute(
+            "INSERT INTO npcs (id, entry_id, group_id, name, last_name, species, class, class_category, "
+            "gender, motivation, relationship, timestamp, traits) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            _npc_row(npc, entry["id"], group_id, timestamp, traits)
+        )
+        # The text row shares its rowid with the npcs row so results can be joined back
+        conn.execute(
+            "INSERT INTO npc_text (rowid, name, species, class, personality, speech_pattern, voice, "
+            "motivation, secret, appearance, notes) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (cursor.lastrowid,) + _text_row(npc)
+        )
+        # Near-duplicate buckets (see npc_dedup.py)
+        conn.executemany("INSERT INTO npc_bands (band, bucket, npc_rowid) VALUES (?, ?, ?)",
+                         [(band, bucket, cursor.lastrowid) for band, bucket in enumerate(band_keys(traits))])
+        if counts is not None:
+            count_stats(counts, npc)
+
+
+def mark_index_current(conn):
+    """Record that the index now matches npcs.json as it is on disk"""
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('signature', ?)",
+                 (collection_signature(),))
+    conn.commit()
+
+
+def rebuild_index(collection, conn=None):
+    """Throw the index away and rebuild it from a loaded collection"""
+    own_connection = conn is None
+    if own_connection:
+        conn = connect_index()
+    try:
+        conn.execute("DELETE FROM npcs")
+        conn.execute("DELETE FROM groups")
+        conn.execute("DELETE FROM npc_text")
+        conn.execute("DELETE FROM stats")
+        conn.execute("DELETE FROM npc_bands")
+        counts = Counter()
+        for entry in collection["npcs"]:
+            index_entry(conn, entry, counts)
+        save_stats(conn, counts)
+        mark_index_current(conn)
+    finally:
+        if own_connection:
+            conn.close()
+
+
+def update_index(entries, collection, previous_signature):
+    """
+    Add freshly saved entries to the index. Called by add_npcs_to_collection
+    right after npcs.json is written, so the index never needs a full rebuild.
+    previous_signature: collection_signature() from just before the save -
+    if the index did not match it, the index is rebuilt from collection.
+    """
+    with closing(connect_index()) as conn:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'signature'").fetchone()
+        if row is None or row["value"] != previous_signature:
+            rebuild_index(collection, conn)
+            return
+        counts = Counter()
+        for entry in entries:
+            index_entry(conn, entry, counts)
+        save_stats(conn, counts)
+        mark_index_current(conn)
+
+
+def collection_stats():
+    """
+    Running totals for the whole collection, read straight from the index:
+    {"entries": {"individual": n, "group": n}, "species": {"Elf": n, ...},
+     "class_category": ..., "gender": ..., "challenge_rating": ...,
+     "hit_points": {"10-19": n, ...}, "armor_class": {"14": n, ...},
+     "lazy_stat_blocks": {"lazy": n}}
+    Values within each dimension are ordered most common first.
+    """
+    stats = {dimension: {} for dimension in STAT_DIMENSIONS}
+    with closing(open_index()) as conn:
+        rows = conn.execute("SELECT dimension, value, count FROM stats WHERE count > 0 "
+                            "ORDER BY dimension, count DESC, value")
+        for row in rows:
+            stats.setdefault(row["dimension"], {})[row["value"]] = row["count"]
+    return stats
+
+
+def find_npcs(limit=None, **filters):
+    """
+    Look up NPCs by indexed traits, e.g. find_npcs(last_name="Tealeaf")
+    or find_npcs(species="Tiefling", relationship="Leader")
+    Returns a list of dicts with the indexed fields
+    """
+    unknown = set(filters) - set(NPC_FILTER_COLUMNS)
+    if unknown:
+        raise ValueError(f"Cannot filter on: {', '.join(sorted(unknown))}")
+
+    where = " AND ".join(f"{column} = ?" for column in filters) or "1"
+    query = f"SELECT * FROM npcs WHERE {where} ORDER BY entry_id, id"
+    params = list(filters.values())
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+    with closing(open_index()) as conn:
+        return [dict(row) for row in conn.execute(query, params)]
+
+
+def search_npcs(query, limit=20):
+    """
+    Full-text search over names, personalities, secrets, motivations,
+    appearance and any extra AI-written text. Supports AND / OR / NOT,
+    "quoted phrases" and prefix* searches. Best matches come first.
+    Returns a list of dicts with the indexed fields plus a 'snippet'
+    (limit=0 returns every match)
+    """
+    sql = (
+        "SELECT npcs.*, snippet(npc_text, -1, '[', ']', '...', 10) AS snippet "
+        "FROM npc_text JOIN npcs ON npcs.rowid = npc_text.rowid "
+        "WHERE npc_text MATCH ? ORDER BY rank LIMIT ?"
+    )
+    with closing(open_index()) as conn:
+        try:
+            return [dict(row) for row in conn.execute(sql, (query, limit or -1))]
+        except sqlite3.OperationalError as e:
+            raise ValueError(f"Invalid search '{query}': {e}") from e
+
+
+def group_members(group_id):
+    """All members of a group entry, in the order they were generated"""
+    with closing(open_index()) as conn:
+        rows = conn.execute("SELECT * FROM npcs WHERE group_id = ? ORDER BY rowid", (group_id,))
+        return [dict(row) for row in rows]
+
+
+def group_of(npc_id):
+    """Return the group row an NPC belongs to, or None for individuals"""
+    with closing(open_index()) as conn:
+        row = conn.execute(
+            "SELECT groups.* FROM npcs JOIN groups ON groups.id = npcs.group_id WHERE npcs.id = ?",
+            (npc_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+
+def find_group_members(group_type=None, leader_species=None, leader_role="Leader"):
+    """
+    Graph query over group membership, e.g. every member of a crew led by
+    a Tiefling: find_group_members("crew", leader_species="Tiefling")
+    group_type: GROUP_TYPES key like 'crew' (or None for any group)
+    leader_species: species of the member holding leader_role
+    leader_role: relationship that counts as leading the group
+    """
+    joins = ["SELECT members.rowid AS member_row, members.*, groups.group_type FROM groups",
+             "JOIN npcs AS members ON members.group_id = groups.id"]
+    where = []
+    params = []
+    if leader_species:
+        joins.append("JOIN npcs AS leader ON leader.group_id = groups.id")
+        where.append("leader.relationship = ? AND leader.species = ?")
+        params.extend([leader_role, leader_species])
+    if group_type:
+        where.append("groups.group_key = ?")
+        params.append(group_type)
+
+    query = " ".join(joins)
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY groups.id, members.rowid"
+    with closing(open_index()) as conn:
+        # A group with two matching leaders would list its members twice
+        seen = set()
+        results = []
+        for row in conn.execute(query, params):
+            if row["member_row"] in seen:
+                continue
+            seen.add(row["member_row"])
+            result = dict(row)
+            del result["member_row"]
+            results.append(result)
+        return results
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Unique name allocation for NPC populations
+Hands out names that are never repeated within a scope (a collection,
+a campaign, a town...) without having to scan the collection each time
+"""
+
+import math
+import random
+
+# Syllables used to synthesize extra first names once the hand-written
+# FIRST_NAMES list runs out. Each species gets its own flavor.
+# Format: (prefixes, middles, suffixes) - an empty middle keeps names short
+NAME_SYLLABLES = {
+    "Human": (
+        ["Al", "Bran", "Cor", "Ed", "Gar", "Hal", "Jor", "Mar", "Ro", "Tam", "Wil", "El"],
+        ["", "a", "e", "i", "o", "dr", "ri"],
+        ["ric", "wen", "mond", "ton", "ly", "na", "ra", "win", "beth", "son"]
+    ),
+    "Elf": (
+        ["Ae", "Cael", "Eil", "Fae", "Ith", "Lia", "Mir", "Nae", "Syl", "Tha", "Vael", "Yl"],
+        ["", "la", "ri", "the", "va", "ni", "ly"],
+        ["dor", "riel", "wyn", "lith", "thas", "nor", "ra", "iel", "ion", "sera"]
+    ),
+    "Dwarf": (
+        ["Bal", "Bor", "Dag", "Dur", "Eb", "Gim", "Har", "Kil", "Mor", "Rur", "Thor", "Vond"],
+        ["", "a", "i", "ur", "ek", "om", "un"],
+        ["din", "grim", "ra", "dal", "rak", "nar", "hild", "gan", "bek", "trud"]
+    ),
+    "Halfling": (
+        ["Bel", "Cor", "Fin", "Lav", "Mer", "Mil", "Pip", "Ros", "Sam", "Tob", "Wel", "Cal"],
+        ["", "a", "i", "o", "li", "ri", "an"],
+        ["do", "by", "lo", "wise", "ry", "nan", "kin", "ie", "ett", "lie"]
+    ),
+    "Dragonborn": (
+        ["Ar", "Bala", "Dona", "Gher", "Kri", "Med", "Nal", "Pand", "Rho", "Sha", "Tor", "Vyr"],
+        ["", "a", "ja", "ka", "ra", "za", "th"],
+        ["jhan", "sar", "ash", "rinn", "van", "ghor", "thys", "kris", "nar", "zhan"]
+    ),
+    "Gnome": (
+        ["Al", "Bim", "Dim", "Fon", "Glim", "Nim", "Orr", "Quil", "Tink", "Wren", "Zook", "Bree"],
+        ["", "b", "ble", "wi", "zi", "pip", "el"],
+        ["ston", "ble", "kin", "wick", "nottin", "ra", "ella", "fiz", "bo", "le"]
+    ),
+    "Half-Elf": (
+        ["Ael", "Bren", "Cas", "Dar", "El", "Fen", "Ian", "Lor", "Ser", "Tav", "Val", "Ys"],
+        ["", "a", "e", "ia", "ri", "wy", "o"],
+        ["wyn", "ric", "lian", "ra", "dor", "eth", "is", "len", "mir", "na"]
+    ),
+    "Half-Orc": (
+        ["Dench", "Feng", "Gell", "Hen", "Hol", "Kar", "Krusk", "Mhur", "Ront", "Shump", "Thok", "Yev"],
+        ["", "a", "u", "o", "ag", "ru", "ug"],
+        ["ga", "gash", "ka", "rak", "ren", "tha", "ush", "gar", "ma", "ok"]
+    ),
+    "Tiefling": (
+        ["Ak", "Am", "Bar", "Dam", "Ekem", "Kal", "Lev", "Mor", "Nem", "Ori", "Sker", "Zer"],
+        ["", "a", "e", "i", "ra", "yo", "ak"],
+        ["menos", "non", "akos", "ista", "thos", "lix", "ra", "eus", "kos", "ith"]
+    ),
+    "Aasimar": (
+        ["Ar", "Cel", "Dael", "Iel", "Lu", "Mal", "Ori", "Ra", "Sol", "Tha", "Ur", "Zar"],
+        ["", "a", "e", "ie", "ra", "li", "un"],
+        ["iel", "sa", "el", "on", "ar", "ara", "ius", "ael", "ia", "en"]
+    ),
+    "Genasi": (
+        ["Aer", "Bre", "Cin", "Ember", "Fla", "Gal", "Ish", "Kor", "Pyr", "Stor", "Tid", "Zeph"],
+        ["", "a", "e", "o", "ri", "va", "un"],
+        ["a", "is", "on", "ra", "yr", "ex", "ith", "us", "el", "ka"]
+    ),
+    "Goliath": (
+        ["Aukan", "Eglath", "Gae", "Ilik", "Kav", "Mane", "Nal", "Orn", "Pau", "Tha", "Vaun", "Keo"],
+        ["", "a", "i", "u", "ga", "la", "ro"],
+        ["nath", "ak", "al", "li", "thi", "kal", "ea", "ug", "o", "vak"]
+    )
+}
+
+# Syllables for synthesized family names (shared by all species)
+SURNAME_SYLLABLES = (
+    ["Amber", "Ash", "Black", "Bright", "Copper", "Dawn", "Deep", "Frost",
+     "Gold", "Iron", "Moon", "Oak", "Raven", "Silver", "Stone", "Storm"],
+    ["bane", "brook", "cloak", "dale", "fall", "forge", "hand", "heart",
+     "hollow", "mantle", "ridge", "shadow", "song", "thorn", "vale", "wood"]
+)
+
+
+def count_synthetic_first_names(species):
+    """How many distinct first names the syllable tables can build for a species"""
+    prefixes, middles, suffixes = NAME_SYLLABLES.get(species, NAME_SYLLABLES["Human"])
+    return len(prefixes) * len(middles) * len(suffixes)
+
+
+def synthesize_first_name(species, index):
+    """Build the index-th synthetic first name for a species (0 <= index < count)"""
+    prefixes, middles, suffixes = NAME_SYLLABLES.get(species, NAME_SYLLABLES["Human"])
+    index, suffix = divmod(index, len(suffixes))
+    prefix, middle = divmod(index, len(middles))
+    return (prefixes[prefix] + middles[middle] + suffixes[suffix]).capitalize()
+
+
+def synthesize_last_name(index):
+    """Build the index-th synthetic family name"""
+    firsts, seconds = SURNAME_SYLLABLES
+    first, second = divmod(index, len(seconds))
+    return firsts[first] + seconds[second]
+
+
+class _PermutationWalk:
+    """
+    Visits every number in range(size) exactly once, in a shuffled order,
+    without building the whole list: position -> (offset + position * step) % size
+    with step coprime to size is a permutation of the range.
+    """
+    __slots__ = ("size", "offset", "step", "position")
+
+    def __init__(self, size, rng):
+        self.size = size
+        self.offset = rng.randrange(size) if size else 0
+        step = rng.randrange(1, size) if size > 1 else 1
+        while math.gcd(step, size) != 1:
+            step += 1
+        self.step = step
+        self.position = 0
+
+    def next(self):
+        """Return the next index, or None once every index has been visited"""
+        if self.position >= self.size:
+            return None
+        index = (self.offset + self.position * self.step) % self.size
+        self.position += 1
+        return index
+
+
+class NameAllocator:
+    """
+    Hands out "First Last" names that are unique within one scope.
+
+    The hand-written first_names x last_names space (npc_generator's
+    FIRST_NAMES and LAST_NAMES) is used first. Once it
+    runs dry (or for a fixed family name, once the first names do) names
+    are synthesized from the species syllable tables. Every name space is
+    sampled without replacement and used names live in a set, so each
+    allocation costs the same no matter how big the population gets.
+    """
+
+    def __init__(self, first_names, last_names, used_names=(), rng=None, synthesize=True):
+        self.first_names = first_names
+        self.last_names = last_names
+        self.used = set(used_names)
+        self.rng = rng or random
+        self.synthesize = synthesize
+        self._walks = {}
+
+    def __contains__(self, name):
+        return name in self.used
+
+    def reserve(self, name):
+        """Mark a name as taken. Returns False if it was already in use."""
+        if name in self.used:
+            return False
+        self.used.add(name)
+        return True
+
+    def allocate(self, species=None, last_name=None):
+        """
+        Return a name that has not been handed out in this scope yet
+        species: picks the syllable table used for synthesized names
+        last_name: keep this family name and only vary the first name
+        Raises ValueError when every name space is exhausted
+        """
+        for space in self._name_spaces(species, last_name):
+            name = self._draw(*space)
+            if name:
+                return name
+        raise ValueError(f"No unique names left for species '{species}'"
+                         + (f" with last name '{last_name}'" if last_name else ""))
+
+    def _name_spaces(self, species, last_name):
+        """The name spaces to try, in order: (key, size, index -> name)"""
+        firsts, lasts = self.first_names, self.last_names
+        synthetic_species = species if species in NAME_SYLLABLES else "Human"
+        synthetic_firsts = count_synthetic_first_names(synthetic_species)
+        synthetic_lasts = len(SURNAME_SYLLABLES[0]) * len(SURNAME_SYLLABLES[1])
+
+        def synthetic_first(index):
+            return synthesize_first_name(synthetic_species, index)
+
+        if last_name:
+            yield (("curated", last_name), len(firsts),
+                   lambda i: f"{firsts[i]} {last_name}")
+            if self.synthesize:
+                yield (("synthetic", synthetic_species, last_name), synthetic_firsts,
+                       lambda i: f"{synthetic_first(i)} {last_name}")
+            return
+
+        yield (("curated",), len(firsts) * len(lasts),
+               lambda i: f"{firsts[i // len(lasts)]} {lasts[i % len(lasts)]}")
+        if self.synthesize:
+            all_lasts = len(lasts) + synthetic_lasts
+
+            def synthetic_name(i):
+                first, last = divmod(i, all_lasts)
+                if last < len(lasts):
+                    surname = lasts[last]
+                else:
+                    surname = synthesize_last_name(last - len(lasts))
+                return f"{synthetic_first(first)} {surname}"
+
+            yield (("synthetic", synthetic_species), synthetic_firsts * all_lasts,
+                   synthetic_name)
+
+    def _draw(self, key, size, build_name):
+        """Walk one name space until an unused name turns up (None if exhausted)"""
+        walk = self._walks.get(key)
+        if walk is None:
+            walk = self._walks[key] = _PermutationWalk(size, self.rng)
+        while True:
+            index = walk.next()
+            if index is None:
+                return None
+            name = build_name(index)
+            if name not in self.used:
+                self.used.add(name)
+                return name
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Lightweight timing instrumentation for the NPC generator
+Hot paths are wrapped with @timed("phase") or `with span("phase"):`.
+Nothing is recorded until enable() is called (the --profile flag does
+that), so the wrappers cost next to nothing in normal runs. Only the main
+thread is timed: a background thread (like the Ollama keep-alive pinger)
+would interleave its spans with the main thread's on the shared stack.
+"""
+
+import functools
+import json
+import threading
+import time
+
+# phase name -> {"calls": int, "total": seconds, "self": seconds, "max": seconds}
+_metrics = {}
+# Child time accumulated by each open span, so nested phases aren't counted twice
+_stack = []
+_enabled = False
+
+
+def enable():
+    """Start recording timings"""
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """Stop recording timings (what's been recorded is kept)"""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Forget everything recorded so far"""
+    _metrics.clear()
+    _stack.clear()
+
+
+def _record(phase, elapsed, child_time):
+    stats = _metrics.get(phase)
+    if stats is None:
+        stats = _metrics[phase] = {"calls": 0, "total": 0.0, "self": 0.0, "max": 0.0}
+    stats["calls"] += 1
+    stats["total"] += elapsed
+    stats["self"] += elapsed - child_time
+    if elapsed > stats["max"]:
+        stats["max"] = elapsed
+
+
+class span:
+    """
+    Time a block of code as one phase:
+        with span("collection.save"):
+            ...
+    """
+    __slots__ = ("phase", "start", "active")
+
+    def __init__(self, phase):
+        self.phase = phase
+        self.active = False
+
+    def __enter__(self):
+        self.active = _enabled and threading.current_thread() is threading.main_thread()
+        if self.active:
+            _stack.append(0.0)
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self.active:
+            return False
+        elapsed = time.perf_counter() - self.start
+        child_time = _stack.pop()
+        if _stack:
+            _stack[-1] += elapsed
+        _record(self.phase, elapsed, child_time)
+        return False
+
+
+def timed(phase):
+    """Decorator version of span(): every call of the function is one sample"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with span(phase):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_metrics():
+    """Copy of everything recorded so far, slowest phases first"""
+    return {phase: dict(stats) for phase, stats in
+            sorted(_metrics.items(), key=lambda item: item[1]["self"], reverse=True)}
+
+
+def print_report(wall_time=None):
+    """Print a per-phase breakdown of where the time went"""
+    metrics = get_metrics()
+    print("\n⏱️  PROFILE")
+    print("=" * 72)
+    if not metrics:
+        print("Nothing recorded.")
+        return
+    print(f"{'phase':<28} {'calls':>6} {'total ms':>11} {'self ms':>11} {'max ms':>10}")
+    print("-" * 72)
+    for phase, stats in metrics.items():
+        print(f"{phase:<28} {stats['calls']:>6} {stats['total'] * 1000:>11.2f} "
+              f"{stats['self'] * 1000:>11.2f} {stats['max'] * 1000:>10.2f}")
+    if wall_time is not None:
+        measured = sum(stats["self"] for stats in metrics.values())
+        print("-" * 72)
+        print(f"{'wall time':<28} {'':>6} {wall_time * 1000:>11.2f}")
+        print(f"{'not in any phase':<28} {'':>6} {(wall_time - measured) * 1000:>11.2f}")
+
+
+def write_metrics(path, wall_time=None):
+    """
+    Export the recorded timings for dashboards. Files ending in .prom get the
+    Prometheus text format; anything else gets JSON.
+    """
+    metrics = get_metrics()
+    with open(path, 'w') as f:
+        if path.endswith(".prom"):
+            f.write("# HELP npc_phase_seconds_total Time spent per phase, children included\n")
+            f.write("# TYPE npc_phase_seconds_total counter\n")
+            for phase, stats in metrics.items():
+                f.write(f'npc_phase_seconds_total{{phase="{phase}"}} {stats["total"]:.6f}\n')
+            f.write("# HELP npc_phase_self_seconds_total Time spent per phase, children excluded\n")
+            f.write("# TYPE npc_phase_self_seconds_total counter\n")
+            for phase, stats in metrics.items():
+                f.write(f'npc_phase_self_seconds_total{{phase="{phase}"}} {stats["self"]:.6f}\n')
+            f.write("# HELP npc_phase_calls_total Number of times each phase ran\n")
+            f.write("# TYPE npc_phase_calls_total counter\n")
+            for phase, stats in metrics.items():
+                f.write(f'npc_phase_calls_total{{phase="{phase}"}} {stats["calls"]}\n')
+        else:
+            json.dump({
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "wall_time_s": wall_time,
+                "phases": {phase: {"calls": stats["calls"], "total_s": stats["total"],
+                                   "self_s": stats["self"], "max_s": stats["max"]}
+                           for phase, stats in metrics.items()}
+            }, f, indent=2)
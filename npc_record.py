@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Compact in-memory NPC records
+A generated NPC is a dict of 17+ string keys whose values are almost all
+picked from a few hundred table entries, yet each dict holds its own key
+table and value references - a couple of kilobytes per NPC. CompactNPC
+keeps the same data in __slots__, with every trait value shared through
+an intern table (one string object per distinct value, however many NPCs
+use it), the name split into shared first/last parts and the stat block
+in a slotted CompactStatBlock whose lists and sub-dicts are shared the
+same way. That's roughly a tenth of the memory, for simulations that hold
+hundreds of thousands of NPCs at once.
+
+Both classes are read-only mappings with the same keys and values as the
+dicts they came from, so render_npc / display_npc take them as they are;
+to_dict() gives back a plain dict for saving or changing. A lazy stat
+block (see lazy_stat_block) is kept as just its CR and hit point seed
+until the NPC's "stat_block" is first read.
+"""
+
+import json
+from collections.abc import Mapping
+
+ABILITIES = ["strength", "dexterity", "constitution", "intelligence", "wisdom", "charisma"]
+
+# Trait fields every generated NPC has, in the order generate_npc makes them
+TRAIT_FIELDS = ["species", "class", "class_category", "gender", "personality", "speech_pattern", "voice",
+                "motivation", "secret", "height", "build", "hair_color", "hair_style", "eye_color",
+                "distinctive_feature", "clothing_style"]
+
+STAT_FIELDS = ["challenge_rating", "xp_value", "armor_class", "hit_points", "hit_dice", "speed", "size",
+               "ability_scores", "ability_modifiers", "proficiency_bonus", "saving_throws", "skills",
+               "special_abilities", "attacks", "spell_save_dc"]
+
+# kind -> {value: the one shared copy of it}
+_interned = {}
+
+
+def intern(kind, value):
+    """The shared copy of value (strings, tuples, numbers...) for this kind of field"""
+    table = _interned.get(kind)
+    if table is None:
+        table = _interned[kind] = {}
+    return table.setdefault(value, value)
+
+
+def intern_json(kind, value):
+    """The shared copy of a dict or list, compared by content"""
+    key = json.dumps(value, sort_keys=True)
+    table = _interned.get(kind)
+    if table is None:
+        table = _interned[kind] = {}
+    return table.setdefault(key, value)
+
+
+def intern_table_sizes():
+    """Distinct values held per kind of field, for checking what the tables cost"""
+    return {kind: len(table) for kind, table in _interned.items()}
+
+
+def _modifier(score):
+    return (score - 10) // 2
+
+
+class CompactStatBlock(Mapping):
+    """
+    A stat block in slots; looks like the stat block dict it was made from.
+    Lists and dicts it hands out are shared with other NPCs - use
+    to_dict() for copies that can be changed.
+    """
+    __slots__ = ("challenge_rating", "xp_value", "armor_class", "hit_points", "hit_dice", "speed", "size",
+                 "scores", "modifiers", "proficiency_bonus", "saves", "skill_bonuses", "special_abilities",
+                 "attack_list", "spell_save_dc")
+
+    @classmethod
+    def from_dict(cls, stat_block):
+        block = cls.__new__(cls)
+        block.challenge_rating = intern("challenge_rating", stat_block["challenge_rating"])
+        block.xp_value = stat_block["xp_value"]
+        block.armor_class = stat_block["armor_class"]
+        block.hit_points = stat_block["hit_points"]
+        block.hit_dice = intern_json("hit_dice", stat_block["hit_dice"]) if "hit_dice" in stat_block else None
+        block.speed = stat_block["speed"]
+        block.size = intern("size", stat_block["size"])
+        scores = tuple(stat_block["ability_scores"][ability] for ability in ABILITIES)
+        block.scores = intern("ability_scores", scores)
+        modifiers = tuple(stat_block["ability_modifiers"][ability] for ability in ABILITIES)
+        # Usually just (score - 10) // 2, in which case there's nothing to keep
+        block.modifiers = None if modifiers == tuple(map(_modifier, scores)) else intern("ability_modifiers", modifiers)
+        block.proficiency_bonus = stat_block["proficiency_bonus"]
+        block.saves = intern("saving_throws", tuple(stat_block["saving_throws"].items()))
+        block.skill_bonuses = intern("skills", tuple(stat_block["skills"].items()))
+        block.special_abilities = intern("special_abilities", tuple(stat_block["special_abilities"]))
+        block.attack_list = tuple(intern_json("attack", attack) for attack in stat_block["attacks"])
+        block.spell_save_dc = stat_block.get("spell_save_dc")
+        return block
+
+    def __getitem__(self, key):
+        if key == "ability_scores":
+            return dict(zip(ABILITIES, self.scores))
+        if key == "ability_modifiers":
+            return dict(zip(ABILITIES, self.modifiers or map(_modifier, self.scores)))
+        if key == "saving_throws":
+            return dict(self.saves)
+        if key == "skills":
+            return dict(self.skill_bonuses)
+        if key == "special_abilities":
+            return list(self.special_abilities)
+        if key == "attacks":
+            return list(self.attack_list)  # Shared between NPCs - read, don't change
+        if key == "hit_dice" and self.hit_dice is not None:
+            return self.hit_dice
+        if key in ("challenge_rating", "xp_value", "armor_class", "hit_points", "speed", "size",
+                   "proficiency_bonus") or (key == "spell_save_dc" and self.spell_save_dc is not None):
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self):
+        for field in STAT_FIELDS:
+            if field == "hit_dice" and self.hit_dice is None:
+                continue
+            if field == "spell_save_dc" and self.spell_save_dc is None:
+                continue
+            yield field
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self):
+        """The stat block as a plain dict, with its own copies of everything"""
+        block = {field: self[field] for field in self}
+        block["attacks"] = json.loads(json.dumps(block["attacks"]))
+        if "hit_dice" in block:
+            block["hit_dice"] = json.loads(json.dumps(block["hit_dice"]))
+        return block
+
+
+class CompactNPC(Mapping):
+    """
+    An NPC in slots with shared trait values; looks like the NPC dict it
+    was made from (including group fields like relationship and group_id).
+    Fields it has no slot for (AI usage figures, anything custom) are kept
+    in a small dict of their own.
+    """
+    __slots__ = tuple(field if field != "class" else "job" for field in TRAIT_FIELDS) + (
+        "first_name", "last_name", "id", "relationship", "group_id", "group_type", "timestamp",
+        "stat_block", "stat_seed", "extra")
+
+    @classmethod
+    def from_dict(cls, npc):
+        record = cls.__new__(cls)
+        for field in TRAIT_FIELDS:
+            setattr(record, "job" if field == "class" else field, intern(field, npc.get(field)))
+        first, _, last = npc.get("name", "").partition(" ")
+        record.first_name = intern("first_name", first)
+        record.last_name = intern("last_name", last)
+        record.id = npc.get("id")
+        record.relationship = intern("relationship", npc.get("relationship"))
+        record.group_id = npc.get("group_id")
+        record.group_type = intern("group_type", npc.get("group_type"))
+        record.timestamp = npc.get("timestamp")
+        stat_block = npc.get("stat_block")
+        record.stat_seed = None
+        if stat_block and "hit_points" not in stat_block:
+            # Lazy stat block - keep the CR and HP seed, build it when it's first read
+            record.stat_seed = (intern("challenge_rating", stat_block["challenge_rating"]), stat_block["hp_seed"])
+            record.stat_block = None
+        else:
+            record.stat_block = CompactStatBlock.from_dict(stat_block) if stat_block else None
+        extra = {key: value for key, value in npc.items() if key not in _NPC_KEYS}
+        record.extra = extra or None
+        return record
+
+    @property
+    def name(self):
+        return f"{self.first_name} {self.last_name}" if self.last_name else self.first_name
+
+    def __getitem__(self, key):
+        if key == "name":
+            return self.name
+        if key == "stat_block" and self.stat_block is None and self.stat_seed is not None:
+            from npc_generator import generate_stat_block
+            self.stat_block = CompactStatBlock.from_dict(generate_stat_block(self, *self.stat_seed))
+        if key == "class":
+            value = self.job
+        elif key in _NPC_KEYS and key != "name":
+            value = getattr(self, key)
+        else:
+            if self.extra and key in self.extra:
+                return self.extra[key]
+            raise KeyError(key)
+        if value is None:
+            raise KeyError(key)  # Optional field this NPC doesn't have
+        return value
+
+    def __iter__(self):
+        for key in _KEY_ORDER:
+            if key == "name" or (getattr(self, "job" if key == "class" else key) is not None):
+                yield key
+            elif key == "stat_block" and self.stat_seed is not None:
+                yield key
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"CompactNPC({self.name!r}, {self.job!r})"
+
+    def to_dict(self):
+        """The NPC as a plain dict, in the same shape generate_npc makes (lazy stat blocks stay lazy)"""
+        npc = {key: self[key] for key in self if key != "stat_block"}
+        if self.stat_seed is not None:
+            challenge_rating, hp_seed = self.stat_seed
+            npc["stat_block"] = {"challenge_rating": challenge_rating, "hp_seed": hp_seed}
+        elif self.stat_block is not None:
+            npc["stat_block"] = self.stat_block.to_dict()
+        return npc
+
+
+# Keys that have their own slot, and the order they come out in
+_KEY_ORDER = ["id", "name"] + TRAIT_FIELDS + ["relationship", "group_id", "group_type", "timestamp", "stat_block"]
+_NPC_KEYS = set(_KEY_ORDER)
+
+
+def compact_npcs(npcs):
+    """CompactNPC for every NPC dict in an iterable"""
+    return [CompactNPC.from_dict(npc) for npc in npcs]
+
+
+def load_compact_population(entries=None):
+    """
+    Every NPC in the collection (group members flattened, with group_id and
+    group_type) as CompactNPC records, streamed from npcs.json so the dicts
+    never all exist at once. Lazy stat blocks stay lazy until they're read.
+    """
+    from npc_export import iter_export_records
+    return compact_npcs(iter_export_records(entries, expand_stats=False))
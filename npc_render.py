@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Text rendering for NPCs, stat blocks and groups
+Each NPC is rendered into one string from templates compiled once at
+import time, instead of dozens of print() calls, and bulk output is
+written in large chunks (write_buffered). Three styles:
+- plain: the classic terminal layout
+- markdown: headings, bullet lists and an ability score table
+- ansi: the plain layout with bold/coloured headings for terminals
+"""
+
+import re
+import sys
+
+STYLES = ["plain", "markdown", "ansi"]
+
+ABILITIES = ["strength", "dexterity", "constitution", "intelligence", "wisdom", "charisma"]
+
+# Style used when render_* / display_* are not given one (--style sets it)
+_default_style = "plain"
+
+
+def set_style(style):
+    """Change the default style"""
+    global _default_style
+    if style not in STYLES:
+        raise ValueError(f"Unknown style: {style} (choose from {', '.join(STYLES)})")
+    _default_style = style
+
+
+def get_style():
+    return _default_style
+
+
+# --------------------------------------------------------------------------- #
+#  Templates
+# --------------------------------------------------------------------------- #
+PLAIN = {
+    "npc": (
+        "📜 {name} ({gender}){relationship}\n"
+        "Species: {species}\n"
+        "Class: {class}\n"
+        "\n👤 PHYSICAL APPEARANCE:\n"
+        "Height & Build: {height}, {build}\n"
+        "Hair: {hair_color} hair, {hair_style}\n"
+        "Eyes: {eye_color}\n"
+        "Notable: {distinctive_feature}\n"
+        "Style: {clothing_style}\n"
+        "\n🎭 ROLEPLAY NOTES:\n"
+        "Personality: {personality}\n"
+        "Speech pattern: {speech_pattern}\n"
+        "Voice inspiration: {voice}\n"
+        "\n📖 STORY HOOKS:\n"
+        "Motivation: {motivation}\n"
+        "Secret: {secret}\n"
+    ),
+    "relationship": " - {relationship}",
+    "stat_block": (
+        "\n⚔️  COMBAT STATISTICS (CR {challenge_rating}) - {xp_value} XP\n"
+        + "=" * 50 + "\n"
+        "Size: {size}\n"
+        "Armor Class: {armor_class}\n"
+        "Hit Points: {hit_points}{hit_dice}\n"
+        "Speed: {speed} ft.\n"
+        "\n📊 ABILITY SCORES:\n"
+        "STR: {strength} ({strength_mod:+}) | DEX: {dexterity} ({dexterity_mod:+}) | "
+        "CON: {constitution} ({constitution_mod:+})\n"
+        "INT: {intelligence} ({intelligence_mod:+}) | WIS: {wisdom} ({wisdom_mod:+}) | "
+        "CHA: {charisma} ({charisma_mod:+})\n"
+        "\n🎯 PROFICIENCIES:\n"
+        "Proficiency Bonus: +{proficiency_bonus}\n"
+        "{saving_throws}{skills}{special_abilities}{attacks}"
+    ),
+    "hit_dice": " ({})",
+    "saving_throws": "Saving Throws: {}\n",
+    "skills": "Skills: {}\n",
+    "list_separator": ", ",
+    "special_abilities": "\n✨ SPECIAL ABILITIES:\n{}",
+    "ability": "• {}\n",
+    "attacks": "\n⚔️  ACTIONS:\n{}",
+    "reach_attack": "• {name}: {type}, {attack_bonus} to hit\n  Reach {reach}, {target}. Hit: {damage}\n",
+    "range_attack": "• {name}: {type}, {attack_bonus} to hit\n  Range {range}, {target}. Hit: {damage}\n",
+    "attack": "• {name}: {type}, {attack_bonus} to hit\n",
+    "group": "\n🏛️  {type}\n" + "=" * 50 + "\n",
+    "member_separator": "\n" + "-" * 30 + "\n",
+}
+
+MARKDOWN = {
+    "npc": (
+        "## {name}{relationship}\n"
+        "\n"
+        "*{gender} {species} {class}*{label}\n"
+        "\n"
+        "- **Appearance:** {height}, {build}; {hair_color} hair, {hair_style}; {eye_color} eyes\n"
+        "- **Notable:** {distinctive_feature}\n"
+        "- **Style:** {clothing_style}\n"
+        "- **Personality:** {personality}\n"
+        "- **Speech:** {speech_pattern}\n"
+        "- **Voice:** {voice}\n"
+        "- **Motivation:** {motivation}\n"
+        "- **Secret:** {secret}\n"
+        "\n"
+    ),
+    "relationship": " ({relationship})",
+    "stat_block": (
+        "### Challenge {challenge_rating} ({xp_value} XP)\n"
+        "\n"
+        "- **Armor Class** {armor_class}\n"
+        "- **Hit Points** {hit_points}{hit_dice}\n"
+        "- **Speed** {speed} ft.\n"
+        "\n"
+        "| STR | DEX | CON | INT | WIS | CHA |\n"
+        "|:---:|:---:|:---:|:---:|:---:|:---:|\n"
+        "| {strength} ({strength_mod:+}) | {dexterity} ({dexterity_mod:+}) | "
+        "{constitution} ({constitution_mod:+}) | {intelligence} ({intelligence_mod:+}) | "
+        "{wisdom} ({wisdom_mod:+}) | {charisma} ({charisma_mod:+}) |\n"
+        "\n"
+        "{saving_throws}{skills}"
+        "- **Proficiency Bonus** +{proficiency_bonus}\n"
+        "{special_abilities}{attacks}"
+        "\n"
+    ),
+    "hit_dice": " ({})",
+    "saving_throws": "- **Saving Throws** {}\n",
+    "skills": "- **Skills** {}\n",
+    "list_separator": ", ",
+    "special_abilities": "\n{}",
+    "ability": "- {}\n",
+    "attacks": "\n#### Actions\n\n{}",
+    "reach_attack": "- ***{name}.*** *{type}:* {attack_bonus} to hit, reach {reach}, {target}. *Hit:* {damage}\n",
+    "range_attack": "- ***{name}.*** *{type}:* {attack_bonus} to hit, range {range}, {target}. *Hit:* {damage}\n",
+    "attack": "- ***{name}.*** *{type}:* {attack_bonus} to hit\n",
+    "group": "# {type}\n\n",
+    "member_separator": "",
+}
+
+ANSI_BOLD = "\033[1m"
+ANSI_HEADING = "\033[1;33m"
+ANSI_TITLE = "\033[1;36m"
+ANSI_RESET = "\033[0m"
+
+
+def _ansi(template):
+    """Derive an ANSI template from a plain one: coloured titles/headings, bold labels"""
+    template = re.sub(r"^(📜|🏛️)(.*)$", ANSI_TITLE + r"\1\2" + ANSI_RESET, template, flags=re.M)
+    template = re.sub(r"^(\S+ +[A-Z][A-Z &]+(?:\(CR .*)?:?)$", ANSI_HEADING + r"\1" + ANSI_RESET,
+                      template, flags=re.M)
+    template = re.sub(r"^( *)([A-Z][A-Za-z &]+)(:)", r"\1" + ANSI_BOLD + r"\2" + ANSI_RESET + r"\3",
+                      template, flags=re.M)
+    return template
+
+
+ANSI = {key: _ansi(value) for key, value in PLAIN.items()}
+
+TEMPLATES = {"plain": PLAIN, "markdown": MARKDOWN, "ansi": ANSI}
+
+
+# --------------------------------------------------------------------------- #
+#  Rendering
+# --------------------------------------------------------------------------- #
+def render_stat_block(stat_block, style=None):
+    """A stat block as one string"""
+    t = TEMPLATES[style or _default_style]
+    fields = dict(stat_block)
+    for ability in ABILITIES:
+        fields[ability] = stat_block["ability_scores"][ability]
+        fields[ability + "_mod"] = stat_block["ability_modifiers"][ability]
+    fields["hit_dice"] = t["hit_dice"].format(stat_block["hit_dice"]["expression"]) if "hit_dice" in stat_block else ""
+
+    separator = t["list_separator"]
+    saves, skills = stat_block["saving_throws"], stat_block["skills"]
+    fields["saving_throws"] = t["saving_throws"].format(separator.join(
+        f"{save.title()} {bonus:+}" for save, bonus in saves.items())) if saves else ""
+    fields["skills"] = t["skills"].format(separator.join(
+        f"{skill.title()} {bonus:+}" for skill, bonus in skills.items())) if skills else ""
+
+    abilities = stat_block["special_abilities"]
+    fields["special_abilities"] = t["special_abilities"].format(
+        "".join(t["ability"].format(ability) for ability in abilities)) if abilities else ""
+
+    attacks = []
+    for attack in stat_block["attacks"]:
+        if "reach" in attack:
+            attacks.append(t["reach_attack"].format_map(attack))
+        elif "range" in attack:
+            attacks.append(t["range_attack"].format_map(attack))
+        else:
+            attacks.append(t["attack"].format_map(attack))
+    fields["attacks"] = t["attacks"].format("".join(attacks)) if attacks else ""
+    return t["stat_block"].format_map(fields)
+
+
+def render_npc(npc, style=None):
+    """An NPC (and its stat block, if it has one) as one string"""
+    style = style or _default_style
+    t = TEMPLATES[style]
+    fields = dict(npc)
+    fields["relationship"] = t["relationship"].format(relationship=npc["relationship"]) if "relationship" in npc else ""
+    if style == "markdown":
+        label = f" - NPC #{npc['id']}" if npc.get("id") is not None else ""
+        if npc.get("group_id") is not None:
+            label += f", {npc.get('group_type', 'group')} #{npc['group_id']}"
+        fields["label"] = label
+    text = t["npc"].format_map(fields)
+    if "stat_block" in npc:
+        text += render_stat_block(npc["stat_block"], style)
+    return text
+
+
+def render_group(group, style=None):
+    """A group header followed by each member"""
+    style = style or _default_style
+    t = TEMPLATES[style]
+    header = t["group"].format(type=group["type"] if style == "markdown" else group["type"].upper())
+    return header + t["member_separator"].join(render_npc(npc, style) for npc in group["members"])
+
+
+def write_buffered(texts, out=None, chunk_size=1 << 18):
+    """
+    Write an iterable of rendered strings in large chunks, so dumping
+    thousands of NPCs costs a handful of writes instead of one per line.
+    Returns the number of strings written.
+    """
+    out = out or sys.stdout
+    pending = []
+    size = 0
+    count = 0
+    for text in texts:
+        pending.append(text)
+        size += len(text)
+        count += 1
+        if size >= chunk_size:
+            out.write("".join(pending))
+            pending, size = [], 0
+    if pending:
+        out.write("".join(pending))
+    out.flush()
+    return count
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+NPC collection storage
+Everything that reads or writes npcs.json: the file locations, the
+process-wide collection lock, atomic writes, schema upgrades, streaming
+reads and the save paths that keep the sidecar index (npc_index.py) in
+step. It lives apart from npc_generator.py so that modules importing it
+share one lock even when npc_generator.py is run as a script (which would
+otherwise load a second copy of it, with a second lock).
+"""
+
+import contextlib
+import datetime
+import itertools
+import json
+import os
+import re
+import sqlite3
+import tempfile
+
+from npc_profiling import span, timed
+
+# Advisory file locking: fcntl on Linux/macOS, msvcrt on Windows
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    try:
+        import msvcrt
+    except ImportError:
+        msvcrt = None
+
+# File management constants
+NPC_DATA_DIR = "npc_collection"
+NPC_DATA_FILE = os.path.join(NPC_DATA_DIR, "npcs.json")
+NPC_LOCK_FILE = os.path.join(NPC_DATA_DIR, "npcs.lock")
+
+# Version of the saved record layout. Collections without a version are 1.
+# 1: original format - NPCs could have "race" instead of "species"
+# 2: "species" everywhere, every entry has a "type"
+SCHEMA_VERSION = 2
+
+def ensure_data_directory():
+    """Create the NPC data directory if it doesn't exist"""
+    if not os.path.exists(NPC_DATA_DIR):
+        os.makedirs(NPC_DATA_DIR)
+
+
+# How many times this process currently holds the collection lock
+_lock_depth = 0
+
+
+@contextlib.contextmanager
+def collection_lock():
+    """
+    Hold an exclusive advisory lock on the collection while reading and
+    writing it, so several generators can safely share one npcs.json.
+    Re-entrant: nested uses inside one process only lock once.
+    """
+    global _lock_depth
+    if _lock_depth:
+        _lock_depth += 1
+        try:
+            yield
+        finally:
+            _lock_depth -= 1
+        return
+    
+    ensure_data_directory()
+    with open(NPC_LOCK_FILE, 'a+') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        elif msvcrt:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        _lock_depth = 1
+        try:
+            yield
+        finally:
+            _lock_depth = 0
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            elif msvcrt:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def write_file_atomically(path, write):
+    """
+    Write a file via a temporary file and a rename, so readers only ever see
+    the old contents or the new ones - never a half-written file
+    write: function that takes the open temporary file and fills it
+    """
+    directory = os.path.dirname(path) or "."
+    fd, temp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp makes owner-only files - keep the old file's permissions, or the usual ones
+        try:
+            mode = os.stat(path).st_mode & 0o777
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def upgrade_npc_v1(npc):
+    """Rename 'race' to 'species', keeping the field where it was"""
+    if "race" not in npc:
+        return npc
+    return {("species" if key == "race" else key): value for key, value in npc.items()}
+
+
+def upgrade_entry_v1(entry):
+    entry = upgrade_npc_v1(entry)
+    entry.setdefault("type", "group" if "members" in entry else "individual")
+    if entry["type"] == "group":
+        entry["members"] = [upgrade_npc_v1(member) for member in entry["members"]]
+    return entry
+
+
+# version -> function that upgrades an entry from that version to the next
+ENTRY_UPGRADES = {1: upgrade_entry_v1}
+
+
+def upgrade_entry(entry, version):
+    """Bring one saved entry from schema `version` up to SCHEMA_VERSION"""
+    while version < SCHEMA_VERSION:
+        entry = ENTRY_UPGRADES[version](entry)
+        version += 1
+    return entry
+
+
+@timed("collection.load")
+def load_npc_collection():
+    """Load existing NPC collection from file"""
+    ensure_data_directory()
+    if os.path.exists(NPC_DATA_FILE):
+        try:
+            with open(NPC_DATA_FILE, 'r') as f:
+                collection = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            # Keep the unreadable file around instead of overwriting it on the next save
+            backup = f"{NPC_DATA_FILE}.corrupt-{datetime.datetime.now():%Y%m%d-%H%M%S}"
+            print(f"Warning: could not read {NPC_DATA_FILE} ({e}). Moved it to {backup}")
+            os.replace(NPC_DATA_FILE, backup)
+            return {"schema_version": SCHEMA_VERSION, "npcs": [], "next_id": 1}
+        # Older files are upgraded as they're read; the next save writes them back current
+        version = collection.get("schema_version", 1)
+        if version < SCHEMA_VERSION:
+            collection["npcs"] = [upgrade_entry(entry, version) for entry in collection["npcs"]]
+            collection["schema_version"] = SCHEMA_VERSION
+        return collection
+    return {"schema_version": SCHEMA_VERSION, "npcs": [], "next_id": 1}
+
+
+@timed("collection.save")
+def save_npc_collection(collection):
+    """Save NPC collection to file (atomically - see write_file_atomically)"""
+    ensure_data_directory()
+    # The version goes first so streaming readers see it before any NPCs
+    collection = dict({"schema_version": SCHEMA_VERSION}, **collection)
+    write_file_atomically(NPC_DATA_FILE, lambda f: json.dump(collection, f, indent=2))
+
+
+def reserve_npc_ids(count=1, collection=None):
+    """
+    Reserve a block of unused NPC IDs and return the first one.
+    The counter is next_id in npcs.json, so call this under
+    collection_lock() and save the collection before letting go of it.
+    collection: the loaded collection (or just {"next_id": ...}); its
+    next_id is moved past the reserved block. Read from npcs.json if not given.
+    """
+    if collection is None:
+        collection = {"next_id": read_saved_next_id()}
+    first_id = collection.get("next_id", 1)
+    collection["next_id"] = first_id + count
+    return first_id
+
+
+# Matches the opening of a file written by save_npc_collection:
+# {"schema_version": 2, "npcs": [  (older files start straight at "npcs")
+COLLECTION_HEADER = re.compile(r'\s*\{\s*(?:"schema_version"\s*:\s*(\d+)\s*,\s*)?"npcs"\s*:\s*\[')
+
+
+def iter_npc_collection(chunk_size=65536):
+    """
+    Yield saved entries one at a time, reading npcs.json in chunks instead
+    of loading the whole file. Stop iterating early and the rest of the file
+    is never read.
+    """
+    if not os.path.exists(NPC_DATA_FILE):
+        return
+    
+    decoder = json.JSONDecoder()
+    with open(NPC_DATA_FILE, 'r') as f:
+        buffer = f.read(chunk_size)
+        header = COLLECTION_HEADER.match(buffer)
+        if not header:
+            # Not laid out the way we save it (hand edited?) - read it the slow way
+            yield from load_npc_collection()["npcs"]
+            return
+        pos = header.end()
+        version = int(header.group(1) or 1)
+        if version < SCHEMA_VERSION:
+            # Legacy file: upgrade each entry on the way out (--migrate makes this unnecessary)
+            for entry in _iter_entries(f, decoder, buffer, pos, chunk_size):
+                yield upgrade_entry(entry, version)
+            return
+        yield from _iter_entries(f, decoder, buffer, pos, chunk_size)
+
+
+def _iter_entries(f, decoder, buffer, pos, chunk_size):
+    """The chunked entry parser behind iter_npc_collection"""
+    while True:
+        # Skip whitespace and the commas between entries, reading more as needed
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos == len(buffer):
+            buffer, pos = f.read(chunk_size), 0
+            if not buffer:
+                return  # Truncated file - nothing more we can read
+            continue
+        
+        if buffer[pos] == "]":
+            return  # End of the NPC list
+        
+        try:
+            entry, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # The entry runs past the end of the buffer - read another chunk
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        yield entry
+
+
+def read_saved_next_id():
+    """next_id from npcs.json without parsing the NPC list (it's written after it)"""
+    try:
+        with open(NPC_DATA_FILE, 'rb') as f:
+            f.seek(max(0, os.path.getsize(NPC_DATA_FILE) - 256))
+            tail = re.search(rb'"next_id"\s*:\s*(\d+)', f.read())
+    except OSError:
+        return 1
+    return int(tail.group(1)) if tail else 1
+
+
+def write_collection_stream(out, entries, next_id=1):
+    """
+    Write entries to an open file one at a time, in the same layout as
+    save_npc_collection, so a collection of any size can be rewritten in
+    constant memory. Returns (entries written, next_id).
+    """
+    count = 0
+    out.write(f'{{\n  "schema_version": {SCHEMA_VERSION},\n  "npcs": [')
+    for entry in entries:
+        out.write(",\n    " if count else "\n    ")
+        out.write(json.dumps(entry, indent=2).replace("\n", "\n    "))
+        count += 1
+        ids = [entry["id"]] + [member.get("id") or 0 for member in entry.get("members", [])]
+        next_id = max(next_id, max(ids) + 1)
+    out.write(f'\n  ],\n  "next_id": {next_id}\n}}')
+    return count, next_id
+
+
+def migrate_collection():
+    """
+    Upgrade npcs.json to SCHEMA_VERSION in one streaming pass: entries are
+    read, upgraded and written out one at a time, so even a huge legacy
+    collection is migrated in constant memory. The old file is replaced
+    atomically at the end.
+    Returns (entries migrated, version migrated from), or None if the
+    collection was already current.
+    """
+    if not os.path.exists(NPC_DATA_FILE):
+        return None
+    with collection_lock():
+        with open(NPC_DATA_FILE, 'r') as f:
+            header = COLLECTION_HEADER.match(f.read(4096))
+        version = int(header.group(1) or 1) if header else None
+        if version is not None and version >= SCHEMA_VERSION:
+            return None
+        if version is None:
+            # Unusual layout - fall back to loading it whole
+            collection = load_npc_collection()
+            save_npc_collection(collection)
+            return len(collection["npcs"]), 1
+        
+        result = []
+        write_file_atomically(NPC_DATA_FILE, lambda out: result.extend(
+            write_collection_stream(out, iter_npc_collection(), read_saved_next_id())))
+        count, _ = result
+        return count, version
+
+
+def build_collection_entry(npc, group_info, first_id, timestamp):
+    """Turn a generated NPC or group into a collection entry with IDs from first_id"""
+    if group_info:
+        # This is a group of NPCs
+        group_entry = {
+            "id": first_id,
+            "type": "group",
+            "group_type": group_info["type"],
+            "timestamp": timestamp,
+            "members": []
+        }
+        
+        for i, member in enumerate(group_info["members"]):
+            member_data = member.copy()
+            member_data["id"] = first_id + 1 + i
+            member_data["group_id"] = first_id
+            member_data["timestamp"] = timestamp
+            group_entry["members"].append(member_data)
+        
+        return group_entry
+    
+    # Single NPC
+    npc_data = npc.copy()
+    npc_data["id"] = first_id
+    npc_data["type"] = "individual"
+    npc_data["timestamp"] = timestamp
+    return npc_data
+
+
+def add_npcs_to_collection(items):
+    """
+    Save many NPCs and/or groups with a single read-modify-write of npcs.json
+    items: list of (npc, group_info) pairs, as for add_npc_to_collection
+    Returns the list of new entry IDs. Safe to call from parallel processes.
+    """
+    with collection_lock():
+        collection = load_npc_collection()
+        timestamp = datetime.datetime.now().isoformat()
+        
+        # One ID per NPC, plus one for each group entry itself
+        id_count = sum(1 + len(group_info["members"]) if group_info else 1 for _, group_info in items)
+        next_id = reserve_npc_ids(id_count, collection)
+        
+        entries = []
+        for npc, group_info in items:
+            entry = build_collection_entry(npc, group_info, next_id, timestamp)
+            next_id += 1 + len(entry.get("members", []))
+            entries.append(entry)
+        
+        collection["npcs"].extend(entries)
+        collection["next_id"] = next_id
+        
+        from npc_index import collection_signature, update_index
+        previous_signature = collection_signature()
+        save_npc_collection(collection)
+        try:
+            with span("collection.index"):
+                update_index(entries, collection, previous_signature)
+        except sqlite3.Error as e:
+            # npcs.json is already saved; the index rebuilds itself next time it's opened
+            print(f"Warning: could not update the NPC index: {e}")
+    
+    return [entry["id"] for entry in entries]
+
+
+def add_npc_to_collection(npc, group_info=None):
+    """
+    Add an NPC (or group) to the persistent collection
+    Every NPC gets its own ID - group members too - so they can be looked up
+    directly. Returns the ID of the new entry (the group ID for groups).
+    """
+    return add_npcs_to_collection([(npc, group_info)])[0]
+
+
+def stream_into_collection(items, chunk_size=500):
+    """
+    Save a large or endless stream of (npc, group_info) pairs - e.g. a
+    whole town - without holding it in memory. Saved entries are copied
+    and the new ones appended in one pass, chunk_size items at a time
+    (one ID reservation and index update per chunk), and the new file
+    replaces the old one atomically. Time grows linearly with the
+    collection plus the new NPCs, unlike repeated add_npcs_to_collection.
+    Returns the number of entries added.
+    """
+    from collections import Counter
+    from npc_index import collection_signature, connect_index, index_entry, mark_index_current, save_stats
+    
+    with collection_lock():
+        ensure_data_directory()
+        conn = connect_index()
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'signature'").fetchone()
+            # Keep the index in step only if it matched the file before we started
+            index_current = row is not None and row["value"] == collection_signature()
+            counts = Counter()
+            state = {"added": 0, "next_id": read_saved_next_id()}
+            
+            def new_entries():
+                timestamp = datetime.datetime.now().isoformat()
+                pending = iter(items)
+                while True:
+                    chunk = list(itertools.islice(pending, chunk_size))
+                    if not chunk:
+                        return
+                    id_count = sum(1 + len(group_info["members"]) if group_info else 1 for _, group_info in chunk)
+                    next_id = reserve_npc_ids(id_count, {"next_id": state["next_id"]})
+                    for npc, group_info in chunk:
+                        entry = build_collection_entry(npc, group_info, next_id, timestamp)
+                        next_id += 1 + len(entry.get("members", []))
+                        if index_current:
+                            index_entry(conn, entry, counts)
+                        state["added"] += 1
+                        yield entry
+                    state["next_id"] = next_id
+            
+            with span("collection.save"):
+                write_file_atomically(NPC_DATA_FILE, lambda out: write_collection_stream(
+                    out, itertools.chain(iter_npc_collection(), new_entries()), state["next_id"]))
+            if index_current:
+                save_stats(conn, counts)
+                mark_index_current(conn)
+        finally:
+            conn.close()
+    return state["added"]
+
+
+def collection_names(collection):
+    """Yield the name of every NPC in a collection, including group members"""
+    for entry in collection["npcs"]:
+        if entry["type"] == "group":
+            for member in entry["members"]:
+                yield member["name"]
+        else:
+            yield entry["name"]
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Offline stand-in for an Ollama server
+Serves /api/tags, /api/generate and /api/chat with answers recorded from
+real models, so the whole AI path (generate_ai_npc, generate_ai_group,
+hybrid enrichment, the fall-backs) can be run and load-tested without a
+GPU or network. Latency, streaming, malformed answers and server errors
+are all configurable, and a seed makes a run repeatable.
+
+Like a real server it keeps the last prompt it evaluated and only
+evaluates (and charges time for) the part of the next prompt after the
+prefix they share, and it reports token counts and timings the way
+Ollama does.
+
+Usage:
+    python3 ollama_stub_server.py --port 11434
+    python3 ollama_stub_server.py --latency 0.5 --malformed-rate 0.2 --error-rate 0.05 --seed 1
+    OLLAMA_URL=http://127.0.0.1:11434 python3 npc_generator.py --ai
+
+From Python:
+    with running_stub(latency=0.1) as url:
+        ai_npc_generator.OLLAMA_URL = url
+        ...
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Responses recorded from real models, including the chatter and code
+# fences they like to wrap around the JSON we asked for
+RECORDED_RESPONSES = [
+    """{
+    "name": "Marta Quillfeather",
+    "species": "Halfling",
+    "class": "Innkeeper",
+    "gender": "Female",
+    "personality": "keeps a ledger of every favor owed to her, and calls them in at the worst times",
+    "speech_pattern": "ends every sentence with a small, knowing hum",
+    "voice": "warm and raspy, like a grandmother who smoked a pipe for fifty years",
+    "motivation": "wants to buy the building next door before the thieves' guild does",
+    "secret": "the inn's cellar connects to an old smugglers' tunnel she still rents out",
+    "height": "short even for a halfling",
+    "build": "round and sturdy",
+    "hair_color": "iron gray",
+    "hair_style": "tied up with a pencil stuck through the bun",
+    "eye_color": "bright hazel",
+    "distinctive_feature": "a burn scar on her left forearm shaped like a key",
+    "clothing_style": "flour-dusted apron over a surprisingly expensive silk blouse"
+}""",
+    """Here is your NPC:
+
+```json
+{
+    "name": "Dorn Ashcallow",
+    "species": "Dwarf",
+    "class": "Blacksmith",
+    "gender": "Male",
+    "personality": "tests every stranger's handshake as if grading their metal",
+    "speech_pattern": "speaks in forging metaphors",
+    "voice": "low rumble, like a bellows",
+    "motivation": "forging a blade worthy of his late brother's name",
+    "secret": "the famous sword he sold the duke is a forgery",
+    "height": "stocky and short",
+    "build": "barrel-chested",
+    "hair_color": "coal black streaked with ash",
+    "hair_style": "braided beard tucked into his belt",
+    "eye_color": "deep brown",
+    "distinctive_feature": "missing the tip of his right ear",
+    "clothing_style": "scorched leather apron, always"
+}
+```
+
+Let me know if you want another one!""",
+    """Sure! {"name": "Vex Morrowind", "species": "Tiefling", "class": "Con Artist", "gender": "Non-binary", "personality": "collects other people's lies like trophies", "speech_pattern": "answers questions with questions", "voice": "smooth, theatrical whisper", "motivation": "paying off a debt to a devil who is getting impatient", "secret": "their real name is carved on a contract in Avernus", "height": "tall and willowy", "build": "lean", "hair_color": "violet", "hair_style": "shaved on one side", "eye_color": "solid gold", "distinctive_feature": "a broken horn capped in silver", "clothing_style": "a different disguise every day"}""",
+    "I'm sorry, I can't produce JSON right now, but here is a description of a sailor named Bryn."
+]
+
+# Fields a hybrid (format: json) request asks for
+HYBRID_STUB_FIELDS = ["personality", "speech_pattern", "motivation", "secret"]
+
+
+def recorded_npc(i):
+    """The NPC in one of the well-formed recorded responses, as a dict"""
+    text = RECORDED_RESPONSES[i % 3]
+    return json.loads(text[text.index("{"):text.rindex("}") + 1])
+
+
+class StubOllamaServer(ThreadingHTTPServer):
+    """
+    The stub server. Every knob is an attribute, so tests can change them
+    between requests:
+    latency: seconds per request before answering
+    prompt_token_seconds / token_seconds: time per prompt token evaluated
+      and per output token generated
+    malformed_rate: share of answers that are not the JSON asked for
+    error_rate: share of requests answered with an HTTP 500
+    models: model names /api/tags lists and requests may use
+    parallel: requests the "model" works on at once, like OLLAMA_NUM_PARALLEL
+      (others queue); None for no limit
+    """
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), latency=0.0, prompt_token_seconds=0.0002, token_seconds=0.0,
+                 malformed_rate=0.0, error_rate=0.0, models=("llama3",), parallel=None, seed=None):
+        super().__init__(address, StubOllamaHandler)
+        self.latency = latency
+        self.prompt_token_seconds = prompt_token_seconds
+        self.token_seconds = token_seconds
+        self.malformed_rate = malformed_rate
+        self.error_rate = error_rate
+        self.models = list(models)
+        self.rng = random.Random(seed)
+        self.cached_prompt = ""
+        self.lock = threading.Lock()
+        self.slots = threading.Semaphore(parallel) if parallel else contextlib.nullcontext()
+        # Request counts for load tests (GET /stub/stats)
+        self.stats = {"requests": 0, "errors": 0, "malformed": 0, "streamed": 0, "loads": 0,
+                      "active": 0, "max_active": 0}
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+            if key == "active":
+                self.stats["max_active"] = max(self.stats["max_active"], self.stats["active"])
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # Keep test and benchmark output clean
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self.send_json({"models": [{"name": name, "model": name} for name in self.server.models]})
+        elif self.path == "/stub/stats":
+            with self.server.lock:
+                self.send_json(dict(self.server.stats))
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self.send_json({"error": "invalid JSON in request"}, 400)
+            return
+        if self.path not in ("/api/generate", "/api/chat"):
+            self.send_json({"error": "not found"}, 404)
+            return
+        server = self.server
+        server.count("requests")
+        with server.slots:
+            server.count("active")
+            try:
+                self.answer(request)
+            finally:
+                server.count("active", -1)
+
+    def answer(self, request):
+        server = self.server
+        model = request.get("model")
+        if model not in server.models:
+            self.send_json({"error": f"model '{model}' not found"}, 404)
+            return
+        with server.lock:
+            fail = server.rng.random() < server.error_rate
+            malformed = server.rng.random() < server.malformed_rate
+            pick = server.rng.randrange(3)
+        if fail:
+            server.count("errors")
+            self.send_json({"error": "stub: injected server error"}, 500)
+            return
+
+        messages = request.get("messages", [])
+        prompt = "\n\n".join(message["content"] for message in messages) or request.get("prompt", "")
+        if not prompt:
+            # No prompt just loads the model (warm-up and keep-alive pings)
+            server.count("loads")
+            self.send_json({"model": model, "created_at": now(), "response": "", "done": True,
+                            "done_reason": "load", "load_duration": 1_000_000})
+            return
+
+        # Rough token counts (about four characters per token)
+        with server.lock:
+            cached = len(os.path.commonprefix([server.cached_prompt, prompt]))
+            server.cached_prompt = prompt
+        prompt_tokens = max(1, (len(prompt) - cached) // 4)
+        prompt_time = prompt_tokens * server.prompt_token_seconds
+        time.sleep(server.latency + prompt_time)
+
+        if malformed:
+            server.count("malformed")
+            response = RECORDED_RESPONSES[3] if pick else RECORDED_RESPONSES[0][:200]
+        elif request.get("format") == "json":
+            # Hybrid prompts number their NPCs "1. ...", "2. ..." - answer for each
+            count = len(re.findall(r"^\d+\. ", prompt, flags=re.M))
+            response = json.dumps({"npcs": [{field: recorded_npc(pick + i)[field] for field in HYBRID_STUB_FIELDS}
+                                            for i in range(count)]})
+        else:
+            response = RECORDED_RESPONSES[pick]
+        eval_count = max(1, len(response) // 4)
+
+        # Timings in nanoseconds, like the real thing
+        final = {"model": model, "created_at": now(), "done": True, "done_reason": "stop",
+                 "prompt_eval_count": prompt_tokens, "eval_count": eval_count,
+                 "load_duration": 1_000_000, "prompt_eval_duration": int(prompt_time * 1e9),
+                 "eval_duration": int((server.latency + eval_count * server.token_seconds) * 1e9),
+                 "total_duration": int((server.latency + prompt_time + eval_count * server.token_seconds) * 1e9)
+                 + 1_000_000}
+        # Ollama streams unless asked not to
+        if request.get("stream", True):
+            server.count("streamed")
+            self.stream(final, response, bool(messages), server.token_seconds)
+            return
+        time.sleep(eval_count * server.token_seconds)
+        if messages:
+            final["message"] = {"role": "assistant", "content": response}
+        else:
+            final["response"] = response
+        self.send_json(final)
+
+    def stream(self, final, response, chat, token_seconds):
+        """Send the answer a few characters at a time as newline-delimited JSON, then the totals"""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(payload):
+            data = json.dumps(payload).encode() + b"\n"
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        try:
+            for start in range(0, len(response), 4):
+                piece = response[start:start + 4]
+                time.sleep(token_seconds)
+                content = {"message": {"role": "assistant", "content": piece}} if chat else {"response": piece}
+                send(dict(content, model=final["model"], created_at=now(), done=False))
+            final = dict(final, **({"message": {"role": "assistant", "content": ""}} if chat else {"response": ""}))
+            send(final)
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # The client stopped reading - fine for a stub
+
+
+def now():
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+def start_stub_server(port=0, **settings):
+    """
+    Start a stub server on a background thread (port 0 picks a free port).
+    settings are StubOllamaServer's knobs. Returns the server; stop it with
+    server.shutdown() and server.server_close().
+    """
+    server = StubOllamaServer(("127.0.0.1", port), **settings)
+    threading.Thread(target=server.serve_forever, name="ollama-stub", daemon=True).start()
+    return server
+
+
+@contextlib.contextmanager
+def running_stub(**settings):
+    """Run a stub server for the duration of a with block, yielding its URL"""
+    server = start_stub_server(**settings)
+    try:
+        yield server.url
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline stand-in for an Ollama server')
+    parser.add_argument('--port', type=int, default=11434, help='Port to listen on (default: 11434)')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--model', action='append',
+                        help="Model name to serve (repeatable; default: $OLLAMA_MODEL or llama3)")
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds per request (default: 0)')
+    parser.add_argument('--prompt-token-seconds', type=float, default=0.0002,
+                        help='Seconds per prompt token evaluated (default: 0.0002)')
+    parser.add_argument('--token-seconds', type=float, default=0.0,
+                        help='Seconds per output token generated (default: 0)')
+    parser.add_argument('--malformed-rate', type=float, default=0.0,
+                        help='Share of answers that are not valid NPC JSON (default: 0)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Share of requests that get an HTTP 500 (default: 0)')
+    parser.add_argument('--parallel', type=int,
+                        help='Requests handled at once, the rest queue (like OLLAMA_NUM_PARALLEL; default: no limit)')
+    parser.add_argument('--seed', type=int, help='Random seed for repeatable runs')
+    args = parser.parse_args()
+
+    server = StubOllamaServer((args.host, args.port), latency=args.latency,
+                              prompt_token_seconds=args.prompt_token_seconds, token_seconds=args.token_seconds,
+                              malformed_rate=args.malformed_rate, error_rate=args.error_rate,
+                              models=args.model or [os.getenv('OLLAMA_MODEL', 'llama3')], parallel=args.parallel,
+                              seed=args.seed)
+    print(f"Stub Ollama serving {', '.join(server.models)} at {server.url} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
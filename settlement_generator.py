@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Settlement generator
+Populates a whole village, town or port from a demographic spec: how many
+people, what share work each job, how big households are, which jobs form
+crews or businesses, and what CR range the fighters have. Jobs are handed
+out to match the spec exactly (not just on average), and NPCs are
+generated and saved in a stream, so memory stays flat and the run time
+grows linearly with the population.
+
+A spec is a dict (or a JSON file) like:
+    {
+        "name": "Port Town",
+        "population": 2000,
+        "jobs": {"sailor": 0.30, "guard": 0.05, "merchant": 0.08},
+        "household": [2, 6],
+        "groups": {"sailor": ["crew", 0.6, [4, 10]]},
+        "crs": {"guard": ["1/2", "2"]}
+    }
+jobs: share of the population per job category; whatever is left over
+  are commoners
+household: smallest and largest family size (1 = lives alone)
+groups: job -> [group type, share of that job in such groups, size range]
+crs: job -> [lowest CR, highest CR] for NPCs who get stat blocks
+A spec can start from a preset with "extends": "port".
+"""
+
+import json
+import random
+
+from npc_generator import CHALLENGE_RATINGS, GROUP_TYPES, JOBS, generate_group, generate_npc
+
+SETTLEMENT_TYPES = {
+    "village": {
+        "name": "Village",
+        "population": 150,
+        "jobs": {"commoner": 0.55, "artisan": 0.15, "merchant": 0.05, "innkeeper": 0.02,
+                 "religious": 0.03, "guard": 0.03, "performer": 0.02, "scholar": 0.01},
+        "household": [2, 7],
+        "groups": {"artisan": ["business", 0.3, [2, 3]]},
+        "crs": {"guard": ["1/8", "1/2"]}
+    },
+    "town": {
+        "name": "Town",
+        "population": 1500,
+        "jobs": {"commoner": 0.40, "artisan": 0.15, "merchant": 0.10, "innkeeper": 0.03,
+                 "religious": 0.04, "guard": 0.05, "noble": 0.02, "criminal": 0.04,
+                 "performer": 0.03, "scholar": 0.03, "adventurer": 0.01},
+        "household": [1, 6],
+        "groups": {"artisan": ["business", 0.4, [2, 4]], "merchant": ["business", 0.4, [2, 4]],
+                   "criminal": ["crew", 0.5, [3, 6]], "adventurer": ["adventuring", 1.0, [3, 5]]},
+        "crs": {"guard": ["1/4", "1"], "criminal": ["1/8", "1"], "adventurer": ["1", "4"]}
+    },
+    "port": {
+        "name": "Port Town",
+        "population": 2000,
+        "jobs": {"sailor": 0.30, "commoner": 0.20, "merchant": 0.10, "artisan": 0.10,
+                 "innkeeper": 0.04, "guard": 0.05, "criminal": 0.06, "religious": 0.03,
+                 "performer": 0.03, "noble": 0.01, "scholar": 0.02, "adventurer": 0.01},
+        "household": [2, 6],
+        "groups": {"sailor": ["crew", 0.6, [4, 10]], "merchant": ["business", 0.5, [2, 4]],
+                   "criminal": ["crew", 0.6, [3, 6]], "adventurer": ["adventuring", 1.0, [3, 5]]},
+        "crs": {"guard": ["1/2", "2"], "sailor": ["1/8", "1/2"], "criminal": ["1/8", "2"],
+                "adventurer": ["1", "5"]}
+    },
+    "city": {
+        "name": "City",
+        "population": 20000,
+        "jobs": {"commoner": 0.35, "artisan": 0.15, "merchant": 0.12, "innkeeper": 0.03,
+                 "religious": 0.04, "guard": 0.06, "noble": 0.03, "criminal": 0.06,
+                 "performer": 0.04, "scholar": 0.04, "sailor": 0.06, "adventurer": 0.02},
+        "household": [1, 6],
+        "groups": {"artisan": ["business", 0.5, [2, 5]], "merchant": ["business", 0.5, [2, 5]],
+                   "criminal": ["crew", 0.6, [3, 8]], "sailor": ["crew", 0.5, [4, 10]],
+                   "adventurer": ["adventuring", 1.0, [3, 6]], "guard": ["crew", 0.3, [4, 8]]},
+        "crs": {"guard": ["1/2", "3"], "criminal": ["1/8", "3"], "adventurer": ["1", "8"],
+                "noble": ["1/8", "1/2"]}
+    }
+}
+
+
+def load_spec(spec):
+    """
+    Turn a preset name, a JSON file path or a dict into a complete, checked spec.
+    Raises ValueError if anything in it doesn't make sense.
+    """
+    if isinstance(spec, str):
+        if spec in SETTLEMENT_TYPES:
+            spec = {"extends": spec}
+        else:
+            try:
+                with open(spec, 'r') as f:
+                    spec = json.load(f)
+            except (IOError, json.JSONDecodeError) as e:
+                raise ValueError(f"'{spec}' is not a settlement type ({', '.join(SETTLEMENT_TYPES)}) "
+                                 f"or a readable spec file: {e}")
+
+    base = spec.get("extends")
+    if base:
+        if base not in SETTLEMENT_TYPES:
+            raise ValueError(f"Unknown settlement type: {base}")
+        spec = dict(SETTLEMENT_TYPES[base], **{key: value for key, value in spec.items() if key != "extends"})
+    spec = dict({"name": "Settlement", "population": 100, "jobs": {}, "household": [1, 6],
+                 "groups": {}, "crs": {}}, **spec)
+
+    for job in list(spec["jobs"]) + list(spec["groups"]) + list(spec["crs"]):
+        if job not in JOBS:
+            raise ValueError(f"Unknown job category: {job}")
+    total = sum(spec["jobs"].values())
+    if total > 1.0001 or any(share < 0 for share in spec["jobs"].values()):
+        raise ValueError(f"Job shares must be positive and add up to at most 1 (they add up to {total:.2f})")
+    low, high = spec["household"]
+    if not 1 <= low <= high:
+        raise ValueError(f"Bad household size range: {low}-{high}")
+    for job, (group_type, share, (smallest, largest)) in spec["groups"].items():
+        if group_type not in GROUP_TYPES:
+            raise ValueError(f"Unknown group type for {job}: {group_type}")
+        if not 0 <= share <= 1 or not 2 <= smallest <= largest:
+            raise ValueError(f"Bad group settings for {job}: share 0-1, sizes of at least 2")
+    for job, crs in spec["crs"].items():
+        if len(crs) != 2:
+            raise ValueError(f"Challenge ratings for {job} must be [lowest, highest]")
+        for cr in crs:
+            if cr not in CHALLENGE_RATINGS:
+                raise ValueError(f"Unknown challenge rating for {job}: {cr}")
+        low, high = crs
+        if CHALLENGE_RATINGS.index(low) > CHALLENGE_RATINGS.index(high):
+            raise ValueError(f"Bad challenge rating range for {job}: {low}-{high} (lowest first)")
+    if spec["population"] < 1:
+        raise ValueError("Population must be at least 1")
+    return spec
+
+
+def job_counts(jobs, population):
+    """
+    Exact head count per job: shares are rounded with the largest remainder
+    method so the counts always add up to the population. Anyone left
+    over is a commoner.
+    """
+    shares = dict(jobs)
+    shares["commoner"] = shares.get("commoner", 0) + max(0.0, 1 - sum(jobs.values()))
+    exact = {job: share * population for job, share in shares.items()}
+    counts = {job: int(value) for job, value in exact.items()}
+    leftover = population - sum(counts.values())
+    for job in sorted(exact, key=lambda job: exact[job] - counts[job], reverse=True)[:leftover]:
+        counts[job] += 1
+    return {job: count for job, count in counts.items() if count}
+
+
+def cr_range(low, high):
+    """Every CR from low to high inclusive"""
+    return CHALLENGE_RATINGS[CHALLENGE_RATINGS.index(low):CHALLENGE_RATINGS.index(high) + 1]
+
+
+def split_sizes(total, smallest, largest, rng):
+    """Random group sizes between smallest and largest that add up to total"""
+    sizes = []
+    while total > 0:
+        size = min(total, rng.randint(smallest, largest))
+        sizes.append(size)
+        total -= size
+    return sizes
+
+
+def plan_settlement(spec, population=None, rng=None):
+    """
+    Decide who lives where without generating anyone.
+    Yields (group_type, jobs, crs) per household or working group -
+    group_type is None for people who live alone. Only the job pool is
+    held in memory (one short string per person).
+    """
+    rng = rng or random
+    population = population or spec["population"]
+    counts = job_counts(spec["jobs"], population)
+    cr_choices = {job: cr_range(*crs) for job, crs in spec["crs"].items()}
+
+    def cr_for(job):
+        return rng.choice(cr_choices[job]) if job in cr_choices else None
+
+    # Crews, businesses and parties first, from their share of each job
+    for job, (group_type, share, (smallest, largest)) in spec["groups"].items():
+        grouped = round(counts.get(job, 0) * share)
+        if grouped < smallest:
+            continue
+        counts[job] -= grouped
+        for size in split_sizes(grouped, smallest, largest, rng):
+            if size == 1:
+                yield None, [job], [cr_for(job)]
+            else:
+                yield group_type, [job] * size, [cr_for(job) for _ in range(size)]
+
+    # Everyone else lives in families (or alone), with a mix of jobs
+    pool = [job for job, count in counts.items() for _ in range(count)]
+    rng.shuffle(pool)
+    low, high = spec["household"]
+    start = 0
+    while start < len(pool):
+        size = min(rng.randint(low, high), len(pool) - start)
+        jobs = pool[start:start + size]
+        start += size
+        yield ("family" if size > 1 else None), jobs, [cr_for(job) for job in jobs]
+
+
+def generate_settlement(spec, population=None, name_allocator=None, rng=None, lazy_stats=False):
+    """
+    Generate a settlement as a stream of (npc, group_info) pairs, ready for
+    stream_into_collection / add_npcs_to_collection. Groups are generated
+    with generate_group, so families share a surname and species, crews a
+    motivation, and so on. lazy_stats saves only the CR and HP seed of each
+    stat block (see lazy_stat_block).
+    """
+    for group_type, jobs, crs in plan_settlement(spec, population, rng):
+        if group_type is None:
+            yield generate_npc(job_filter=jobs[0], challenge_rating=crs[0], name_allocator=name_allocator,
+                               lazy_stats=lazy_stats), None
+        else:
+            group = generate_group(group_type, len(jobs), name_allocator=name_allocator,
+                                   member_jobs=jobs, member_crs=crs, lazy_stats=lazy_stats)
+            yield None, group
+
+
+def describe_settlement(spec, population=None):
+    """Summary lines for the planned head count per job"""
+    population = population or spec["population"]
+    counts = job_counts(spec["jobs"], population)
+    lines = [f"{spec['name']} of {population:,}"]
+    for job, count in sorted(counts.items(), key=lambda item: -item[1]):
+        crs = spec["crs"].get(job)
+        note = f" (CR {crs[0]}-{crs[1]})" if crs else ""
+        lines.append(f"  {job:<12} {count:>7,}  {count / population:>6.1%}{note}")
+    return lines